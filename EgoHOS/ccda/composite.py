@@ -1,12 +1,11 @@
 from PIL import Image
-import numpy as np 
+import numpy as np
 from skimage.io import imsave
 import glob
-import pdb
-import os 
+import os
+import time
 from tqdm import tqdm
-# from sklearn.metrics.pairwise import cosine_similarity
-from scipy.spatial.distance import cosine
+from multiprocessing import Pool
 import random
 from shutil import copyfile
 import argparse
@@ -24,83 +23,151 @@ parser.add_argument("--lama_dir", default='/mnt/session_space/home/lingzzha/EgoH
 parser.add_argument("--lama_feat_dir", default='/mnt/session_space/home/lingzzha/EgoHOS/data/train/lama_512_feature', type=str)
 parser.add_argument("--aug_img_dir", default='/mnt/session_space/home/lingzzha/EgoHOS/data/train/image_ccda', type=str)
 parser.add_argument("--aug_lbl_dir", default='/mnt/session_space/home/lingzzha/EgoHOS/data/train/label_ccda', type=str)
-args = parser.parse_args()
+parser.add_argument("--block_size", default=1024, type=int, help='queries per matrix multiply of the top-k search')
+parser.add_argument("--workers", default=os.cpu_count(), type=int, help='compositing processes')
+parser.add_argument("--seed", default=0, type=int, help='base seed, query i samples its backgrounds with seed + i')
 
-os.system('rm -rf ' + args.aug_img_dir); os.makedirs(args.aug_img_dir, exist_ok = True)
-os.system('rm -rf ' + args.aug_lbl_dir); os.makedirs(args.aug_lbl_dir, exist_ok = True)
 
-# Load combine features into a list
-fname_list = []
-feature_list = []
-for file in glob.glob(args.lama_feat_dir + '/*'):
-    fname = os.path.basename(file).split('.')[0]
-    feature = np.load(file)
-    # print(feature.shape)
-    feature_list.append(feature)    
-    fname_list.append(fname)
+def image_shape(file):  # (h, w, channels) of an image from its header, without decoding it
+    with Image.open(file) as img:
+        return (img.size[1], img.size[0], len(img.getbands()))
 
 
+def load_features(files):
+    """
+    Stack the LaMa features into one (N, D) float32 matrix with unit rows, so that cosine similarities are dot
+    products. Rows are written in place, no second copy of the features is held.
+    """
+    first = np.load(files[0]).reshape(-1)
+    feats = np.empty((len(files), first.size), dtype=np.float32)
+    feats[0] = first
+    for i, file in enumerate(tqdm(files[1:], desc='features'), 1):
+        feats[i] = np.load(file).reshape(-1)
+    feats /= np.maximum(np.linalg.norm(feats, axis=1, keepdims=True), 1e-12)
+    return feats
 
-# composite images and generate labels
-for file in tqdm(glob.glob(args.lama_feat_dir + '/*')): 
 
-    query_fname = os.path.basename(file).split('.')[0]
-    query_feature = np.load(file)
+def top_k_neighbours(feats, k, block_size=1024):
+    """
+    Indices of the k most cosine-similar rows of every row of feats, itself excluded, most similar first. The
+    similarities are computed block_size queries at a time, as one (block_size, N) matrix multiply each.
+    """
+    n = len(feats)
+    k = min(k, n - 1)
+    neighbours = np.empty((n, k), dtype=np.int64)
+    for start in tqdm(range(0, n, block_size), desc='top-k'):
+        sims = feats[start:start + block_size] @ feats.T
+        rows = np.arange(len(sims))
+        sims[rows, start + rows] = -np.inf  # never pick the query itself
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(sims, top, axis=1), axis=1)
+        neighbours[start:start + block_size] = np.take_along_axis(top, order, axis=1)
+    return neighbours
 
-    score_list = []
-    for feature in feature_list:
-        score = cosine(query_feature, feature)
-        if score != 0.0:
-            score_list.append(score)
 
-    sorted_index_list = np.argsort(np.array(score_list))
-    
-    if args.random_aug:
-        top_k_sorted_index_list = sorted_index_list
+def init_worker(worker_args, worker_fnames, worker_groups):
+    global args, fname_list, shape_groups
+    args, fname_list, shape_groups = worker_args, worker_fnames, worker_groups
+
+
+def composite(task):
+    """
+    Write the aug_numbers composites of one query: the hands and objects of the query pasted onto LaMa backgrounds
+    sampled from its candidates, which all have the shape of the query image. A task names its candidates either
+    directly, as the fitting top-k neighbours, or by the shape group it samples from, excluding the query row when the
+    query's own background is a member.
+    """
+    query_idx, candidates, group, exclude, seed = task
+    query_fname = fname_list[query_idx]
+    rng = random.Random(seed)
+    if args.composite_hr:
+        query_img = np.array(Image.open(os.path.join(args.hr_img_dir, query_fname + '.jpg')))
+        query_lbl = np.array(Image.open(os.path.join(args.hr_lbl_dir, query_fname + '.png')))
     else:
-        top_k_sorted_index_list = sorted_index_list[:args.top_k]
-    
+        query_img = np.array(Image.open(os.path.join(args.img_dir, query_fname + '.jpg')))
+        query_lbl = np.array(Image.open(os.path.join(args.lbl_dir, query_fname + '.png')))
+    query_msk = (query_lbl > 0)[:, :, None]
+
     for aug_idx in range(args.aug_numbers):
-        
-        size_match = False
-        while not size_match:
-            sample_idx = random.randint(0, len(top_k_sorted_index_list)-1)
-            index = top_k_sorted_index_list[sample_idx]
-            select_fname = fname_list[index]
-
-            query_img = np.array(Image.open(os.path.join(args.img_dir, query_fname + '.jpg')))
-            query_lbl = np.array(Image.open(os.path.join(args.lbl_dir, query_fname + '.png')))
-            query_msk = np.zeros((query_lbl.shape)); query_msk[query_lbl>0] = 1
-            query_msk = np.repeat(np.expand_dims(query_msk, 2), 3, 2)
-            select_img = np.array(Image.open(os.path.join(args.lama_dir, select_fname + '.jpg')))
-
-            if query_img.shape == select_img.shape:
-                size_match = True
-        
+        if candidates is not None:
+            select = candidates[rng.randrange(len(candidates))]
+        else:  # any other background of the group
+            members = shape_groups[group]
+            select = members[rng.randrange(len(members) - exclude)]
+            if exclude and select == query_idx:  # swap the query for the member left out of the draw
+                select = members[-1]
+        select_fname = fname_list[select]
+        select_img = Image.open(os.path.join(args.lama_dir, select_fname + '.jpg'))
         if args.composite_hr:
-            hr_query_img = np.array(Image.open(os.path.join(args.hr_img_dir, query_fname + '.jpg')))
-            hr_query_lbl = np.array(Image.open(os.path.join(args.hr_lbl_dir, query_fname + '.png')))
-            hr_query_msk = np.zeros((hr_query_lbl.shape)); hr_query_msk[hr_query_lbl>0] = 1
-            hr_query_msk = np.repeat(np.expand_dims(hr_query_msk, 2), 3, 2)
-            hr_select_img = np.array(Image.open(os.path.join(args.lama_dir, select_fname + '.jpg')).resize((hr_query_img.shape[1], hr_query_img.shape[0])))
-            new_img = hr_query_img * hr_query_msk + hr_select_img * (1 - hr_query_msk)
-        else:
-            new_img = query_img * query_msk + select_img * (1 - query_msk)
-        
-        imsave(os.path.join(args.aug_img_dir, query_fname + '_' + str(aug_idx) + '.jpg'), new_img)
+            select_img = select_img.resize((query_img.shape[1], query_img.shape[0]))
+        new_img = np.where(query_msk, query_img, np.array(select_img))
+
+        imsave(os.path.join(args.aug_img_dir, query_fname + '_' + str(aug_idx) + '.jpg'), new_img, check_contrast=False)
         src_lbl_file = os.path.join(args.lbl_dir, query_fname + '.png')
         dst_lbl_file = os.path.join(args.aug_lbl_dir, query_fname + '_' + str(aug_idx) + '.png')
         copyfile(src_lbl_file, dst_lbl_file)
-    
+
     src_ori_img_file = os.path.join(args.img_dir, query_fname + '.jpg')
     dst_ori_img_file = os.path.join(args.aug_img_dir, query_fname + '.jpg')
     copyfile(src_ori_img_file, dst_ori_img_file)
-    
+
     src_ori_lbl_file = os.path.join(args.lbl_dir, query_fname + '.png')
     dst_ori_lbl_file = os.path.join(args.aug_lbl_dir, query_fname + '.png')
     copyfile(src_ori_lbl_file, dst_ori_lbl_file)
+    return query_fname
+
+
+def main(args):
+    os.system('rm -rf ' + args.aug_img_dir); os.makedirs(args.aug_img_dir, exist_ok = True)
+    os.system('rm -rf ' + args.aug_lbl_dir); os.makedirs(args.aug_lbl_dir, exist_ok = True)
+
+    feat_files = sorted(glob.glob(args.lama_feat_dir + '/*'))
+    fname_list = [os.path.basename(file).split('.')[0] for file in feat_files]
+    t0 = time.time()
+
+    # image shapes are read once from the file headers, a background only fits a query of the same shape
+    with Pool(args.workers) as pool:
+        query_shapes = pool.map(image_shape, [os.path.join(args.img_dir, f + '.jpg') for f in fname_list], 64)
+        lama_shapes = pool.map(image_shape, [os.path.join(args.lama_dir, f + '.jpg') for f in fname_list], 64)
+    lama_shapes = np.array(lama_shapes)
+    query_shapes = np.array(query_shapes)
+
+    # one index array of the backgrounds per shape, the workers sample from them by group id
+    group_shapes, lama_group = np.unique(lama_shapes, axis=0, return_inverse=True)
+    lama_group = lama_group.reshape(-1)
+    shape_groups = [np.flatnonzero(lama_group == g) for g in range(len(group_shapes))]
+    group_of_shape = {tuple(shape): g for g, shape in enumerate(group_shapes.tolist())}
+
+    if args.random_aug:
+        neighbours = None  # any other background of the query shape
+    else:
+        neighbours = top_k_neighbours(load_features(feat_files), args.top_k, args.block_size)
+
+    tasks = []
+    for i, query_fname in enumerate(fname_list):
+        group = group_of_shape.get(tuple(query_shapes[i].tolist()))
+        # the query's own background is in its group when the shapes match, it is never picked
+        exclude = bool(group is not None and lama_group[i] == group)
+        if neighbours is None:
+            candidates = None
+            n_candidates = 0 if group is None else len(shape_groups[group]) - exclude
+        else:
+            candidates = neighbours[i][lama_group[neighbours[i]] == (-1 if group is None else group)]
+            n_candidates = len(candidates)
+        if n_candidates == 0:
+            print('skipping {}: no background of shape {} among its candidates'.format(query_fname, query_shapes[i]))
+            continue
+        tasks.append((i, candidates, group, exclude, args.seed + i))
+    t1 = time.time()
 
+    # composite images and generate labels
+    with Pool(args.workers, init_worker, (args, fname_list, shape_groups)) as pool:
+        for _ in tqdm(pool.imap_unordered(composite, tasks, chunksize=8), total=len(tasks)):
+            pass
+    t2 = time.time()
+    print('index {:.1f}s, compositing {:.1f}s for {} images ({:.1f} images/s)'.format(
+        t1 - t0, t2 - t1, len(tasks), len(tasks) / max(t2 - t1, 1e-9)))
 
 
-    
-    # pdb.set_trace()
\ No newline at end of file
+if __name__ == '__main__':
+    main(parser.parse_args())
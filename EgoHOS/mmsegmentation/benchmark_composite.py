@@ -0,0 +1,84 @@
+import argparse
+import time
+
+import numpy as np
+
+from predict_image import HAND_COLOR, composite_hand_mask
+
+
+def composite_loop(img, seg_result, color=HAND_COLOR):
+    # Reference per-pixel implementation, kept only for comparison
+    res = np.argwhere(seg_result != 0)
+    for ind in res:
+        img[int(ind[0]), int(ind[1])] = np.array(color)
+    return img
+
+
+def synthetic_mask(h, w, coverage, rng):
+    """
+    Build a label map where roughly `coverage` of the pixels belong to a hand. The hand is drawn as a solid
+    blob anchored at the bottom of the frame, which is how hands enter the checkout view.
+    """
+    seg = np.zeros((h, w), dtype=np.int64)
+    if coverage <= 0:
+        return seg
+    area = int(h * w * coverage)
+    bh = min(h, max(1, int(np.sqrt(area * h / w))))
+    bw = min(w, max(1, area // bh))
+    x0 = rng.integers(0, w - bw + 1)
+    seg[h - bh:, x0:x0 + bw] = rng.integers(1, 3)  # left or right hand
+    return seg
+
+
+def timeit(fn, img, seg, repeat):
+    best = float('inf')
+    out = None
+    for _ in range(repeat):
+        frame = img.copy()
+        t = time.perf_counter()
+        out = fn(frame, seg)
+        best = min(best, time.perf_counter() - t)
+    return best, out
+
+
+def main(height, width, coverages, repeat, device):
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    print(f"{'coverage':>9} {'hand px':>9} {'loop ms':>10} {'vector ms':>10} {'speedup':>8}" +
+          (f" {device + ' ms':>10}" if device else ""))
+    for coverage in coverages:
+        seg = synthetic_mask(height, width, coverage, rng)
+        t_loop, ref = timeit(composite_loop, img, seg, repeat)
+        t_vec, out = timeit(composite_hand_mask, img, seg, repeat)
+        assert np.array_equal(ref, out), "vectorized compositing differs from the reference loop"
+        line = f"{coverage:>9.2f} {int((seg != 0).sum()):>9} {t_loop * 1e3:>10.2f} {t_vec * 1e3:>10.2f} " \
+               f"{t_loop / max(t_vec, 1e-9):>7.1f}x"
+        if device:
+            import torch
+            img_t = torch.from_numpy(img).to(device)
+            seg_t = torch.from_numpy(seg).to(device)
+            best = float('inf')
+            for _ in range(repeat):
+                frame = img_t.clone()
+                if frame.is_cuda:
+                    torch.cuda.synchronize()
+                t = time.perf_counter()
+                out_t = composite_hand_mask(frame, seg_t)
+                if frame.is_cuda:
+                    torch.cuda.synchronize()
+                best = min(best, time.perf_counter() - t)
+            assert np.array_equal(ref, out_t.cpu().numpy()), "on-device compositing differs from the reference loop"
+            line += f" {best * 1e3:>10.2f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare per-pixel and vectorized hand-mask compositing")
+    parser.add_argument("--height", default=1080, type=int)
+    parser.add_argument("--width", default=1920, type=int)
+    parser.add_argument("--coverages", nargs='+', default=[0.0, 0.01, 0.05, 0.1, 0.25, 0.5], type=float,
+                        help='fraction of the frame covered by hands')
+    parser.add_argument("--repeat", default=3, type=int)
+    parser.add_argument("--device", default="", type=str, help='also time the torch path on this device, e.g. cuda:0')
+    args = parser.parse_args()
+    main(args.height, args.width, args.coverages, args.repeat, args.device)
@@ -1,6 +1,7 @@
 # Copyright (c) OpenMMLab. All rights reserved.
 import matplotlib.pyplot as plt
 import mmcv
+import numpy as np
 import torch
 from mmcv.parallel import collate, scatter
 from mmcv.runner import load_checkpoint
@@ -67,9 +68,115 @@ class LoadImage:
         return results
 
 
+class SegmentationSession:
+    """Segment images with one loaded segmentor.
+
+    The test pipeline is composed once, and every call collates the given
+    frames into one batch (or batches of ``batch_size``) per forward pass,
+    which suits video callers segmenting several frames at a time. Frames
+    of one batch must have the same shape.
+
+    Args:
+        model (nn.Module): The loaded segmentor.
+        batch_size (int, optional): Frames per forward pass. If left as
+            None, all frames of a call are segmented in one pass.
+    """
+
+    META_KEYS = ('additional_channel', 'twohands_dir', 'cb_dir')
+
+    def __init__(self, model, batch_size=None):
+        self.model = model
+        cfg = model.cfg
+        self.device = next(model.parameters()).device  # model device
+        # build the data pipeline
+        self.pipeline = Compose([LoadImage()] + cfg.data.test.pipeline[1:])
+        # config entries the segmentor reads from the image metas
+        self.extra_metas = {
+            k: cfg[k]
+            for k in self.META_KEYS if k in cfg.keys()
+        }
+        # EncoderDecoder.encode_decode reads it for every model
+        self.extra_metas.setdefault('additional_channel', None)
+        self.batch_size = batch_size
+
+    def collate(self, imgs, metas=None):
+        """Run the test pipeline on every image and collate them into one
+        batch on the model device. ``metas`` holds an extra dict per image
+        that is added to its image metas, e.g. the predictions of an earlier
+        stage of a cascade."""
+        data = collate([self.pipeline(dict(img=img)) for img in imgs],
+                       samples_per_gpu=len(imgs))
+        if self.device.type == 'cuda':
+            # scatter to specified GPU
+            data = scatter(data, [self.device])[0]
+        else:
+            data['img_metas'] = [i.data[0] for i in data['img_metas']]
+        for img_metas in data['img_metas']:
+            for i, img_meta in enumerate(img_metas):
+                img_meta.update(self.extra_metas)
+                if metas is not None:
+                    img_meta.update(metas[i])
+        return data
+
+    def predict(self, imgs, metas=None):
+        """Segment images of the same shape and keep the result on the model
+        device.
+
+        Args:
+            imgs (list[str/ndarray]): Image files or loaded images.
+            metas (list[dict], optional): Extra image metas per image.
+
+        Returns:
+            Tensor: The (N, H, W) label maps.
+        """
+        batch_size = self.batch_size or len(imgs)
+        results = []
+        with torch.no_grad():
+            for i in range(0, len(imgs), batch_size):
+                data = self.collate(
+                    imgs[i:i + batch_size],
+                    None if metas is None else metas[i:i + batch_size])
+                if len(data['img']) == 1:
+                    # no test time augmentation, skip the numpy round trip
+                    seg_logit = self.model.inference(
+                        data['img'][0], data['img_metas'][0], rescale=True)
+                    results.append(seg_logit.argmax(dim=1))
+                else:
+                    seg_pred = self.model(
+                        return_loss=False, rescale=True, **data)
+                    results.append(
+                        torch.from_numpy(np.stack(seg_pred)).to(self.device))
+        return torch.cat(results)
+
+    def __call__(self, imgs):
+        """Segment image(s).
+
+        Args:
+            imgs (str/ndarray or list[str/ndarray]): Either image files or
+                loaded images.
+
+        Returns:
+            (list[ndarray]): The segmentation result of every image.
+        """
+        if not isinstance(imgs, (list, tuple)):
+            imgs = [imgs]
+        batch_size = self.batch_size or len(imgs)
+        results = []
+        # forward the model
+        with torch.no_grad():
+            for i in range(0, len(imgs), batch_size):
+                data = self.collate(imgs[i:i + batch_size])
+                results.extend(
+                    self.model(return_loss=False, rescale=True, **data))
+        return results
+
+
 def inference_segmentor(model, img):
     """Inference image(s) with the segmentor.
 
+    Builds the test pipeline on every call, use a
+    :obj:`SegmentationSession` to segment a stream of images.
+
     Args:
         model (nn.Module): The loaded segmentor.
         imgs (str/ndarray or list[str/ndarray]): Either image files or loaded
@@ -78,32 +185,7 @@ def inference_segmentor(model, img):
     Returns:
         (list[Tensor]): The segmentation result.
     """
-    cfg = model.cfg
-    device = next(model.parameters()).device  # model device
-    # build the data pipeline
-    test_pipeline = [LoadImage()] + cfg.data.test.pipeline[1:]
-    test_pipeline = Compose(test_pipeline)
-    # prepare data
-    data = dict(img=img)
-    data = test_pipeline(data)
-    data = collate([data], samples_per_gpu=1)
-    if next(model.parameters()).is_cuda:
-        # scatter to specified GPU
-        data = scatter(data, [device])[0]
-    else:
-        data['img_metas'] = [i.data[0] for i in data['img_metas']]
-
-    if 'additional_channel' in cfg.keys():
-        data['img_metas'][0][0]['additional_channel'] = cfg['additional_channel']
-    if 'twohands_dir' in cfg.keys():
-        data['img_metas'][0][0]['twohands_dir'] = cfg['twohands_dir']
-    if 'cb_dir' in cfg.keys():
-        data['img_metas'][0][0]['cb_dir'] = cfg['cb_dir']
-    
-    # forward the model
-    with torch.no_grad():
-        result = model(return_loss=False, rescale=True, **data)
-    return result
+    return SegmentationSession(model)(img)
 
 
 def show_result_pyplot(model,
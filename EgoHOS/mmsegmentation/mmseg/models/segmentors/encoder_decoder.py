@@ -79,69 +79,58 @@ class EncoderDecoder(BaseSegmentor):
             x = self.neck(x)
         return x
 
+    def aux_channel(self, img, img_meta, name):
+        """Prediction of an earlier cascade stage ('twohands' or 'cb') as a
+        (1, H, W) input channel of the size of ``img``.
+
+        The label map is taken from ``img_meta[name]`` when the previous stage
+        passed it in memory (see ``predict_image.HandObjectCascade``), else it
+        is read from ``pred_<name>/<image name>.png`` next to the image
+        directory. Either way it is zero padded at the bottom or right to the
+        aspect ratio of ``img`` and resized to it.
+        """
+        img_h, img_w = img.shape[2], img.shape[3]; target_aspect_ratio = img_h / img_w
+        aux = img_meta.get(name)
+        if aux is not None:
+            aux = torch.as_tensor(aux, device=img.device).float()[None, None]
+            aux_h, aux_w = aux.shape[2], aux.shape[3]
+            if aux_h / aux_w < target_aspect_ratio:
+                aux = F.pad(aux, (0, 0, 0, int(target_aspect_ratio * aux_w) - aux_h))
+            else:
+                aux = F.pad(aux, (0, int(aux_h / target_aspect_ratio) - aux_w, 0, 0))
+            # PIL resizes the 8 bit label maps of the files with an antialiased bicubic filter
+            aux = F.interpolate(aux, size=(img_h, img_w), mode='bicubic', align_corners=False, antialias=True)
+            return aux[0].round().clamp(0, 255)
+
+        img_file = img_meta['filename']
+        path = os.path.join(os.path.dirname(os.path.dirname(img_file)), 'pred_' + name)
+        fname = os.path.basename(img_file).split('.')[0] + '.png'
+        aux_file = os.path.join(path, fname)
+
+        aux = Image.open(aux_file); aux_w, aux_h = aux.size[0], aux.size[1]
+        if aux_h / aux_w < target_aspect_ratio:
+            new_aux_h = int(target_aspect_ratio * aux_w)
+            aux = ImageOps.pad(aux, (aux_w, new_aux_h), centering=(0,0))
+        else:
+            new_aux_w = int(aux_h / target_aspect_ratio)
+            aux = ImageOps.pad(aux, (new_aux_w, aux_h), centering=(0,0))
+
+        return torch.from_numpy(np.array(aux.resize((img_w, img_h)))).unsqueeze(0).to(img.device).float()
+
     def encode_decode(self, img, img_metas):
         """Encode images with backbone and decode into a semantic segmentation
         map of the same size as input."""
                 
-        if img_metas[0]['additional_channel'] == 'twohands':
-            
-            img_h, img_w = img.shape[2], img.shape[3]; target_aspect_ratio = img_h / img_w
-            aux_list = torch.zeros((img.shape[0], 1, img.shape[2], img.shape[3])).to(img.device)
-            for i in range(img.shape[0]):
-                img_file = img_metas[i]['filename']
-                # path = img_metas[i]['twohands_dir']
-                path = os.path.join(os.path.dirname(os.path.dirname(img_file)), 'pred_twohands')
-                fname = os.path.basename(img_file).split('.')[0] + '.png'
-                aux_file = os.path.join(path, fname)
-
-                aux = Image.open(aux_file); aux_w, aux_h = aux.size[0], aux.size[1]
-                if aux_h / aux_w < target_aspect_ratio:
-                    new_aux_h = int(target_aspect_ratio * aux_w)
-                    aux = ImageOps.pad(aux, (aux_w, new_aux_h), centering=(0,0))
-                else:
-                    new_aux_w = int(aux_h / target_aspect_ratio)
-                    aux = ImageOps.pad(aux, (new_aux_w, aux_h), centering=(0,0))
-
-                aux = torch.from_numpy(np.array(aux.resize((img_w, img_h)))).unsqueeze(0).to(img[i].device).float()
-                aux_list[i] = aux
-
-            cat_input = torch.cat([img, aux_list], dim = 1)
-            x = self.extract_feat(cat_input)
-
-        elif img_metas[0]['additional_channel'] == 'twohands_cb':
-            
-            img_h, img_w = img.shape[2], img.shape[3]; target_aspect_ratio = img_h / img_w
-            aux_list = torch.zeros((img.shape[0], 1, img.shape[2], img.shape[3])).to(img.device)
-            cb_list = torch.zeros((img.shape[0], 1, img.shape[2], img.shape[3])).to(img.device)
-            for i in range(img.shape[0]):
-                img_file = img_metas[i]['filename']
-                # aux_path = img_metas[i]['twohands_dir']
-                aux_path = os.path.join(os.path.dirname(os.path.dirname(img_file)), 'pred_twohands')
-                # cb_path = img_metas[i]['cb_dir']
-                cb_path = os.path.join(os.path.dirname(os.path.dirname(img_file)), 'pred_cb')
-                fname = os.path.basename(img_file).split('.')[0] + '.png'
-                aux_file = os.path.join(aux_path, fname)
-                cb_file = os.path.join(cb_path, fname)
-
-                aux = Image.open(aux_file); aux_w, aux_h = aux.size[0], aux.size[1]
-                cb = Image.open(cb_file); cb_w, cb_h = cb.size[0], cb.size[1]
-                if aux_h / aux_w < target_aspect_ratio:
-                    new_aux_h = int(target_aspect_ratio * aux_w)
-                    aux = ImageOps.pad(aux, (aux_w, new_aux_h), centering=(0,0))
-                    cb = ImageOps.pad(cb, (aux_w, new_aux_h), centering=(0,0))
-                else:
-                    new_aux_w = int(aux_h / target_aspect_ratio)
-                    aux = ImageOps.pad(aux, (new_aux_w, aux_h), centering=(0,0))
-                    cb = ImageOps.pad(cb, (new_aux_w, aux_h), centering=(0,0))
-
-                aux = torch.from_numpy(np.array(aux.resize((img_w, img_h)))).unsqueeze(0).to(img[i].device).float()
-                aux_list[i] = aux
-                cb = torch.from_numpy(np.array(cb.resize((img_w, img_h)))).unsqueeze(0).to(img[i].device).float()
-                cb_list[i] = cb
-            
-            # print('pdb @ encoder_decoder.py 144'); import pdb; pdb.set_trace()
-            
-            cat_input = torch.cat([img, aux_list, cb_list], dim = 1)
+        additional_channel = img_metas[0]['additional_channel']
+        if additional_channel in ('twohands', 'twohands_cb'):
+            names = ['twohands', 'cb'][:2 if additional_channel == 'twohands_cb' else 1]
+            aux_list = [
+                torch.stack([
+                    self.aux_channel(img, img_meta, name)
+                    for img_meta in img_metas
+                ]) for name in names
+            ]
+            cat_input = torch.cat([img] + aux_list, dim = 1)
             x = self.extract_feat(cat_input)
 
         else:
@@ -368,21 +357,14 @@ class EncoderDecoder(BaseSegmentor):
         return losses
 
     # TODO refactor
-    def slide_inference(self, img, img_meta, rescale):
-        """Inference by sliding-window with overlap.
-
-        If h_crop > h_img or w_crop > w_img, the small patch will be used to
-        decode without padding.
-        """
-
+    def slide_windows(self, h_img, w_img):
+        """Crop boxes (y1, y2, x1, x2) of the sliding windows, all of the
+        same size."""
         h_stride, w_stride = self.test_cfg.stride
         h_crop, w_crop = self.test_cfg.crop_size
-        batch_size, _, h_img, w_img = img.size()
-        num_classes = self.num_classes
         h_grids = max(h_img - h_crop + h_stride - 1, 0) // h_stride + 1
         w_grids = max(w_img - w_crop + w_stride - 1, 0) // w_stride + 1
-        preds = img.new_zeros((batch_size, num_classes, h_img, w_img))
-        count_mat = img.new_zeros((batch_size, 1, h_img, w_img))
+        windows = []
         for h_idx in range(h_grids):
             for w_idx in range(w_grids):
                 y1 = h_idx * h_stride
@@ -391,13 +373,36 @@ class EncoderDecoder(BaseSegmentor):
                 x2 = min(x1 + w_crop, w_img)
                 y1 = max(y2 - h_crop, 0)
                 x1 = max(x2 - w_crop, 0)
+                windows.append((y1, y2, x1, x2))
+        return windows
+
+    def slide_inference(self, img, img_meta, rescale):
+        """Inference by sliding-window with overlap.
+
+        If h_crop > h_img or w_crop > w_img, the small patch will be used to
+        decode without padding.
+
+        With ``test_cfg.slide_batch`` the windows are decoded in batches, see
+        ``batched_slide_logits``.
+        """
+
+        batch_size, _, h_img, w_img = img.size()
+        num_classes = self.num_classes
+        windows = self.slide_windows(h_img, w_img)
+        if self.test_cfg.get('slide_batch', False) and \
+                not torch.onnx.is_in_onnx_export():
+            preds = self.batched_slide_logits(img, img_meta, windows)
+        else:
+            preds = img.new_zeros((batch_size, num_classes, h_img, w_img))
+            for y1, y2, x1, x2 in windows:
                 crop_img = img[:, :, y1:y2, x1:x2]
                 crop_seg_logit = self.encode_decode(crop_img, img_meta)
                 preds += F.pad(crop_seg_logit,
                                (int(x1), int(preds.shape[3] - x2), int(y1),
                                 int(preds.shape[2] - y2)))
-
-                count_mat[:, :, y1:y2, x1:x2] += 1
+        count_mat = img.new_zeros((batch_size, 1, h_img, w_img))
+        for y1, y2, x1, x2 in windows:
+            count_mat[:, :, y1:y2, x1:x2] += 1
         assert (count_mat == 0).sum() == 0
         if torch.onnx.is_in_onnx_export():
             # cast count_mat to constant while exporting to ONNX
@@ -413,6 +418,54 @@ class EncoderDecoder(BaseSegmentor):
                 warning=False)
         return preds
 
+    def batched_slide_logits(self, img, img_meta, windows):
+        """Summed logits of the sliding windows, decoded several windows per
+        forward pass.
+
+        The crops of a chunk of windows are stacked along the batch dimension
+        (window-major, the metas of the images repeated accordingly) and their
+        logits are added into the window region of the output in place, in the
+        order of the windows, so no full size tensor is allocated per window.
+
+        The chunk size is bounded by ``test_cfg.slide_batch`` windows (True for
+        all of them) and, on the GPU, by ``test_cfg.slide_mem_mb``: the memory
+        one window takes is measured on the first chunk of a crop size and
+        batch size, which is decoded alone.
+        """
+        batch_size, _, h_img, w_img = img.size()
+        preds = img.new_zeros((batch_size, self.num_classes, h_img, w_img))
+        max_windows = self.test_cfg.slide_batch
+        max_windows = len(windows) if max_windows is True else max_windows
+        mem_mb = self.test_cfg.get('slide_mem_mb', None)
+        y1, y2, x1, x2 = windows[0]
+        key = (y2 - y1, x2 - x1, batch_size)
+        window_mem = getattr(self, '_slide_window_mem', {})
+        self._slide_window_mem = window_mem
+        measure = mem_mb is not None and img.is_cuda and key not in window_mem
+        start = 0
+        while start < len(windows):
+            chunk = max_windows
+            if measure:
+                chunk = 1
+                base = torch.cuda.memory_allocated(img.device)
+                torch.cuda.reset_peak_memory_stats(img.device)
+            elif mem_mb is not None and img.is_cuda:
+                chunk = min(chunk, max(int(mem_mb * 2**20 // window_mem[key]),
+                                       1))
+            part = windows[start:start + chunk]
+            crops = torch.cat(
+                [img[:, :, y1:y2, x1:x2] for y1, y2, x1, x2 in part])
+            seg_logits = self.encode_decode(crops, img_meta * len(part))
+            for k, (y1, y2, x1, x2) in enumerate(part):
+                preds[:, :, y1:y2, x1:x2] += \
+                    seg_logits[k * batch_size:(k + 1) * batch_size]
+            if measure:
+                window_mem[key] = max(
+                    torch.cuda.max_memory_allocated(img.device) - base, 1)
+                measure = False
+            start += len(part)
+        return preds
+
     def whole_inference(self, img, img_meta, rescale):
         """Inference with full image."""
 
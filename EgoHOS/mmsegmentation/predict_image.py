@@ -1,4 +1,4 @@
-from mmseg.apis import inference_segmentor, init_segmentor
+from mmseg.apis import SegmentationSession, inference_segmentor, init_segmentor
 import os
 import argparse
 from PIL import Image
@@ -6,13 +6,127 @@ import numpy as np
 import cv2
 import sys
 
+HAND_COLOR = (168, 168, 168)  # gray used to paint over hand pixels
+
+
+def composite_hand_mask(img, seg_result, color=HAND_COLOR, inplace=True):
+    """
+    Paint every pixel labelled as hand (non-zero in seg_result) with a flat color, as one array operation.
+    Args:
+        img: (H, W, 3) image. Either a numpy array or a torch tensor, in which case the work stays on its device.
+        seg_result: (H, W) label map of the same type as img (numpy array or tensor).
+        color: the color written over the hand pixels.
+        inplace: write into img directly, otherwise work on a copy and leave img untouched.
+    Return:
+        The composited image.
+    """
+    if not inplace:
+        img = img.copy() if isinstance(img, np.ndarray) else img.clone()
+    if isinstance(img, np.ndarray):
+        img[seg_result != 0] = color
+    else:
+        img[seg_result != 0] = img.new_tensor(color)
+    return img
+
+
+class MaskScheduler:
+    """
+    Decide per frame whether the hand segmentor has to run, or whether the mask of the last segmented (key) frame
+    can be reused. Segmentation runs every `interval` frames, or earlier when the mean absolute difference between the
+    current frame and the key frame (on a downscaled grayscale copy) exceeds `diff_thres`. Frames in between get the
+    key mask as is, or warped to the current frame with dense optical flow when `warp` is set.
+
+    Each refresh that follows reused frames also measures the mask drift: 1 - IoU between the hand pixels of the
+    propagated mask and those of the fresh segmentation.
+    """
+    def __init__(self, segment_fn, interval=1, diff_thres=None, warp=False, scale=0.125):
+        self.segment_fn = segment_fn
+        self.interval = max(int(interval), 1)
+        self.diff_thres = diff_thres
+        self.warp = warp
+        self.scale = scale
+        self.reset()
+
+    def reset(self):  # Call at the start of every video
+        self.mask = None
+        self.key_small = None
+        self.since_key = 0
+        self.frames = 0
+        self.segmented = 0
+        self.skipped = 0
+        self.drifts = []
+
+    def invalidate(self):  # Force a fresh segmentation on the next frame, e.g. when the input region moved
+        self.mask = None
+        self.key_small = None
+
+    def _small(self, img):
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+
+    def _propagate(self, small):
+        if not self.warp or small is None:
+            return self.mask
+        # backward flow: for every pixel of the current frame, where it was in the key frame
+        flow = cv2.calcOpticalFlowFarneback(small, self.key_small, None, 0.5, 2, 9, 2, 5, 1.1, 0)
+        h, w = self.mask.shape
+        flow = cv2.resize(flow, (w, h), interpolation=cv2.INTER_LINEAR) / self.scale
+        grid_x, grid_y = np.meshgrid(np.arange(w, dtype=np.float32), np.arange(h, dtype=np.float32))
+        return cv2.remap(self.mask.astype(np.uint8), grid_x + flow[..., 0], grid_y + flow[..., 1],
+                         cv2.INTER_NEAREST, borderMode=cv2.BORDER_CONSTANT, borderValue=0).astype(self.mask.dtype)
+
+    def __call__(self, img):
+        self.frames += 1
+        self.since_key += 1
+        small = self._small(img) if self.interval > 1 or self.diff_thres is not None else None
+        run = self.mask is None or self.since_key >= self.interval
+        if not run and self.diff_thres is not None:
+            run = float(np.mean(cv2.absdiff(small, self.key_small))) > self.diff_thres
+        if not run:
+            self.skipped += 1
+            return self._propagate(small)
+
+        mask = self.segment_fn(img)
+        if self.mask is not None and self.since_key > 1:  # the previous frames reused a propagated mask
+            prev, cur = self._propagate(small) != 0, mask != 0
+            union = np.count_nonzero(prev | cur)
+            self.drifts.append(1 - np.count_nonzero(prev & cur) / union if union else 0.)
+        self.mask = mask
+        self.key_small = small
+        self.since_key = 0
+        self.segmented += 1
+        return mask
+
+    def stats(self):
+        return {"frames": self.frames,
+                "segmented": self.segmented,
+                "skipped": self.skipped,
+                "mean_drift": float(np.mean(self.drifts)) if self.drifts else 0.,
+                "max_drift": float(np.max(self.drifts)) if self.drifts else 0.}
+
 
 class HandSegmentor:
     def __init__(self, config_file="./work_dirs/seg_twohands_ccda/seg_twohands_ccda.py",
-                 checkpoint_file="./work_dirs/seg_twohands_ccda/best_mIoU_iter_56000.pth"):
-        self.model = init_segmentor(config_file, checkpoint_file, device='cuda:0')
+                 checkpoint_file="./work_dirs/seg_twohands_ccda/best_mIoU_iter_56000.pth",
+                 seg_interval=1, seg_diff_thres=None, seg_warp=False, device='cuda:0', quantize=None):
+        self.model = init_segmentor(config_file, checkpoint_file, device=device)
+        if quantize is not None:
+            # INT8 model from the caller's quantizer, e.g. quantization.quantize_dynamic of yolov8_tracking, so that
+            # the hand segmentor and the ReID model use the same INT8 engine. Quantized models run on the CPU only
+            assert str(device) == 'cpu', 'quantized hand segmentation runs on the CPU, use device="cpu"'
+            self.model = quantize(self.model)
+        self.session = SegmentationSession(self.model)  # test pipeline built once for all frames
+        # seg_interval=1 without a diff threshold segments every frame
+        self.scheduler = MaskScheduler(self.segment, seg_interval, seg_diff_thres, seg_warp)
+        self.last_mask = None  # hand mask applied to the last frame by process_video_frame
+
+    def segment(self, img):  # Run the segmentor on one frame and return the label map
+        return self.session(img)[0]
 
-    def process_video(self, video_dir, out_dir):  # Process the entire video and output the result
+    def segment_batch(self, imgs):  # Label maps of several frames of the same shape, in one forward pass
+        return self.session(imgs)
+
+    def process_video(self, video_dir, out_dir, batch_size=8):  # Process the entire video and output the result
         for filename in os.listdir(video_dir):
             f_path = os.path.join(video_dir, filename)
             vidcap = cv2.VideoCapture(f_path)
@@ -22,29 +136,82 @@ class HandSegmentor:
             count = 1
             alpha = 0.5
             while success:
-                seg_result = inference_segmentor(self.model, image)[0]
-                inv_seg_result = np.where(seg_result == 0, 1, 0)
-                masked_image = (image.transpose() * inv_seg_result.transpose()).transpose()
-                out.write(masked_image.astype(np.uint8))
-                # imsave(os.path.join("/content/output/", str(count) + '.png'), seg_result.astype(np.uint8))
-                if count % 60 == 0:
-                    print("{} second of video {} processed.".format(count//60, filename))
-                count += 1
-                success, image = vidcap.read()
+                # segment batch_size frames per forward pass
+                images = []
+                while success and len(images) < batch_size:
+                    images.append(image)
+                    success, image = vidcap.read()
+                for image, seg_result in zip(images, self.segment_batch(images)):
+                    inv_seg_result = np.where(seg_result == 0, 1, 0)
+                    masked_image = (image.transpose() * inv_seg_result.transpose()).transpose()
+                    out.write(masked_image.astype(np.uint8))
+                    # imsave(os.path.join("/content/output/", str(count) + '.png'), seg_result.astype(np.uint8))
+                    if count % 60 == 0:
+                        print("{} second of video {} processed.".format(count//60, filename))
+                    count += 1
             vidcap.release()
             out.release()
 
-    def process_video_frame(self, img):  # Process one frame and output a tensor/array
-        seg_result = inference_segmentor(self.model, img)[0]
+    def process_video_frame(self, img, inplace=True):  # Process one frame and output a tensor/array
+        seg_result = self.last_mask = self.scheduler(img)
         # inv_seg_result = np.where(seg_result == 0, 1, 0)
         # masked_image = (img.transpose() * inv_seg_result.transpose()).transpose()
-        res = np.argwhere(seg_result != 0)
-        for ind in res:
-            img[int(ind[0]), int(ind[1])] = np.array([168, 168, 168])
-        return img
+        return composite_hand_mask(img, seg_result, inplace=inplace)
         # return masked_image  # (1080, 1920, 3)
 
 
+
+class HandObjectCascade:
+    """
+    The EgoHOS cascade twohands -> contact boundary -> interacting objects, run in memory. Every stage passes its label
+    maps as tensors in the image metas of the next one, which EncoderDecoder uses in place of the pred_twohands /
+    pred_cb files, so no intermediate mask is written to or read from disk.
+    """
+    STAGES = {
+        'twohands': ('seg_twohands_ccda', 56000),
+        'cb': ('twohands_to_cb_ccda', 76000),
+        'obj1': ('twohands_cb_to_obj1_ccda', 34000),
+        'obj2': ('twohands_cb_to_obj2_ccda', 32000),
+    }
+
+    def __init__(self, mode='obj1', work_dir='./work_dirs', batch_size=None, device='cuda:0'):
+        assert mode in ('twohands', 'cb', 'obj1', 'obj2'), f'unknown cascade mode {mode}'
+        names = {'twohands': ['twohands'], 'cb': ['twohands', 'cb']}.get(mode, ['twohands', 'cb', mode])
+        self.sessions = {}
+        for name in names:
+            cfg_name, iters = self.STAGES[name]
+            model = init_segmentor(os.path.join(work_dir, cfg_name, cfg_name + '.py'),
+                                   os.path.join(work_dir, cfg_name, 'best_mIoU_iter_{}.pth'.format(iters)),
+                                   device=device)
+            self.sessions[name] = SegmentationSession(model, batch_size)
+
+    def __call__(self, imgs):
+        """
+        Args:
+            imgs: frames of the same shape, image files or (H, W, 3) BGR arrays.
+        Return:
+            {stage: (N, H, W) label maps on the model device}, one entry per stage of the mode.
+        """
+        results, metas = {}, [{} for _ in imgs]
+        for name, session in self.sessions.items():
+            results[name] = session.predict(imgs, metas if name != 'twohands' else None)
+            for meta, pred in zip(metas, results[name]):
+                meta[name] = pred
+        return results
+
+    @staticmethod
+    def merge(results):
+        """
+        Combine the hands with the objects of an obj1 / obj2 cascade into the label map visualize.py colors: hands
+        keep their labels 1 and 2, object label k becomes k + 2.
+        """
+        merged = results['twohands'].clone()
+        obj = results.get('obj1', results.get('obj2'))
+        if obj is not None:
+            merged[obj != 0] = obj[obj != 0] + 2
+        return merged
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="")
     parser.add_argument("--config_file", default='./work_dirs/seg_twohands_ccda/seg_twohands_ccda.py',
@@ -53,8 +220,9 @@ if __name__ == "__main__":
                         type=str)
     parser.add_argument("--video_dir", default='../../data/test/video', type=str)
     parser.add_argument("--out_dir", default='../../data/test/out', type=str)
+    parser.add_argument("--batch_size", default=8, type=int, help='frames segmented per forward pass')
     args = parser.parse_args()
 
     os.makedirs(args.out_dir, exist_ok=True)
     h = HandSegmentor(args.config_file, args.checkpoint_file)
-    h.process_video(args.video_dir, args.out_dir)
+    h.process_video(args.video_dir, args.out_dir, args.batch_size)
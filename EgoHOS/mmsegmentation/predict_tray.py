@@ -4,9 +4,11 @@ import numpy as np
 
 
 def detect(img, seed=(960, 540)):
-    h, w, _ = img.shape
-    grayscale = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    return detect_gray(cv2.cvtColor(img, cv2.COLOR_RGB2GRAY), seed)
+
 
+def detect_gray(grayscale, seed):
+    h, w = grayscale.shape
     blurred = cv2.GaussianBlur(grayscale, (5, 5), 0)
 
     canny = cv2.Canny(blurred, 20, 35)
@@ -27,6 +29,131 @@ def detect(img, seed=(960, 540)):
     return (rect[0], rect[1]), ((rect[0] + rect[2]), (rect[1] + rect[3]))
 
 
+DEFAULT_TRAY = ((500, 250), (1350, 880))
+
+
+def plausible(box):
+    # Range check of predict_tray, for 1920x1080 frames
+    (x0, y0), (x1, y1) = box
+    return not (x0 < 390 or x0 > 700 or y0 < 200 or y0 > 450 or x1 < 1150 or x1 > 1450 or y1 < 780 or y1 > 1080 or
+                (y1 - y0 > 650))
+
+
+def refine_edges(gray, box, band=12):
+    """
+    Move every edge of box to the strongest gradient within `band` pixels of it, on the full resolution gray image.
+    Only the four strips around the edges are filtered.
+    """
+    h, w = gray.shape
+    (x0, y0), (x1, y1) = box
+    ya, yb = max(y0, 0), min(y1, h)
+    xa, xb = max(x0, 0), min(x1, w)
+    if yb - ya < 2 or xb - xa < 2:
+        return box
+
+    def peak(strip, dx, start):
+        if strip.shape[0] < 3 or strip.shape[1] < 3:
+            return None
+        g = np.abs(cv2.Scharr(strip, cv2.CV_32F, dx, 1 - dx)).sum(axis=1 - dx)
+        return start + int(np.argmax(g))
+
+    edges = []
+    for c, dx in ((x0, 1), (x1, 1), (y0, 0), (y1, 0)):
+        lo, hi = max(c - band, 0), min(c + band + 1, w if dx else h)
+        strip = gray[ya:yb, lo:hi] if dx else gray[lo:hi, xa:xb]
+        p = peak(strip, dx, lo) if hi > lo else None
+        edges.append(c if p is None else p)
+    return (edges[0], edges[2]), (edges[1], edges[3])
+
+
+class TrayTracker:
+    """
+    Continuous tray box estimate of a video, the cheap replacement of running predict_tray on whole frames.
+
+    Detection runs detect() on a copy downscaled by `scale`, the edges of the box are then refined at full resolution
+    near the detected position. A frame is only re-detected when the downscaled frame changed by more than
+    `motion_thres` (mean absolute difference, 0-255) near the border of the current box since the last detection,
+    or when `interval` frames have passed. Accepted boxes are smoothed with an exponential moving average of weight
+    `alpha`. Until the first plausible detection, every frame is detected and the default box is returned.
+    """
+    def __init__(self, scale=0.5, alpha=0.3, motion_thres=4.0, band=24, interval=300, min_interval=5):
+        self.scale = scale
+        self.alpha = alpha
+        self.motion_thres = motion_thres
+        self.band = band
+        self.interval = interval
+        self.min_interval = min_interval
+        self.box = np.array(DEFAULT_TRAY, dtype=np.float64)
+        self.found = False
+        self.ref = None
+        self.since = 0
+        self.frames = self.detections = self.accepted = 0
+
+    @property
+    def tray(self):
+        (x0, y0), (x1, y1) = np.round(self.box).astype(int).tolist()
+        return (x0, y0), (x1, y1)
+
+    def reset(self):  # Call at the start of every video, the next frame is detected again
+        self.ref = None
+
+    def _ring(self, shape):
+        # Mask of the band around the border of the current box, in downscaled pixels
+        b = max(int(self.band * self.scale), 1)
+        (x0, y0), (x1, y1) = (np.round(self.box * self.scale).astype(int)).tolist()
+        mask = np.zeros(shape, dtype=bool)
+        mask[max(y0 - b, 0):y1 + b, max(x0 - b, 0):x1 + b] = True
+        mask[y0 + b:max(y1 - b, y0 + b), x0 + b:max(x1 - b, x0 + b)] = False
+        return mask
+
+    def _moved(self, small):
+        if self.ref is None or not self.found:
+            return True
+        ring = self._ring(small.shape)
+        return ring.any() and float(cv2.absdiff(small, self.ref)[ring].mean()) > self.motion_thres
+
+    def detect(self, gray, small):
+        # predict_tray with its two seeds on the downscaled frame, the box refined on the full one
+        h, w = small.shape
+        for seed in ((w // 2, h // 2), (w // 2 - int(50 * self.scale), h // 2 - int(50 * self.scale))):
+            (x0, y0), (x1, y1) = detect_gray(small, seed)
+            box = (int(x0 / self.scale), int(y0 / self.scale)), (int(x1 / self.scale), int(y1 / self.scale))
+            if plausible(box):
+                box = refine_edges(gray, box, int(np.ceil(1 / self.scale)) + 2)
+                if plausible(box):
+                    return box
+        return None
+
+    def __call__(self, img):
+        """
+        Return:
+            The tray box ((x0, y0), (x1, y1)) and whether it comes from a detection, as predict_tray.
+        """
+        if img is None:
+            return self.tray, self.found
+        self.frames += 1
+        self.since += 1
+        gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+        small = cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        due = self.since >= self.interval or (self.since >= self.min_interval and self._moved(small))
+        if self.found and not due and self.ref is not None:
+            return self.tray, True
+
+        self.detections += 1
+        self.since = 0
+        self.ref = small
+        box = self.detect(gray, small)
+        if box is not None:
+            self.accepted += 1
+            box = np.array(box, dtype=np.float64)
+            self.box = box if not self.found else self.alpha * box + (1 - self.alpha) * self.box
+            self.found = True
+        return self.tray, self.found
+
+    def stats(self):
+        return {"frames": self.frames, "detections": self.detections, "accepted": self.accepted}
+
+
 def detect_video(path):
     cap = cv2.VideoCapture(path)
     while cap.isOpened():
@@ -68,21 +195,21 @@ def predict_tray(img):
             True represents that the bbox is predicted.
     """
     if img is None:
-        return (500, 250), (1350, 880), False
+        return DEFAULT_TRAY[0], DEFAULT_TRAY[1], False
     h, w, _ = img.shape
     seed = (int(w / 2), int(h / 2))
     (x0, y0), (x1, y1) = detect(img, seed=seed)
 
-    if x0 < 390 or x0 > 700 or y0 < 200 or y0 > 450 or x1 < 1150 or x1 > 1450 or y1 < 780 or y1 > 1080 or (y1-y0 > 650):
+    if not plausible(((x0, y0), (x1, y1))):
         # a re-detect is needed
         seed = (seed[0] - 50, seed[1] - 50)
         (x0, y0), (x1, y1) = detect(img, seed=seed)
     else:
         return (x0, y0), (x1, y1), True
 
-    if x0 < 390 or x0 > 700 or y0 < 200 or y0 > 450 or x1 < 1150 or x1 > 1450 or y1 < 780 or y1 > 1080 or (y1-y0 > 650):
+    if not plausible(((x0, y0), (x1, y1))):
         # detect fail, wait for next
-        (x0, y0), (x1, y1) = (500, 250), (1350, 880)
+        (x0, y0), (x1, y1) = DEFAULT_TRAY
     else:
         return (x0, y0), (x1, y1), True
 
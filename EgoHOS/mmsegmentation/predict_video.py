@@ -0,0 +1,58 @@
+from predict_image import HandObjectCascade
+from visualize import visualize_twohands_obj1, visualize_twohands_obj2
+from PIL import Image
+import numpy as np
+import argparse
+import cv2
+import os
+
+
+def str2bool(v):
+    return str(v).lower() in ('true', '1', 'yes')
+
+
+def save_masks(mask_dir, count, results):  # Label maps of one frame as pred_<stage>/<frame>.png, like predict_image.py
+    for name, pred in results.items():
+        os.makedirs(os.path.join(mask_dir, 'pred_' + name), exist_ok=True)
+        Image.fromarray(pred.astype(np.uint8)).save(os.path.join(mask_dir, 'pred_' + name, '{:06d}.png'.format(count)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="")
+    parser.add_argument("--mode", default='obj1', type=str, help='options: obj1, obj2')
+    parser.add_argument("--input_video_file", default='../testvideos/testvideo1_short.mp4', type=str)
+    parser.add_argument("--output_video_file", default='../testvideos/testvideo1_short_result.mp4', type=str)
+    parser.add_argument("--remove_intermediate_images", default=True, type=str2bool,
+                        help='True: save only the processed video; False: also save the label maps of every stage')
+    parser.add_argument("--work_dir", default='./work_dirs', type=str)
+    parser.add_argument("--batch_size", default=8, type=int, help='frames segmented per forward pass')
+    parser.add_argument("--device", default='cuda:0', type=str)
+    args = parser.parse_args()
+
+    visualize = {'obj1': visualize_twohands_obj1, 'obj2': visualize_twohands_obj2}[args.mode]
+    cascade = HandObjectCascade(args.mode, args.work_dir, device=args.device)
+    mask_dir = os.path.splitext(args.output_video_file)[0]
+
+    vidcap = cv2.VideoCapture(args.input_video_file)
+    width, height, fps = int(vidcap.get(3)), int(vidcap.get(4)), vidcap.get(5)
+    out = cv2.VideoWriter(args.output_video_file, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    success, image = vidcap.read()
+    count = 0
+    while success:
+        # the stages pass their masks in memory, batch_size frames per forward pass
+        images = []
+        while success and len(images) < args.batch_size:
+            images.append(image)
+            success, image = vidcap.read()
+        results = cascade(images)
+        merged = HandObjectCascade.merge(results).cpu().numpy()
+        results = {name: pred.cpu().numpy() for name, pred in results.items()}
+        for i, frame in enumerate(images):  # image already holds the first frame of the next batch
+            vis = visualize(frame[:, :, ::-1], merged[i])  # visualize.py colors RGB images
+            out.write(np.clip(vis, 0, 255).astype(np.uint8)[:, :, ::-1].copy())
+            if not args.remove_intermediate_images:
+                save_masks(mask_dir, count, {name: pred[i] for name, pred in results.items()})
+            count += 1
+        print("{} frames of {} processed.".format(count, args.input_video_file))
+    vidcap.release()
+    out.release()
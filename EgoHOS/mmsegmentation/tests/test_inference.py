@@ -2,11 +2,13 @@
 import os.path as osp
 
 import mmcv
+import numpy as np
 
-from mmseg.apis import inference_segmentor, init_segmentor
+from mmseg.apis import (SegmentationSession, inference_segmentor,
+                        init_segmentor)
 
 
-def test_test_time_augmentation_on_cpu():
+def _pspnet_config():
     config_file = 'configs/pspnet/pspnet_r50-d8_512x1024_40k_cityscapes.py'
     config = mmcv.Config.fromfile(config_file)
 
@@ -17,6 +19,11 @@ def test_test_time_augmentation_on_cpu():
     config.model.backbone.norm_cfg = norm_cfg
     config.model.decode_head.norm_cfg = norm_cfg
     config.model.auxiliary_head.norm_cfg = norm_cfg
+    return config
+
+
+def test_test_time_augmentation_on_cpu():
+    config = _pspnet_config()
 
     # Enable test time augmentation
     config.data.test.pipeline[1].flip = True
@@ -28,3 +35,19 @@ def test_test_time_augmentation_on_cpu():
         osp.join(osp.dirname(__file__), 'data/color.jpg'), 'color')
     result = inference_segmentor(model, img)
     assert result[0].shape == (288, 512)
+
+
+def test_segmentation_session_on_cpu():
+    model = init_segmentor(_pspnet_config(), None, device='cpu')
+    rng = np.random.RandomState(0)
+    frames = [rng.randint(0, 256, (64, 96, 3), dtype=np.uint8) for _ in range(3)]
+
+    refs = [inference_segmentor(model, frame)[0] for frame in frames]
+    for batch_size in (None, 2):
+        session = SegmentationSession(model, batch_size=batch_size)
+        results = session(frames)
+        assert len(results) == 3
+        for result, ref in zip(results, refs):
+            assert result.shape == (64, 96)
+            assert (result == ref).mean() > 0.99
+    assert session(frames[0])[0].shape == (64, 96)
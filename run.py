@@ -1,20 +1,100 @@
 import argparse
 import os
+import sys
+from multiprocessing import get_context
+from pathlib import Path
 
+TRACKING_ROOT = Path(__file__).resolve().parent / "yolov8_tracking"
+DEBLUR_PATH = "/content/AICityChallenge/NAFNet/experiments/pretrained_models/NAFNet-REDS-width64.pth"
+
+# Per-process state of the batch runner, models are loaded by the first video a process handles
+_track = None
+_models = None
+
+
+def track_args(f, save_dir, weights, extra=()):
+    # The same options the per-video `python yolov8_tracking/track.py ...` call used
+    return ["--yolo-weights", weights, "--tracking-method", "strongsort", "--source", f, "--save-vid",
+            "--imgsz", "960", "--deblur-path", DEBLUR_PATH, "--result-dir", save_dir, *extra]
+
+
+def init_worker(core_queue):
+    # Pin this worker process to its own set of CPU cores
+    cores = core_queue.get()
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+
+def process_video(f, part_dir, weights, extra):
+    """
+    Track one video in this process, reusing the models loaded for the previous one. The result lines are written
+    to a result.txt of its own and returned, so the caller can append them to the shared file in video order.
+    """
+    global _track, _models
+    if _track is None:
+        sys.path.insert(0, str(TRACKING_ROOT))
+        import track
+        _track = track
+    os.makedirs(part_dir, exist_ok=True)
+    part = os.path.join(part_dir, "result.txt")
+    if os.path.exists(part):
+        os.remove(part)
+    opt = _track.parse_opt(track_args(f, part_dir, weights, extra))
+    if _models is None:
+        _models = _track.load_models(**vars(opt))
+    try:
+        _track.run(**vars(opt), models=_models)
+    except Exception as e:  # like a failed subprocess, one bad video must not stop the batch
+        print("Tracking {} failed: {}".format(f, e))
+    if not os.path.exists(part):
+        return ""
+    with open(part) as fd:
+        return fd.read()
+
+
+def process_job(job):
+    return process_video(*job)
+
+
+def split_cores(workers):
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+    if not cores:
+        return [None] * workers
+    n = max(len(cores) // workers, 1)
+    return [set(cores[(i * n) % len(cores):(i * n) % len(cores) + n]) for i in range(workers)]
+
+
+def main(img_dir, save_dir, weights, workers=1, extra=()):
+    videos = [os.path.join(img_dir, filename) for filename in os.listdir(img_dir)]
+    videos = [f for f in videos if "gitkeep" not in f]  # checking if it is a file
+    parts = [os.path.join(save_dir, ".parts", Path(f).stem) for f in videos]
+    jobs = [(f, part, weights, tuple(extra)) for f, part in zip(videos, parts)]
+    result_save = os.path.join(save_dir, "result.txt")
+
+    if workers <= 1:
+        for job in jobs:
+            lines = process_video(*job)
+            with open(result_save, "a") as fd:
+                fd.write(lines)
+        return
+
+    ctx = get_context("spawn")  # CUDA cannot be re-initialised in a forked child
+    core_queue = ctx.Queue()
+    for cores in split_cores(workers):
+        core_queue.put(cores)
+    with ctx.Pool(workers, initializer=init_worker, initargs=(core_queue,)) as pool:
+        # imap yields in input order, so result.txt lists videos in the same order as a serial run
+        for lines in pool.imap(process_job, jobs):
+            with open(result_save, "a") as fd:
+                fd.write(lines)
 
-def main(img_dir, save_dir, weights):
-    for filename in os.listdir(img_dir):
-        f = os.path.join(img_dir, filename)
-        # checking if it is a file
-        if "gitkeep" not in f:
-            os.system("python yolov8_tracking/track.py --yolo-weights " + weights
-                      + " --tracking-method strongsort --source " + f +
-                      " --save-vid --imgsz 960 --deblur-path \"/content/AICityChallenge/NAFNet/experiments/pretrained_models/NAFNet-REDS-width64.pth\" --result-dir " + save_dir)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="")
     parser.add_argument("--img_dir", default="data/test/video", type=str)
     parser.add_argument("--save_dir", default="data/test/out", type=str)
     parser.add_argument("--weights", default="yolov8_tracking/weights/bestl-100.pt", type=str, required=True)
-    args = parser.parse_args()
-    main(args.img_dir, args.save_dir, args.weights)
+    parser.add_argument("--workers", default=1, type=int,
+                        help="worker processes, each loads the models once and is pinned to its own CPU cores")
+    args, extra = parser.parse_known_args()  # anything else is passed on to track.py
+    main(args.img_dir, args.save_dir, args.weights, args.workers, extra)
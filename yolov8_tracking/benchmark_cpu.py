@@ -0,0 +1,149 @@
+"""
+Accuracy vs latency report of the CPU deployment profile on a sample video.
+
+Every model of the pipeline runs on the CPU, the INT8 variants are compared with their FP32 models on the same inputs:
+    YOLO    FP32 latency per frame
+    ReID    FP32 / dynamic / static INT8 latency per batch of crops, cosine similarity to the FP32 embeddings and
+            agreement of the nearest neighbour between crops
+    EgoHOS  FP32 / dynamic INT8 latency per frame, IoU of the hand masks with the FP32 masks
+    NAFNet  FP32 latency per frame (whole frame and tray ROI)
+The report is printed and written as markdown.
+
+No measured report is checked in: the YOLO, OSNet, EgoHOS and NAFNet weights and the sample checkout video are not
+part of this repository, so the report has to be generated on a box that has them, with the command below.
+
+Usage:
+
+    $ python benchmark_cpu.py --source sample.mp4 --frames 20 --cpu-threads 4 --report runs/cpu_profile.md
+"""
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[0]
+WEIGHTS = ROOT / 'weights'
+
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+if str(ROOT / 'yolov8') not in sys.path:
+    sys.path.append(str(ROOT / 'yolov8'))  # add yolov8 ROOT to PATH
+if str(ROOT / 'trackers' / 'strongsort') not in sys.path:
+    sys.path.append(str(ROOT / 'trackers' / 'strongsort'))  # add strong_sort ROOT to PATH
+
+from yolov8.ultralytics.nn.autobackend import AutoBackend
+from yolov8.ultralytics.yolo.data.dataloaders.stream_loaders import LoadImages
+from yolov8.ultralytics.yolo.utils.torch_utils import select_device
+from quantization import calibration_crops, quantize_dynamic
+from track import load_reid
+import EgoHOS.mmsegmentation.predict_image as handseg
+
+
+def timeit(fn, repeat):
+    # Median seconds per call and the last output
+    times, out = [], None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        out = fn()
+        times.append(time.perf_counter() - t)
+    return float(np.median(times)), out
+
+
+def frames_of(source, n):
+    # n frames spread over the video
+    cap = cv2.VideoCapture(str(source))
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    frames = []
+    for idx in np.linspace(0, max(total - 1, 0), n).astype(int):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+        ok, im = cap.read()
+        if ok:
+            frames.append(im)
+    cap.release()
+    return frames
+
+
+@torch.no_grad()
+def main(opt):
+    torch.set_num_threads(opt.cpu_threads)  # importing track.py limits the libraries to one thread
+    device = select_device('cpu')
+    frames = frames_of(opt.source, opt.frames)
+    assert frames, f'could not read frames from {opt.source}'
+    rows = []  # (model, variant, latency ms, unit, accuracy)
+
+    # YOLO
+    yolo = AutoBackend(opt.yolo_weights, device=device)
+    h, w = opt.imgsz
+    im = torch.zeros(1, 3, h, w)
+    t, _ = timeit(lambda: yolo(im), opt.repeat)
+    rows.append(('YOLO', 'fp32', t, 'frame', '-'))
+
+    # ReID, crops of other frames than the calibration ones
+    crops = calibration_crops(opt.source, opt.crops, seed=1)
+    fp32 = load_reid(opt.reid_weights, device)
+    ref = torch.nn.functional.normalize(fp32(crops).float(), dim=1)
+    ref_nn = (ref @ ref.T).fill_diagonal_(-1).argmax(1)
+    t, _ = timeit(lambda: fp32(crops), opt.repeat)
+    rows.append(('OSNet ReID', 'fp32', t, f'{len(crops)} crops', 'reference'))
+    for mode in ('dynamic', 'static'):
+        int8 = load_reid(opt.reid_weights, device, reid_quant=mode, source=opt.source, quant_calib=opt.calib)
+        t, f = timeit(lambda: int8(crops), opt.repeat)
+        f = torch.nn.functional.normalize(f.float(), dim=1)
+        cos = (f * ref).sum(1)
+        agree = ((f @ f.T).fill_diagonal_(-1).argmax(1) == ref_nn).float().mean()
+        rows.append(('OSNet ReID', f'int8 {mode}', t, f'{len(crops)} crops',
+                     f'cos mean {cos.mean():.4f} min {cos.min():.4f}, nn agreement {agree:.3f}'))
+
+    # NAFNet and the hand segmentor, loaded the way LoadImages loads them
+    nafnet, seg = LoadImages.load_models(opt.deblur_path, device='cpu')
+    loader = LoadImages.__new__(LoadImages)  # for deblur_frame, which only needs the NAFNet model
+    loader.NAFNet = nafnet
+    t, _ = timeit(lambda: loader.deblur_frame(frames[0].copy()), max(opt.repeat // 2, 1))
+    rows.append(('NAFNet', 'fp32', t, 'frame', '-'))
+    roi = (slice(150, 980), slice(400, 1450))  # default tray box plus the default --roi-margin
+    t, _ = timeit(lambda: loader.deblur_frame(frames[0].copy(), roi), opt.repeat)
+    rows.append(('NAFNet', 'fp32', t, 'tray ROI', '-'))
+
+    masks = [seg.segment(im) for im in frames]
+    t, _ = timeit(lambda: seg.segment(frames[0]), opt.repeat)
+    rows.append(('EgoHOS', 'fp32', t, 'frame', 'reference'))
+    int8 = quantize_dynamic(seg.model)
+    t, _ = timeit(lambda: handseg.inference_segmentor(int8, frames[0])[0], opt.repeat)
+    ious = []
+    for im, ref_mask in zip(frames, masks):
+        a, b = handseg.inference_segmentor(int8, im)[0] != 0, ref_mask != 0
+        union = np.count_nonzero(a | b)
+        ious.append(np.count_nonzero(a & b) / union if union else 1.)
+    rows.append(('EgoHOS', 'int8 dynamic', t, 'frame', f'hand IoU mean {np.mean(ious):.4f} min {np.min(ious):.4f}'))
+
+    lines = [f'# CPU profile, {opt.source}, {len(frames)} frames, {torch.get_num_threads()} threads', '',
+             '| model | variant | latency ms | per | accuracy vs fp32 |', '|---|---|---|---|---|']
+    lines += [f'| {m} | {v} | {t * 1e3:.1f} | {u} | {a} |' for m, v, t, u, a in rows]
+    report = '\n'.join(lines) + '\n'
+    print(report)
+    if opt.report:
+        Path(opt.report).parent.mkdir(parents=True, exist_ok=True)
+        Path(opt.report).write_text(report)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Accuracy vs latency of the CPU and INT8 models")
+    parser.add_argument('--source', type=str, required=True, help='sample video')
+    parser.add_argument('--yolo-weights', type=Path, default=WEIGHTS / 'yolov8s-seg.pt')
+    parser.add_argument('--reid-weights', type=Path, default=WEIGHTS / 'osnet_x0_25_msmt17.pt')
+    parser.add_argument('--deblur-path', type=str, default='', help='NAFNet weights')
+    parser.add_argument('--imgsz', nargs=2, type=int, default=[1088, 1920], help='YOLO input h, w')
+    parser.add_argument('--frames', type=int, default=20, help='frames spread over the video for EgoHOS')
+    parser.add_argument('--crops', type=int, default=128, help='ReID crops')
+    parser.add_argument('--calib', type=int, default=256, help='crops to calibrate the static ReID quantization')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--cpu-threads', type=int, default=os.cpu_count(), help='torch threads, as --cpu-threads of track.py')
+    parser.add_argument('--report', type=str, default='', help='write the markdown report here')
+    main(parser.parse_args())
@@ -0,0 +1,103 @@
+"""
+Compare one KalmanFilterNew per OC-SORT track with the batched BatchKalmanFilter.
+
+Every frame predicts all tracks and updates them with a jittered box, some tracks miss a few frames so that the
+freeze / re-update path runs too. Both filters must end up in the same state.
+
+Usage:
+
+    $ python benchmark_kalman.py --tracks 10 100 1000 --frames 100
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[0]
+
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+if str(ROOT / 'yolov8') not in sys.path:
+    sys.path.append(str(ROOT / 'yolov8'))  # add yolov8 ROOT to PATH
+
+from trackers.ocsort.batch_kalman import F, H, P0, Q, R, BatchKalmanFilter
+from trackers.ocsort.kalmanfilter import KalmanFilterNew
+
+
+def per_track_filter(z):
+    # The filter KalmanBoxTracker used to build for every track
+    kf = KalmanFilterNew(dim_x=7, dim_z=4)
+    kf.F, kf.H, kf.R, kf.P, kf.Q = F.copy(), H.copy(), R.copy(), P0.copy(), Q.copy()
+    kf.x[:4] = z.reshape((4, 1))
+    return kf
+
+
+def observations(n, frames, miss, rng):
+    # (frames, n, 4) [x, y, s, r] observations of boxes moving at constant speed, nan where a track is missed
+    xy = rng.uniform(0, 1000, (n, 2))
+    v = rng.uniform(-5, 5, (n, 2))
+    wh = rng.uniform(40, 300, (n, 2))
+    t = np.arange(1, frames + 1)[:, None, None]
+    pos = xy[None] + v[None] * t + rng.normal(0, 1, (frames, n, 2))
+    z = np.concatenate([pos, (wh[:, 0] * wh[:, 1])[None, :, None].repeat(frames, 0),
+                        (wh[:, 0] / wh[:, 1])[None, :, None].repeat(frames, 0)], axis=2)
+    missed = rng.random((frames, n)) < miss
+    missed[0] = False
+    z[missed] = np.nan
+    return z
+
+
+def run_per_track(z0, zs):
+    kfs = [per_track_filter(z) for z in z0]
+    for z in zs:
+        for kf, zi in zip(kfs, z):
+            if (kf.x[6] + kf.x[2]) <= 0:
+                kf.x[6] *= 0.0
+            kf.predict()
+            kf.update(None if np.isnan(zi[0]) else zi.reshape((4, 1)))
+    return np.stack([kf.x[:, 0] for kf in kfs])
+
+
+def run_batched(z0, zs):
+    kf = BatchKalmanFilter()
+    slots = [kf.add(z) for z in z0]
+    for z in zs:
+        kf.predict(slots)
+        for slot, zi in zip(slots, z):
+            kf.update(slot, None if np.isnan(zi[0]) else zi)
+        kf.flush()
+    return kf.x[slots]
+
+
+def main(tracks, frames, miss, repeat):
+    rng = np.random.default_rng(0)
+    print(f"{'tracks':>7} {'per track ms':>13} {'batched ms':>11} {'speedup':>8} {'max rel err':>12}")
+    for n in tracks:
+        z = observations(n, frames + 1, miss, rng)
+        times = {}
+        for name, fn in (('per_track', run_per_track), ('batched', run_batched)):
+            best = float('inf')
+            for _ in range(repeat):
+                t = time.perf_counter()
+                x = fn(z[0], z[1:])
+                best = min(best, time.perf_counter() - t)
+            times[name] = (best / frames, x)
+        ref, out = times['per_track'][1], times['batched'][1]
+        err = np.nanmax(np.abs(ref - out) / np.maximum(np.abs(ref), 1))
+        print(f"{n:>7} {times['per_track'][0] * 1e3:>13.3f} {times['batched'][0] * 1e3:>11.3f} "
+              f"{times['per_track'][0] / max(times['batched'][0], 1e-9):>7.1f}x {err:>12.2e}")
+        assert err < 1e-6, "batched filter state differs from the per-track filters"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare per-track and batched OC-SORT Kalman filters")
+    parser.add_argument('--tracks', nargs='+', default=[10, 100, 1000], type=int, help='concurrent tracks')
+    parser.add_argument('--frames', default=100, type=int)
+    parser.add_argument('--miss', default=0.1, type=float, help='probability that a track is not observed')
+    parser.add_argument('--repeat', default=3, type=int)
+    args = parser.parse_args()
+    main(args.tracks, args.frames, args.miss, args.repeat)
@@ -0,0 +1,64 @@
+"""
+Latency of NAFNet through the BasicSR model LoadImages used to load, and through NAFNetRuntime on exported models.
+
+Every exported model must restore the tray ROI of the sample frames to within one grey level of the BasicSR model.
+
+Usage:
+
+    $ python export_nafnet.py --weights NAFNet-REDS-width64.pth --include onnx torchscript
+    $ python benchmark_nafnet.py --source sample.mp4 --deblur-path NAFNet-REDS-width64.pth \
+        --exports weights/NAFNet-REDS-width64_dynamic.onnx weights/NAFNet-REDS-width64_dynamic.torchscript
+"""
+
+import argparse
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import torch
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[0]
+
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+if str(ROOT / 'yolov8') not in sys.path:
+    sys.path.append(str(ROOT / 'yolov8'))  # add yolov8 ROOT to PATH
+
+from yolov8.ultralytics.yolo.data.dataloaders.stream_loaders import LoadImages
+from benchmark_cpu import frames_of, timeit
+from nafnet_runtime import NAFNetRuntime
+
+
+@torch.no_grad()
+def main(opt):
+    torch.set_num_threads(opt.cpu_threads)
+    frames = frames_of(opt.source, opt.frames)
+    assert frames, f'could not read frames from {opt.source}'
+    roi = (slice(150, 980), slice(400, 1450))  # default tray box plus the default --roi-margin
+    crops = [np.ascontiguousarray(im[roi]) for im in frames]
+
+    loader = LoadImages.__new__(LoadImages)  # for restore(), which only needs the NAFNet model
+    loader.NAFNet = LoadImages.load_nafnet(opt.deblur_path, cpu=True)
+    refs = [loader.restore(im) for im in crops]
+    t, _ = timeit(lambda: loader.restore(crops[0]), opt.repeat)
+    print(f"{'model':<60} {'ms':>8} {'max diff':>9}")
+    print(f"{'BasicSR eager':<60} {t * 1e3:>8.1f} {'-':>9}")
+    for file in opt.exports:
+        runtime = NAFNetRuntime(file, threads=opt.cpu_threads)
+        diff = max(int(np.abs(ref.astype(np.int16) - runtime(im)).max()) for im, ref in zip(crops, refs))
+        t, _ = timeit(lambda: runtime(crops[0]), opt.repeat)
+        print(f'{Path(file).name:<60} {t * 1e3:>8.1f} {diff:>9}')
+        assert diff <= 1, f'{file} differs from the BasicSR model'
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency of the eager and exported NAFNet on the CPU")
+    parser.add_argument('--source', type=str, required=True, help='sample video')
+    parser.add_argument('--deblur-path', type=str, required=True, help='NAFNet checkpoint the exports were made from')
+    parser.add_argument('--exports', nargs='+', default=[], help='.onnx / .torchscript files of export_nafnet.py')
+    parser.add_argument('--frames', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--cpu-threads', type=int, default=os.cpu_count())
+    main(parser.parse_args())
@@ -0,0 +1,81 @@
+"""
+Compare the per-crop PIL preprocessing of the StrongSORT ReID model with the batched roi_align path.
+
+Usage:
+
+    $ python benchmark_reid.py --reid-weights weights/osnet_x0_25_msmt17.pt --boxes 1 8 32 --device cpu
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[0]
+WEIGHTS = ROOT / 'weights'
+
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+if str(ROOT / 'yolov8') not in sys.path:
+    sys.path.append(str(ROOT / 'yolov8'))  # add yolov8 ROOT to PATH
+if str(ROOT / 'trackers' / 'strongsort') not in sys.path:
+    sys.path.append(str(ROOT / 'trackers' / 'strongsort'))  # add strong_sort ROOT to PATH
+
+from yolov8.ultralytics.yolo.utils.torch_utils import select_device
+from trackers.strongsort.reid_multibackend import ReIDDetectMultiBackend
+
+
+def synthetic_boxes(n, height, width, rng):
+    # Product sized xyxy integer boxes, the bounds StrongSORT._get_features computes
+    w = rng.integers(40, 400, n)
+    h = rng.integers(40, 400, n)
+    x1 = rng.integers(0, width - w)
+    y1 = rng.integers(0, height - h)
+    return np.stack([x1, y1, x1 + w, y1 + h], 1)
+
+
+def timeit(fn, repeat):
+    best = float('inf')
+    out = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t)
+    return best, out
+
+
+@torch.no_grad()
+def main(reid_weights, device, height, width, n_boxes, repeat):
+    device = select_device(device)
+    model = ReIDDetectMultiBackend(weights=reid_weights, device=device, fp16=False)
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    img = np.ascontiguousarray(np.repeat(np.repeat(img[::8, ::8], 8, 0), 8, 1)[:height, :width])  # some structure
+    print(f"{'boxes':>6} {'crop ms':>9} {'batched ms':>11} {'speedup':>8} {'forward ms':>11} "
+          f"{'max |dx|':>9} {'min cos':>8}")
+    for n in n_boxes:
+        xyxy = synthetic_boxes(n, height, width, rng)
+        crops = [img[y1:y2, x1:x2] for x1, y1, x2, y2 in xyxy]
+        t_crop, ref = timeit(lambda: model._preprocess(crops), repeat)
+        t_batch, out = timeit(lambda: model._preprocess_boxes(img, xyxy), repeat)
+        t_fwd, f_batch = timeit(lambda: model(img, boxes=xyxy), repeat)
+        f_ref = model(crops)
+        cos = torch.nn.functional.cosine_similarity(f_ref.float(), f_batch.float(), dim=1)
+        print(f"{n:>6} {t_crop * 1e3:>9.2f} {t_batch * 1e3:>11.2f} {t_crop / max(t_batch, 1e-9):>7.1f}x "
+              f"{t_fwd * 1e3:>11.2f} {(ref - out).abs().max().item():>9.3f} {cos.min().item():>8.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare per-crop and batched ReID preprocessing")
+    parser.add_argument('--reid-weights', type=Path, default=WEIGHTS / 'osnet_x0_25_msmt17.pt')
+    parser.add_argument('--device', default='cpu', help='cuda device, i.e. 0 or cpu')
+    parser.add_argument('--height', default=1080, type=int)
+    parser.add_argument('--width', default=1920, type=int)
+    parser.add_argument('--boxes', nargs='+', default=[1, 4, 16, 64], type=int, help='boxes per frame')
+    parser.add_argument('--repeat', default=5, type=int)
+    args = parser.parse_args()
+    main(args.reid_weights, args.device, args.height, args.width, args.boxes, args.repeat)
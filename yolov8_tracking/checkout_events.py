@@ -0,0 +1,185 @@
+"""
+Turns the per-track class votes collected by track.py into checkout events, the lines of result.txt.
+
+Votes are kept as {track id: (first frame in the tray, {class: votes})}. When the video is over, tracks are merged
+backwards into one of their RETRO_TRACKS predecessors (in id order) if they share the majority class and start less
+than RETRO_WINDOW frames after it, then every track whose majority vote passes the threshold becomes an event.
+
+The same rules can run while the video is being read: flush() finalizes the oldest tracks as soon as nothing that
+can still happen (votes, merges, new tracks) is able to change them, writes their events and frees their state.
+"""
+
+RETRO_WINDOW = 250  # frames between a track and a predecessor it may be merged into
+RETRO_TRACKS = 3  # number of predecessors a track may be merged into
+
+
+class CheckoutEvents:
+    def __init__(self, vid_id, window=RETRO_WINDOW, retro=RETRO_TRACKS, avg_item=None):
+        """
+        Args:
+            vid_id: video id written at the start of every line.
+            window: retro window in frames, also how long a track must be gone before flush() may close it.
+            retro: number of predecessors a track may be merged into.
+            avg_item: average votes per item used for the thresholds of events written by flush(). By default the
+                running average of the tracks closed so far is used, pass the value of a batch run (see
+                sum_frame / n_tracks) to get exactly the batch output while streaming.
+        """
+        self.vid_id = vid_id
+        self.window = window
+        self.retro = retro
+        self.avg_item = avg_item
+        self.see = {}
+        self.keys = []  # ids of tracks still held, in order of entry
+        self.last_output = {}  # id -> last frame the tracker output it, anywhere in the image
+        self.sum_frame = 0  # majority votes of the rectified tracks
+        self.n_tracks = 0  # number of tracks ever voted for
+        self.n_rectified = 0
+        # state of the event writer, carried from one flush to the next
+        self.prev_tstamp = -1
+        self.prev_cls = -1
+        self.prev_count = -1
+
+    def vote(self, id, frame_idx, cls_int, weight=1):
+        # Add `weight` votes for class cls_int to track id, returns True when the track is new
+        if id in self.see:
+            d = self.see[id][1]
+            d[cls_int] = d.get(cls_int, 0) + weight
+            return False
+        self.see[id] = (frame_idx, {cls_int: weight})
+        self.keys.append(id)
+        self.n_tracks += 1
+        return True
+
+    def observe(self, frame_idx, ids):
+        # Record the ids output by the tracker at frame_idx, in or out of the tray
+        for id in ids:
+            self.last_output[id] = frame_idx
+
+    def _rectify(self, keys, j):
+        # Merge keys[j] into the first of its predecessors with the same majority class that is close enough in time.
+        # Predecessors that are no longer held were closed by flush(), which guarantees they cannot match.
+        tstamp, cls_d = self.see[keys[j]]
+        max_cls = max(cls_d, key=cls_d.get)
+        self.sum_frame += cls_d[max_cls]
+        self.n_rectified += 1
+        for retro in range(1, self.retro + 1):
+            if j - retro < 0 or keys[j - retro] not in self.see:
+                continue
+            ntstamp, ncls_d = self.see[keys[j - retro]]
+            nmax_cls = max(ncls_d, key=ncls_d.get)
+            if nmax_cls == max_cls and (tstamp - ntstamp - ncls_d[nmax_cls]) < self.window:
+                ncls_d[nmax_cls] += cls_d[max_cls]
+                cls_d[max_cls] = 0
+                break
+
+    def _write(self, keys, avg_item):
+        lines = []
+        wait = 5
+        threshold = int(avg_item)
+        if threshold > 18:
+            threshold = 18
+            wait = 15
+        else:
+            threshold = min(10, threshold)
+        for i in keys:
+            tstamp, cls_d = self.see[i]
+            x = sorted(((v, k) for k, v in cls_d.items()))
+            max_cls = x[-1][1]
+            if cls_d[max_cls] > threshold:  # The count for this classification is > threshold
+                frames = cls_d[max_cls]
+                added_frames = (frames // 10) if frames < 50 else 5
+                if len(x) > 1 and cls_d[x[-2][1]] > avg_item + 10:
+                    lines.append("{} {} {}\n".format(self.vid_id, x[-2][1] + 1, int(tstamp + wait - avg_item)))
+                if self.prev_cls == -1:
+                    self.prev_cls = max_cls
+                    self.prev_tstamp = tstamp
+                    self.prev_count = cls_d[max_cls]
+                    lines.append("{} {} {}\n".format(self.vid_id, max_cls + 1, tstamp + wait + added_frames))
+                else:
+                    if (self.prev_cls == max_cls and (tstamp - self.prev_tstamp - self.prev_count) < 60) or \
+                            ((tstamp - self.prev_tstamp) < 9 and (tstamp - self.prev_tstamp) >= 0):
+                        # Enforcing that if you are writing consecutive entries with the same item
+                        # there must be a time gap larger than threshold frames.
+                        if tstamp + cls_d[max_cls] > self.prev_tstamp + self.prev_count:
+                            self.prev_tstamp = tstamp
+                            self.prev_count = cls_d[max_cls]
+                        continue
+                    else:
+                        self.prev_cls = max_cls
+                        self.prev_tstamp = tstamp
+                        self.prev_count = cls_d[max_cls]
+                        lines.append("{} {} {}\n".format(self.vid_id, max_cls + 1, tstamp + 5))
+        return lines
+
+    def _release(self, keys):
+        for k in keys:
+            del self.see[k]
+            self.last_output.pop(k, None)
+        released = set(keys)
+        self.keys = [k for k in self.keys if k not in released]
+
+    def _closed(self, frame_idx, ordered):
+        # Length of the longest prefix of `ordered` (held ids, sorted) that nothing in the future can change
+        gone = lambda k: frame_idx - self.last_output.get(k, self.see[k][0]) > self.window
+        # a track output outside the tray may still enter it, its id would be inserted in the middle of the order
+        entering = [k for k, f in self.last_output.items() if k not in self.see and frame_idx - f <= self.window]
+        limit = min(entering) if entering else None
+        m = 0
+        while m < len(ordered) and gone(ordered[m]) and (limit is None or ordered[m] < limit):
+            m += 1
+        while m > 0:
+            # No later track, held or future, may be merged into one of the last `retro` tracks of the prefix.
+            # Later tracks are rectified first, so a prefix track still has its own final votes when they look at it.
+            # Held tracks start at a known frame, future ones (which may also be inserted right after the prefix)
+            # no earlier than the next frame.
+            safe = True
+            for p in range(max(m - self.retro, 0), m):
+                tstamp, cls_d = self.see[ordered[p]]
+                count = max(cls_d.values())
+                starts = [self.see[k][0] for k in ordered[m:p + self.retro + 1]] + [frame_idx + 1]
+                if any(start - tstamp - count < self.window for start in starts):
+                    safe = False
+                    break
+            if safe:
+                return m
+            m -= 1
+        return 0
+
+    def flush(self, frame_idx):
+        """
+        Close the oldest tracks that can no longer change, call once per frame while streaming.
+        Return:
+            The result.txt lines of the closed tracks.
+        """
+        # tracks that left without entering the tray and are gone for good
+        self.last_output = {k: f for k, f in self.last_output.items()
+                            if k in self.see or frame_idx - f <= self.window}
+        if not self.see:
+            return []
+        ordered = sorted(self.keys)
+        m = self._closed(frame_idx, ordered)
+        if m == 0:
+            return []
+        prefix = ordered[:m]
+        for j in range(m - 1, -1, -1):  # backwards
+            self._rectify(prefix, j)
+        avg_item = self.avg_item if self.avg_item is not None else self.sum_frame / self.n_rectified
+        lines = self._write(prefix, avg_item)
+        self._release(prefix)
+        return lines
+
+    def finalize(self):
+        """
+        Rectify and write every track still held, at the end of the video. Without earlier flush() calls this is the
+        original end-of-video postprocessing.
+        Return:
+            The remaining result.txt lines.
+        """
+        if not self.see:
+            return []
+        ordered = sorted(self.keys)
+        for j in range(len(ordered) - 1, -1, -1):  # backwards
+            self._rectify(ordered, j)
+        lines = self._write(ordered, self.sum_frame / self.n_tracks)
+        self._release(ordered)
+        return lines
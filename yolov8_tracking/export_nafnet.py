@@ -0,0 +1,68 @@
+"""
+Export the NAFNet deblurring model to ONNX and TorchScript for NAFNetRuntime.
+
+Exports take dynamic shapes by default, which are exact for any frame or tray ROI, including the trays of up to
+1060 x 650 pixels TrayTracker accepts in --tray-roi mode. --shape h w makes a fixed shape export for a ROI of known
+size, e.g. 830 1050 for the default tray box grown by the default --roi-margin; NAFNetRuntime restores larger images
+with it in tiles. Every export is checked against the eager model on a random image.
+
+Usage:
+
+    $ python export_nafnet.py --weights NAFNet-REDS-width64.pth --include onnx torchscript
+    $ python export_nafnet.py --weights NAFNet-REDS-width64.pth --shape 830 1050
+    $ python track.py --deblur-path weights/NAFNet-REDS-width64_dynamic.onnx ...
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
+import torch
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[0]
+WEIGHTS = ROOT / 'weights'
+
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+if str(ROOT.parent / 'NAFNet') not in sys.path:
+    sys.path.append(str(ROOT.parent / 'NAFNet'))  # add NAFNet ROOT to PATH
+
+from nafnet_runtime import MIN_SIDE, NAFNetRuntime, build_nafnet, export, to_image, to_tensor
+
+SUFFIXES = {'onnx': '.onnx', 'torchscript': '.torchscript'}
+
+
+@torch.no_grad()
+def check(net, runtime, h, w, tol=1):
+    # Max absolute difference of the uint8 outputs of the eager and the exported model on a random h x w image
+    im = np.random.default_rng(0).integers(0, 256, (h, w, 3), dtype=np.uint8)
+    ref = to_image(net(to_tensor(im)).numpy())
+    diff = int(np.abs(ref.astype(np.int16) - runtime(im)).max())
+    assert diff <= tol, f'exported NAFNet differs from the eager model by {diff} on a {h}x{w} image'
+    return diff
+
+
+def main(opt):
+    net = build_nafnet(opt.weights)
+    stem = Path(opt.weights).stem if opt.weights else 'NAFNet-random'
+    out = Path(opt.out)
+    out.mkdir(parents=True, exist_ok=True)
+    for fmt in opt.include:
+        file = out / f"{stem}_{'x'.join(map(str, opt.shape)) if opt.shape else 'dynamic'}{SUFFIXES[fmt]}"
+        meta = export(net, file, opt.shape, opset=opt.opset)
+        runtime = NAFNetRuntime(file)
+        shapes = [tuple(opt.shape)] if opt.shape else [(830, 1050), (850, 1260), (MIN_SIDE + 10, MIN_SIDE + 50)]
+        diffs = [check(net, runtime, *s) for s in shapes]
+        print(f'{file} {meta}, max uint8 difference to the eager model {max(diffs)}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export NAFNet to ONNX / TorchScript")
+    parser.add_argument('--weights', type=str, default='', help='NAFNet checkpoint, random weights if empty')
+    parser.add_argument('--include', nargs='+', default=['onnx'], choices=list(SUFFIXES))
+    parser.add_argument('--shape', nargs=2, type=int, default=None, help='h, w of a fixed shape export, else dynamic')
+    parser.add_argument('--opset', type=int, default=17, help='ONNX opset')
+    parser.add_argument('--out', type=str, default=str(WEIGHTS))
+    main(parser.parse_args())
@@ -0,0 +1,183 @@
+"""
+On-disk cache of the per-frame model outputs of track.py, so that tracking and vote parameters can be tuned without
+running YOLO, EgoHOS, NAFNet and ReID again.
+
+Entries live in <root>/<video hash>/<fingerprint>/, the video hash is computed from the file content and the
+fingerprint from the weights and every option that changes what the models see. An entry holds, for every frame:
+    dets.npy     (N, 6) float32 post-NMS detections x1, y1, x2, y2, conf, cls of all frames, in im0 pixels
+    offsets.npy  (F + 1,) int64, the detections of frame k are dets[offsets[k]:offsets[k + 1]]
+    embs.npy     (N, D) float32 ReID embeddings of the detections (StrongSORT only)
+    trays.npy    (F, 2, 2) int32 tray corners
+    deblur.npy   (F,) bool, whether the frame was deblurred before detection
+    warps.npy    (F, 2, 3) float32 camera motion to the previous frame, nan when it was not estimated
+    masks.bin    (F, ceil(H * W / 8)) uint8 bit-packed hand masks (optional)
+    meta.json
+All arrays are opened memory-mapped. The least recently used entries are removed when the cache grows beyond
+max_bytes.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+
+LOGGER = logging.getLogger('ultralytics')  # the yolov8 logger, without importing the model stack
+
+_hashes = {}  # (path, size, mtime ns) -> digest, every file is read once per process
+
+
+def file_hash(path, chunk=1 << 20):
+    # Hash of the whole file content, memoized until the file changes
+    path = Path(path).resolve()
+    st = path.stat()
+    key = (str(path), st.st_size, st.st_mtime_ns)
+    if key not in _hashes:
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(chunk), b''):
+                h.update(block)
+        _hashes[key] = h.hexdigest()[:16]
+    return _hashes[key]
+
+
+def fingerprint(**fields):
+    # Hash of the options that change the cached outputs, files are hashed by content
+    fields = {k: file_hash(v) if isinstance(v, Path) and v.is_file() else v for k, v in sorted(fields.items())}
+    return hashlib.sha1(json.dumps(fields, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def _dir_size(path):
+    return sum(f.stat().st_size for f in Path(path).rglob('*') if f.is_file())
+
+
+class CachedVideo:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.meta = json.loads((self.path / 'meta.json').read_text())
+        self.n_frames = self.meta['frames']
+        self.shape = tuple(self.meta['shape'])
+        load = lambda name: np.load(self.path / name, mmap_mode='r') if (self.path / name).is_file() else None
+        self.dets = load('dets.npy')
+        self.offsets = load('offsets.npy')
+        self.embs = load('embs.npy')
+        self.trays = load('trays.npy')
+        self.deblur = load('deblur.npy')
+        self.warps = load('warps.npy')
+        self.masks = np.memmap(self.path / 'masks.bin', np.uint8, 'r', shape=(self.n_frames, self.meta['mask_bytes'])) \
+            if self.meta.get('mask_bytes') else None
+
+    def __len__(self):
+        return self.n_frames
+
+    def frame(self, k):
+        """
+        Return:
+            dets (n, 6), embs (n, D) or None, tray ((x1, y1), (x2, y2)), deblurred flag, warp (2, 3) or None
+        """
+        a, b = self.offsets[k], self.offsets[k + 1]
+        warp = self.warps[k] if self.warps is not None and not np.isnan(self.warps[k, 0, 0]) else None
+        tray = self.trays[k].tolist()
+        return (np.asarray(self.dets[a:b]), None if self.embs is None else np.asarray(self.embs[a:b]),
+                (tuple(tray[0]), tuple(tray[1])), bool(self.deblur[k]), warp)
+
+    def hand_mask(self, k):
+        h, w = self.shape[:2]
+        return np.unpackbits(self.masks[k], count=h * w).reshape(h, w).astype(bool)
+
+
+class CacheRecorder:
+    def __init__(self, cache, path, meta, masks=False):
+        self.cache = cache
+        self.path = Path(path)
+        self.meta = meta
+        self.tmp = self.path.with_name(self.path.name + f'.tmp{os.getpid()}')
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        self.tmp.mkdir(parents=True)
+        self.dets, self.embs, self.trays, self.deblur, self.warps = [], [], [], [], []
+        self.n = [0]
+        self.masks = open(self.tmp / 'masks.bin', 'wb') if masks else None
+        self.shape = None
+        self.emb_dim = None  # D, known from the first frame with detections
+
+    def add(self, det, tray, deblur, embs=None, warp=None, mask=None, shape=None):
+        det = np.asarray(det, dtype=np.float32).reshape(-1, 6)
+        self.dets.append(det)
+        self.n.append(self.n[-1] + len(det))
+        if embs is not None:  # (0, D) or any empty array for frames without detections
+            embs = np.asarray(embs, dtype=np.float32)
+            if len(det):
+                embs = embs.reshape(len(det), -1)
+                self.emb_dim = embs.shape[1]
+            self.embs.append(embs if len(det) else embs.reshape(0, self.emb_dim or 0))
+        self.trays.append(np.asarray(tray, dtype=np.int32).reshape(2, 2))
+        self.deblur.append(bool(deblur))
+        self.warps.append(np.full((2, 3), np.nan, np.float32) if warp is None else np.asarray(warp, np.float32)[:2])
+        self.shape = self.shape or shape
+        if self.masks is not None:
+            h, w = self.shape[:2]
+            self.masks.write(np.packbits(np.zeros((h, w), bool) if mask is None else mask != 0).tobytes())
+
+    def save(self):
+        np.save(self.tmp / 'dets.npy', np.concatenate(self.dets) if self.dets else np.zeros((0, 6), np.float32))
+        np.save(self.tmp / 'offsets.npy', np.asarray(self.n, dtype=np.int64))
+        if self.embs and len(self.embs) == len(self.dets):  # every frame carried embeddings
+            np.save(self.tmp / 'embs.npy', np.concatenate([e.reshape(len(e), self.emb_dim or 0) for e in self.embs]))
+        np.save(self.tmp / 'trays.npy', np.stack(self.trays) if self.trays else np.zeros((0, 2, 2), np.int32))
+        np.save(self.tmp / 'deblur.npy', np.asarray(self.deblur, dtype=bool))
+        np.save(self.tmp / 'warps.npy', np.stack(self.warps) if self.warps else np.zeros((0, 2, 3), np.float32))
+        meta = dict(self.meta, frames=len(self.dets), shape=list(self.shape or (0, 0, 3)), created=time.time())
+        if self.masks is not None:
+            self.masks.close()
+            h, w = meta['shape'][:2]
+            meta['mask_bytes'] = (h * w + 7) // 8
+        else:
+            (self.tmp / 'masks.bin').unlink(missing_ok=True)
+        (self.tmp / 'meta.json').write_text(json.dumps(meta, indent=1, default=str))
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self.tmp, self.path)  # readers never see a half written entry
+        self.cache.evict(keep=self.path)
+        return self.path
+
+
+class FrameCache:
+    def __init__(self, root, max_bytes=None):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def entry(self, video, fp):
+        return self.root / file_hash(video) / fp
+
+    def load(self, video, fp):
+        # Return the CachedVideo of `video` recorded with fingerprint fp, or None
+        path = self.entry(video, fp)
+        if not (path / 'meta.json').is_file():
+            return None
+        os.utime(path / 'meta.json')  # recently used
+        return CachedVideo(path)
+
+    def recorder(self, video, fp, masks=False, **meta):
+        return CacheRecorder(self, self.entry(video, fp), dict(meta, video=str(video), fingerprint=fp), masks=masks)
+
+    def evict(self, keep=None):
+        # Remove the least recently used entries until the cache fits in max_bytes
+        if self.max_bytes is None:
+            return
+        entries = [p.parent for p in self.root.glob('*/*/meta.json')]
+        sizes = {p: _dir_size(p) for p in entries}
+        total = sum(sizes.values())
+        for p in sorted(entries, key=lambda p: (p / 'meta.json').stat().st_mtime):
+            if total <= self.max_bytes:
+                break
+            if keep is not None and p == Path(keep):
+                continue
+            shutil.rmtree(p, ignore_errors=True)
+            total -= sizes[p]
+            LOGGER.info(f'Frame cache: evicted {p}')
+            if not any(p.parent.iterdir()):
+                p.parent.rmdir()
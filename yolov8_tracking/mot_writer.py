@@ -0,0 +1,139 @@
+"""
+Buffered writer for the MOT rows saved by track.py --save-txt.
+
+Each sequence (one tracks/<name> file) keeps a single open handle and a preallocated row buffer. Rows are written in
+bulk when the buffer is full, when `interval` seconds have passed since the last write and on close(). Rows are
+    frame, id, bbox_left, bbox_top, bbox_w, bbox_h, -1, -1, -1, i
+and can be saved as the usual text file (.txt), a float64 .npy array or a .parquet table (requires pyarrow).
+"""
+
+import struct
+import time
+
+import numpy as np
+
+MOT_COLUMNS = ('frame', 'id', 'bbox_left', 'bbox_top', 'bbox_w', 'bbox_h', 'x', 'y', 'z', 'i')
+MOT_FORMATS = ('txt', 'npy', 'parquet')
+NPY_HEADER = 128  # bytes reserved for the .npy header, rewritten with the final row count on close
+
+
+def _npy_header(n):
+    d = "{'descr': '<f8', 'fortran_order': False, 'shape': (%d, %d), }" % (n, len(MOT_COLUMNS))
+    d = d.ljust(NPY_HEADER - 11) + '\n'
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(d)) + d.encode('latin1')
+
+
+class _Sequence:
+    def __init__(self, path, fmt, capacity):
+        self.path = path
+        self.fmt = fmt
+        self.buf = np.empty((capacity, len(MOT_COLUMNS)), dtype='<f8')
+        self.n = 0  # rows in buf
+        self.rows = 0  # rows written to disk
+        self.last = time.monotonic()
+        if fmt == 'txt':
+            self.f = open(path, 'a')
+        elif fmt == 'npy':
+            self.f = open(path, 'wb')
+            self.f.write(_npy_header(0))
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            self.schema = pa.schema([(c, pa.float64()) for c in MOT_COLUMNS])
+            self.f = pq.ParquetWriter(path, self.schema)
+
+    def flush(self):
+        if self.n:
+            rows = self.buf[:self.n]
+            if self.fmt == 'txt':
+                np.savetxt(self.f, rows, fmt='%g ', delimiter='')  # same text as ('%g ' * 10 + '\n') % row
+            elif self.fmt == 'npy':
+                self.f.write(rows.tobytes())
+            else:
+                import pyarrow as pa
+                self.f.write_table(pa.Table.from_arrays([pa.array(rows[:, k]) for k in range(rows.shape[1])],
+                                                        schema=self.schema))
+            self.rows += self.n
+            self.n = 0
+        self.last = time.monotonic()
+
+    def close(self):
+        self.flush()
+        if self.fmt == 'npy':
+            self.f.seek(0)
+            self.f.write(_npy_header(self.rows))
+        self.f.close()
+
+
+class MOTWriter:
+    def __init__(self, fmt='txt', capacity=4096, interval=5.0, max_open=16):
+        """
+        Args:
+            fmt: 'txt', 'npy' or 'parquet'.
+            capacity: rows buffered per sequence before they are written.
+            interval: seconds after which buffered rows are written even if the buffer is not full, None to wait for
+                a full buffer.
+            max_open: sequences kept open at once, the least recently started one is closed beyond that. Text files
+                are appended to when a closed sequence gets more rows, npy and parquet files are started over.
+        """
+        assert fmt in MOT_FORMATS, f'unknown MOT format {fmt}, use one of {MOT_FORMATS}'
+        if fmt == 'parquet':
+            import pyarrow  # noqa: F401, fail here rather than on the first flush
+        self.fmt = fmt
+        self.capacity = capacity
+        self.interval = interval
+        self.max_open = max_open
+        self.seqs = {}
+
+    @property
+    def suffix(self):
+        return '.' + self.fmt
+
+    def add(self, path, frame, boxes, ids, i=0):
+        """
+        Buffer the rows of one frame.
+        Args:
+            path: file name without suffix, one per sequence.
+            frame: frame number written in the first column.
+            boxes: (n, 4) xyxy boxes.
+            ids: (n,) track ids.
+            i: index of the source in the batch, written in the last column.
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        n = len(boxes)
+        if not n:
+            return
+        seq = self.seqs.get(path)
+        if seq is None:
+            if len(self.seqs) >= self.max_open:
+                self.close(next(iter(self.seqs)))
+            seq = self.seqs[path] = _Sequence(path + self.suffix, self.fmt, self.capacity)
+        if seq.n + n > len(seq.buf):
+            seq.flush()
+            if n > len(seq.buf):
+                seq.buf = np.empty((n, len(MOT_COLUMNS)), dtype='<f8')
+        rows = seq.buf[seq.n:seq.n + n]
+        rows[:, 0] = frame
+        rows[:, 1] = ids
+        rows[:, 2:4] = boxes[:, :2]
+        rows[:, 4:6] = boxes[:, 2:] - boxes[:, :2]
+        rows[:, 6:9] = -1
+        rows[:, 9] = i
+        seq.n += n
+        if self.interval is not None and time.monotonic() - seq.last > self.interval:
+            seq.flush()
+
+    def flush(self):
+        for seq in self.seqs.values():
+            seq.flush()
+
+    def close(self, path=None):
+        # Write and close one sequence, or all of them
+        for p in ([path] if path is not None else list(self.seqs)):
+            self.seqs.pop(p).close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,209 @@
+"""
+NAFNet deblurring without the BasicSR model machinery.
+
+build_nafnet() loads the bare NAFNetLocal network from the options file LoadImages uses, export_nafnet.py exports it to
+ONNX or TorchScript and NAFNetRuntime runs an exported model, ONNX with ONNX Runtime on the CPU, TorchScript on any
+device. Pass the exported file as --deblur-path of track.py to use it instead of the eager BasicSR model.
+
+NAFNetLocal replaces the global average pooling of its channel attention with a local average pooling whose kernel
+was fixed for 256 x 256 training crops. Which pooling runs depends on the input size, so an exported graph is exact
+for the shapes it was exported for:
+    dynamic  any (h, w) whose padded sides are both at least MIN_SIDE. Smaller inputs are padded up to MIN_SIDE. The
+             default of export_nafnet.py, exact for every tray ROI.
+    fixed    one (h, w), padded to a multiple of 16, for a ROI of known size. Smaller inputs are zero padded to it,
+             which only matches the eager model within the padding it applies itself. Larger ones are restored in
+             overlapping tiles of the export shape, averaged where they overlap, so they are never refused but are
+             not exact either.
+"""
+
+import copy
+import json
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+PAD = 16  # NAFNetLocal pads its input to a multiple of 2 ** len(encoders)
+MIN_SIDE = 384  # kernel of the local average pooling at full resolution, 1.5 x the 256 pixel training crops
+OPT_PATH = Path(__file__).resolve().parents[1] / 'NAFNet/options/test/REDS/NAFNet-width64.yml'
+META_KEY = 'nafnet'
+
+
+def padded(n, minimum=0):
+    return max(-(-n // PAD) * PAD, minimum)
+
+
+def tile_starts(n, size):
+    # Starts of the fewest windows of `size` that cover range(n), spread evenly, the last one flush with the end
+    k = -(-n // size)
+    if k <= 1:
+        return [0]
+    return [round(i * (n - size) / (k - 1)) for i in range(k)]
+
+
+def build_nafnet(weights='', opt_path=OPT_PATH):
+    """
+    Args:
+        weights: BasicSR checkpoint of the network, random weights if ''.
+        opt_path: test options whose network_g section describes the network.
+    Return:
+        The NAFNetLocal model on the CPU, in eval mode.
+    """
+    from basicsr.models.archs import define_network
+    from basicsr.utils.options import parse
+
+    opt = parse(str(opt_path), is_train=False)
+    net = define_network(dict(opt['network_g']))
+    if weights:
+        state = torch.load(weights, map_location='cpu')
+        state = state.get(opt['path'].get('param_key', 'params'), state)
+        state = {k[7:] if k.startswith('module.') else k: v for k, v in state.items()}  # drop 'module.'
+        net.load_state_dict(state, strict=opt['path'].get('strict_load_g', True))
+    return net.eval()
+
+
+class Padded(nn.Module):
+    # The network without its own padding, the runtime pads the inputs so no shape arithmetic ends up in the graph
+    def __init__(self, net):
+        super().__init__()
+        self.net = net
+
+    def forward(self, x):
+        net = self.net
+        y = net.intro(x)
+        encs = []
+        for encoder, down in zip(net.encoders, net.downs):
+            y = encoder(y)
+            encs.append(y)
+            y = down(y)
+        y = net.middle_blks(y)
+        for decoder, up, enc_skip in zip(net.decoders, net.ups, encs[::-1]):
+            y = decoder(up(y) + enc_skip)
+        return net.ending(y) + x
+
+
+class LayerNorm(nn.Module):
+    # LayerNorm2d without its autograd.Function, which TorchScript can not serialize, same arithmetic
+    def __init__(self, norm):
+        super().__init__()
+        self.weight, self.bias, self.eps = norm.weight, norm.bias, norm.eps
+
+    def forward(self, x):
+        mu = x.mean(1, keepdim=True)
+        var = (x - mu).pow(2).mean(1, keepdim=True)
+        y = (x - mu) / (var + self.eps).sqrt()
+        return self.weight.view(1, -1, 1, 1) * y + self.bias.view(1, -1, 1, 1)
+
+
+def exportable(net):
+    # A copy of the network that traces to plain tensor ops
+    from basicsr.models.archs.arch_util import LayerNorm2d
+
+    net = copy.deepcopy(net).cpu().float().eval()
+    for module in list(net.modules()):
+        for name, child in module.named_children():
+            if isinstance(child, LayerNorm2d):
+                setattr(module, name, LayerNorm(child))
+    return Padded(net)
+
+
+def to_tensor(im):
+    # HWC uint8 BGR to a 1CHW float tensor in [0, 1], the channel order LoadImages feeds NAFNet
+    return torch.from_numpy(np.ascontiguousarray(im.transpose(2, 0, 1))).float().div_(255.).unsqueeze(0)
+
+
+def to_image(out):
+    # 1CHW float output to HWC uint8, rounded like basicsr.utils.tensor2img
+    out = np.clip(np.asarray(out)[0].transpose(1, 2, 0), 0, 1)
+    return (out * 255.).round().astype(np.uint8)
+
+
+@torch.no_grad()
+def export(net, file, shape=None, opset=17):
+    """
+    Export NAFNetLocal to ONNX (.onnx) or TorchScript (any other suffix).
+    Args:
+        shape: (h, w) of a fixed shape export, None for dynamic shapes.
+    Return:
+        The metadata stored with the model.
+    """
+    file = Path(file)
+    meta = {'shape': None if shape is None else [padded(shape[0]), padded(shape[1])], 'min_side': MIN_SIDE}
+    h, w = meta['shape'] or [padded(1088, MIN_SIDE), padded(1920, MIN_SIDE)]
+    model = exportable(net)
+    x = torch.rand(1, 3, h, w)
+    if file.suffix == '.onnx':
+        import onnx
+
+        torch.onnx.export(model, x, str(file), opset_version=opset, input_names=['images'], output_names=['output'],
+                          dynamic_axes=None if shape else {'images': {2: 'height', 3: 'width'},
+                                                           'output': {2: 'height', 3: 'width'}})
+        proto = onnx.load(str(file))
+        proto.metadata_props.add(key=META_KEY, value=json.dumps(meta))
+        onnx.save(proto, str(file))
+    else:
+        ts = torch.jit.trace(model, x, check_trace=False)
+        torch.jit.save(ts, str(file), _extra_files={META_KEY: json.dumps(meta)})
+    return meta
+
+
+class NAFNetRuntime:
+    """
+    Exported NAFNet, called on a HWC uint8 BGR image and returning the restored one, like LoadImages.deblur_frame.
+    """
+
+    def __init__(self, file, device='cpu', threads=0):
+        file = Path(file)
+        self.onnx = file.suffix == '.onnx'
+        if self.onnx:
+            import onnxruntime as ort
+
+            options = ort.SessionOptions()
+            if threads:
+                options.intra_op_num_threads = threads
+            self.session = ort.InferenceSession(str(file), options, providers=['CPUExecutionProvider'])
+            meta = self.session.get_modelmeta().custom_metadata_map[META_KEY]
+        else:
+            extra = {META_KEY: ''}
+            self.device = torch.device(device)
+            self.model = torch.jit.load(str(file), map_location=self.device, _extra_files=extra).eval()
+            meta = extra[META_KEY]
+        meta = json.loads(meta)
+        self.shape, self.min_side = meta['shape'], meta['min_side']
+
+    def input_shape(self, h, w):
+        # (h, w) the model is run at for an image of at most h x w, the export shape of a fixed export
+        if self.shape is None:
+            return padded(h, self.min_side), padded(w, self.min_side)
+        return self.shape
+
+    def fits(self, h, w):
+        # Whether an h x w image is restored in one piece
+        return self.shape is None or (h <= self.shape[0] and w <= self.shape[1])
+
+    @torch.no_grad()
+    def run(self, im):
+        h, w = im.shape[:2]
+        ph, pw = self.input_shape(h, w)
+        x = F.pad(to_tensor(im), (0, pw - w, 0, ph - h))
+        if self.onnx:
+            out = self.session.run(None, {'images': x.numpy()})[0]
+        else:
+            out = self.model(x.to(self.device)).cpu().numpy()
+        return to_image(out[:, :, :h, :w])
+
+    def __call__(self, im):
+        h, w = im.shape[:2]
+        if self.fits(h, w):
+            return self.run(im)
+        # larger than a fixed export, e.g. a tray ROI beyond the default box: average overlapping tiles
+        th, tw = self.shape
+        out = np.zeros(im.shape, np.float32)
+        weight = np.zeros((h, w, 1), np.float32)
+        for y in tile_starts(h, th):
+            for x in tile_starts(w, tw):
+                out[y:y + th, x:x + tw] += self.run(np.ascontiguousarray(im[y:y + th, x:x + tw]))
+                weight[y:y + th, x:x + tw] += 1
+        return (out / weight).round().astype(np.uint8)
@@ -0,0 +1,136 @@
+"""
+Per-stage latency profiler of the tracking pipeline.
+
+Every stage of a frame (decode, hand segmentation, tray, NAFNet, letterbox, inference, NMS, tracker, annotation, video
+writing, ...) runs inside `with profiler.stage(name):`. Enabled, the profiler records one event per stage call, with
+the frame it belongs to and the thread it ran on. From them it builds:
+    summary()              per stage count and p50 / p95 / p99 / max of the per-frame latency, as table()
+    histogram(name)        histogram of the per-frame latency of a stage
+    export_chrome_trace()  Chrome trace JSON, open in chrome://tracing or https://ui.perfetto.dev
+
+Disabled, stage() returns one shared no-op context manager and iterate() the plain iterator, so the stages can stay in
+production code.
+
+Usage:
+
+    $ python track.py --source vid.mp4 --profile  # writes trace.json and profile.txt to the run directory
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+import numpy as np
+import torch
+
+NULL_STAGE = nullcontext()
+
+
+class Stage:
+    __slots__ = ('profiler', 'name', 'frame', 'start')
+
+    def __init__(self, profiler, name, frame):
+        self.profiler, self.name, self.frame = profiler, name, frame
+
+    def __enter__(self):
+        if self.profiler.sync:
+            torch.cuda.synchronize()
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if self.profiler.sync:
+            torch.cuda.synchronize()
+        self.profiler.add(self.name, self.frame, self.start, time.perf_counter_ns() - self.start)
+
+
+class StageProfiler:
+    def __init__(self, enabled=True, sync=True):
+        """
+        Args:
+            enabled: record stages, a disabled profiler costs one attribute check per stage.
+            sync: wait for CUDA at the stage boundaries so that GPU work is charged to the stage that queued it.
+        """
+        self.enabled = enabled
+        self.sync = enabled and sync and torch.cuda.is_available()
+        self.frame_idx = 0  # frame of the stages that do not name one
+        self.events = []  # (stage, frame, start ns, duration ns, thread id), appends are atomic across threads
+        self.threads = {}  # thread id -> name
+        self.t0 = time.perf_counter_ns()
+
+    def stage(self, name, frame=None):
+        # Context manager timing stage `name` of `frame`, the current frame if None
+        if not self.enabled:
+            return NULL_STAGE
+        return Stage(self, name, self.frame_idx if frame is None else frame)
+
+    def add(self, name, frame, start, duration):
+        thread = threading.current_thread()
+        self.threads.setdefault(thread.ident, thread.name)
+        self.events.append((name, frame, start, duration, thread.ident))
+
+    def iterate(self, iterable, name='load'):
+        # Iterate, timing every next() as stage `name` of the frame it yields and counting the frames
+        if not self.enabled:
+            return iter(iterable)
+        return self._timed(iterable, name)
+
+    def _timed(self, iterable, name):
+        it = iter(iterable)
+        frame = 0
+        while True:
+            self.frame_idx = frame
+            start = time.perf_counter_ns()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            self.add(name, frame, start, time.perf_counter_ns() - start)
+            yield item
+            frame += 1
+
+    def frame_times(self):
+        """
+        Return:
+            {stage: (frames, per frame latency in ms)}, the calls of a stage within one frame are summed.
+        """
+        per_stage = {}
+        for name, frame, _, duration, _ in self.events:
+            frames = per_stage.setdefault(name, {})
+            frames[frame] = frames.get(frame, 0) + duration
+        return {name: (np.fromiter(f.keys(), dtype=np.int64), np.fromiter(f.values(), dtype=np.float64) / 1e6)
+                for name, f in per_stage.items()}
+
+    def summary(self):
+        # [(stage, frames, mean, p50, p95, p99, max, total)] in ms, by total time
+        rows = []
+        for name, (_, ms) in self.frame_times().items():
+            p50, p95, p99 = np.percentile(ms, (50, 95, 99))
+            rows.append((name, len(ms), ms.mean(), p50, p95, p99, ms.max(), ms.sum()))
+        return sorted(rows, key=lambda r: -r[-1])
+
+    def table(self):
+        lines = [f"{'stage':<16}{'frames':>8}{'mean':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'total s':>9}"]
+        for name, n, mean, p50, p95, p99, mx, total in self.summary():
+            lines.append(f'{name:<16}{n:>8}{mean:>9.2f}{p50:>9.2f}{p95:>9.2f}{p99:>9.2f}{mx:>9.2f}{total / 1e3:>9.2f}')
+        return '\n'.join(lines)
+
+    def histogram(self, name, bins=20):
+        # (counts, bin edges in ms) of the per-frame latency of a stage
+        return np.histogram(self.frame_times()[name][1], bins=bins)
+
+    def export_chrome_trace(self, file):
+        """
+        Write the events as Chrome trace JSON, one complete ('X') event per stage call with the frame in its args
+        and one track per thread.
+        """
+        pid = os.getpid()
+        trace = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                 for tid, name in self.threads.items()]
+        trace += [{'name': name, 'cat': 'pipeline', 'ph': 'X', 'pid': pid, 'tid': tid, 'ts': (start - self.t0) / 1e3,
+                   'dur': duration / 1e3, 'args': {'frame': int(frame)}}
+                  for name, frame, start, duration, tid in self.events]
+        with open(file, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,94 @@
+"""
+INT8 variants of the ReID and hand segmentation models for the CPU deployment profile of track.py.
+
+    dynamic  nn.Linear weights are stored in INT8 and activations are quantized on the fly. Covers the attention and
+             MLP layers of the Swin backbone of the EgoHOS segmentor, no calibration needed.
+    static   weights and activations of the whole graph in INT8 (FX graph mode), with activation ranges calibrated on
+             crops of a sample video. Meant for the convolutional OSNet ReID model.
+
+Quantized models run on the CPU only. The quantized engine is picked from what this torch build supports, x86 / fbgemm
+on Intel and AMD boxes and qnnpack on ARM.
+"""
+
+import copy
+
+import cv2
+import numpy as np
+import torch
+import torch.nn as nn
+
+from yolov8.ultralytics.yolo.utils import LOGGER
+
+QUANT_MODES = ('dynamic', 'static')
+
+
+def quant_engine():
+    engines = torch.backends.quantized.supported_engines
+    for engine in ('x86', 'fbgemm', 'qnnpack'):
+        if engine in engines:
+            return engine
+    raise RuntimeError(f'no INT8 engine in this torch build, supported engines are {engines}')
+
+
+def quantize_dynamic(model):
+    # INT8 weights for every nn.Linear, the rest of the model stays FP32
+    torch.backends.quantized.engine = quant_engine()
+    return torch.ao.quantization.quantize_dynamic(model.cpu().float().eval(), {nn.Linear}, dtype=torch.qint8)
+
+
+@torch.no_grad()
+def quantize_static(model, calib):
+    """
+    Args:
+        model: FP32 nn.Module, left untouched.
+        calib: list of input batches the activation ranges are observed on.
+    Return:
+        The INT8 model, or the dynamically quantized one when the model can not be traced.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    engine = quant_engine()
+    torch.backends.quantized.engine = engine
+    model = copy.deepcopy(model).cpu().float().eval()
+    try:
+        prepared = prepare_fx(model, get_default_qconfig_mapping(engine), example_inputs=(calib[0],))
+    except Exception as e:  # FX can not trace every model
+        LOGGER.warning(f'WARNING ⚠️ static quantization failed ({e}), falling back to dynamic quantization')
+        return quantize_dynamic(model)
+    for x in calib:
+        prepared(x)
+    return convert_fx(prepared)
+
+
+def quantize(model, mode, calib=None):
+    assert mode in QUANT_MODES, f'unknown quantization {mode}, use one of {QUANT_MODES}'
+    if mode == 'static':
+        assert calib, 'static quantization needs calibration inputs'
+        return quantize_static(model, calib)
+    return quantize_dynamic(model)
+
+
+def calibration_crops(source, n=256, frames=32, seed=0):
+    """
+    Random product sized crops from `frames` frames spread over a video, the inputs the ReID model sees at runtime.
+    Return:
+        list of HWC uint8 BGR crops.
+    """
+    cap = cv2.VideoCapture(str(source))
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    rng = np.random.default_rng(seed)
+    crops = []
+    for idx in np.linspace(0, max(total - 1, 0), frames).astype(int):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+        ok, im = cap.read()
+        if not ok:
+            continue
+        h, w = im.shape[:2]
+        for _ in range(-(-n // frames)):
+            bw, bh = rng.integers(40, min(400, w)), rng.integers(40, min(400, h))
+            x1, y1 = rng.integers(0, w - bw + 1), rng.integers(0, h - bh + 1)
+            crops.append(im[y1:y1 + bh, x1:x1 + bw])
+    cap.release()
+    assert crops, f'could not read calibration frames from {source}'
+    return crops[:n]
@@ -0,0 +1,50 @@
+# Round trip of the frame cache through CacheRecorder and CachedVideo
+
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add yolov8_tracking ROOT to PATH
+
+from frame_cache import FrameCache, file_hash
+
+
+def test_round_trip_with_empty_frames(tmp_path):
+    video = tmp_path / 'video.mp4'
+    video.write_bytes(b'not really a video')
+    cache = FrameCache(tmp_path / 'cache')
+    recorder = cache.recorder(video, 'fp')
+    rng = np.random.default_rng(0)
+    frames = [0, 3, 0, 2]  # detections per frame, the video starts and continues with empty frames
+    dets = [rng.uniform(0, 100, (n, 6)).astype(np.float32) for n in frames]
+    embs = [rng.normal(0, 1, (n, 8)).astype(np.float32) for n in frames]
+    tray = ((10, 20), (30, 40))
+    for k, (det, emb) in enumerate(zip(dets, embs)):
+        recorder.add(det, tray, k == 1, emb if len(det) else np.zeros((0, 0), np.float32), shape=(48, 64, 3))
+    recorder.save()
+
+    cached = cache.load(video, 'fp')
+    assert cached is not None and len(cached) == len(frames)
+    assert cached.embs is not None and cached.embs.shape == (sum(frames), 8)
+    for k in range(len(frames)):
+        det, emb, tray_k, deblur, warp = cached.frame(k)
+        assert np.array_equal(det, dets[k]) and np.array_equal(emb, embs[k])
+        assert tray_k == tray and deblur == (k == 1) and warp is None
+
+
+def test_file_hash_covers_the_whole_file(tmp_path):
+    # two files of the same size that differ in the middle only, like a fine-tuned checkpoint
+    data = bytearray(3 << 20)
+    a, b = tmp_path / 'a.pt', tmp_path / 'b.pt'
+    a.write_bytes(bytes(data))
+    data[len(data) // 2] = 1
+    b.write_bytes(bytes(data))
+    assert file_hash(a) != file_hash(b)
+    assert file_hash(a) == file_hash(a)  # memoized
+    b.write_bytes(a.read_bytes())
+    os.utime(b, ns=(1, 1))  # a rewritten file is hashed again
+    assert file_hash(b) == file_hash(a)
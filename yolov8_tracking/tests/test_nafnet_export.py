@@ -0,0 +1,69 @@
+# Parity of the exported NAFNet models run by NAFNetRuntime with the eager network
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+import torch
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add yolov8_tracking ROOT to PATH
+if str(ROOT.parent / 'NAFNet') not in sys.path:
+    sys.path.append(str(ROOT.parent / 'NAFNet'))  # add NAFNet ROOT to PATH
+
+from basicsr.models.archs.NAFNet_arch import NAFNetLocal
+from nafnet_runtime import MIN_SIDE, NAFNetRuntime, export, tile_starts, to_image, to_tensor
+
+
+@pytest.fixture(scope='module')
+def net():
+    # A narrow NAFNetLocal with the depth of the REDS model, random weights and non-zero residual scales
+    torch.manual_seed(0)
+    net = NAFNetLocal(width=8, enc_blk_nums=[1, 1, 1, 2], middle_blk_num=1, dec_blk_nums=[1, 1, 1, 1])
+    with torch.no_grad():
+        for name, p in net.named_parameters():
+            if name.endswith(('beta', 'gamma')):
+                p.normal_(0, 0.5)
+    return net.eval()
+
+
+def max_diff(net, runtime, h, w):
+    im = np.random.default_rng(h * w).integers(0, 256, (h, w, 3), dtype=np.uint8)
+    with torch.no_grad():
+        ref = to_image(net(to_tensor(im)).numpy())
+    return int(np.abs(ref.astype(np.int16) - runtime(im)).max())
+
+
+@pytest.mark.parametrize('suffix', ['.torchscript', '.onnx'])
+def test_fixed_shape(net, tmp_path, suffix):
+    if suffix == '.onnx':
+        pytest.importorskip('onnx')
+        pytest.importorskip('onnxruntime')
+    file = tmp_path / f'nafnet{suffix}'
+    meta = export(net, file, (410, 500))
+    assert meta['shape'] == [416, 512]
+    runtime = NAFNetRuntime(file)
+    assert max_diff(net, runtime, 410, 500) <= 1
+    # larger images, e.g. trays beyond the export shape, are restored in tiles instead of failing
+    im = np.random.default_rng(0).integers(0, 256, (600, 530, 3), dtype=np.uint8)
+    assert runtime(im).shape == im.shape
+
+
+def test_tile_starts():
+    assert tile_starts(400, 416) == [0]
+    assert tile_starts(850, 416) == [0, 217, 434]
+    assert tile_starts(832, 416) == [0, 416]
+
+
+@pytest.mark.parametrize('suffix', ['.torchscript', '.onnx'])
+def test_dynamic_shape(net, tmp_path, suffix):
+    if suffix == '.onnx':
+        pytest.importorskip('onnx')
+        pytest.importorskip('onnxruntime')
+    file = tmp_path / f'nafnet{suffix}'
+    export(net, file)
+    runtime = NAFNetRuntime(file)
+    for h, w in ((MIN_SIDE, MIN_SIDE + 100), (MIN_SIDE + 37, MIN_SIDE + 3), (600, 800)):
+        assert max_diff(net, runtime, h, w) <= 1
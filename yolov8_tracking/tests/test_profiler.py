@@ -0,0 +1,52 @@
+# Stage statistics and trace export of the pipeline profiler
+
+import json
+import sys
+import threading
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add yolov8_tracking ROOT to PATH
+
+from profiler import NULL_STAGE, StageProfiler
+
+
+def test_disabled_is_a_no_op():
+    prof = StageProfiler(enabled=False)
+    assert prof.stage('decode') is NULL_STAGE
+    items = [1, 2, 3]
+    assert list(prof.iterate(items)) == items
+    with prof.stage('decode'):
+        pass
+    assert prof.events == [] and prof.summary() == []
+
+
+def test_summary_and_trace(tmp_path):
+    prof = StageProfiler(sync=False)
+    for frame in prof.iterate(range(100)):
+        prof.add('inference', frame, 0, (frame + 1) * 1_000_000)  # frame + 1 ms
+        prof.add('annotate', frame, 0, 500_000)
+        prof.add('annotate', frame, 0, 500_000)  # two calls in one frame are one sample of 1 ms
+    worker = threading.Thread(target=lambda: prof.stage('deblur', 7).__enter__().__exit__(None, None, None))
+    worker.start()
+    worker.join()
+
+    rows = {r[0]: r for r in prof.summary()}
+    assert set(rows) == {'load', 'inference', 'annotate', 'deblur'}
+    _, n, mean, p50, p95, p99, mx, total = rows['inference']
+    assert n == 100 and mx == 100
+    assert np.allclose((mean, p50, p95, p99), (50.5, 50.5, 95.05, 99.01))
+    assert np.allclose(rows['annotate'][2:7], 1.)
+    assert rows['deblur'][1] == 1
+    counts, edges = prof.histogram('inference', bins=10)
+    assert counts.sum() == 100 and edges[0] == 1 and edges[-1] == 100
+
+    prof.export_chrome_trace(tmp_path / 'trace.json')
+    events = json.loads((tmp_path / 'trace.json').read_text())['traceEvents']
+    calls = [e for e in events if e['ph'] == 'X']
+    assert len(calls) == 100 * 4 + 1
+    assert {e['args']['name'] for e in events if e['ph'] == 'M'} >= {'MainThread', worker.name}
+    assert next(e for e in calls if e['name'] == 'deblur')['args']['frame'] == 7
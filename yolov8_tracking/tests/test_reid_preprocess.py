@@ -0,0 +1,56 @@
+# Parity of the batched roi_align crop preprocessing of the StrongSORT ReID model with the per-crop PIL path
+
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add yolov8_tracking ROOT to PATH
+if str(ROOT / 'yolov8') not in sys.path:
+    sys.path.append(str(ROOT / 'yolov8'))  # add yolov8 ROOT to PATH
+if str(ROOT / 'trackers' / 'strongsort') not in sys.path:
+    sys.path.append(str(ROOT / 'trackers' / 'strongsort'))  # add strong_sort ROOT to PATH
+
+from trackers.strongsort.deep.models import build_model
+from trackers.strongsort.reid_multibackend import ReIDDetectMultiBackend
+
+
+def synthetic_frame(h=1080, w=1920, seed=0):
+    # Smooth random texture over a gradient, product crops are neither flat nor pixel noise
+    rng = np.random.default_rng(seed)
+    texture = rng.uniform(0, 255, (h // 16, w // 16, 3)).astype(np.float32)
+    texture = cv2.resize(texture, (w, h), interpolation=cv2.INTER_CUBIC)
+    y, x = np.mgrid[0:h, 0:w]
+    ramp = np.stack([x * 255 / w, y * 255 / h, (x + y) * 255 / (w + h)], 2)
+    return np.ascontiguousarray(np.clip(0.5 * texture + 0.5 * ramp, 0, 255).astype(np.uint8))
+
+
+def synthetic_boxes(n, h, w, seed=0):
+    # Product sized xyxy integer boxes, the bounds StrongSORT._get_features computes
+    rng = np.random.default_rng(seed)
+    bw, bh = rng.integers(40, 400, n), rng.integers(40, 400, n)
+    x1, y1 = rng.integers(0, w - bw), rng.integers(0, h - bh)
+    return np.stack([x1, y1, x1 + bw, y1 + bh], 1)
+
+
+@torch.no_grad()
+def test_batched_preprocess_matches_pil(tmp_path):
+    torch.manual_seed(0)
+    weights = tmp_path / 'osnet_x0_25_msmt17.pt'  # random weights, the file name selects the architecture
+    torch.save(build_model('osnet_x0_25', num_classes=1, pretrained=False).state_dict(), weights)
+    model = ReIDDetectMultiBackend(weights=weights, device=torch.device('cpu'), fp16=False)
+
+    img = synthetic_frame()
+    boxes = synthetic_boxes(16, *img.shape[:2])
+    ref = model._preprocess([img[y1:y2, x1:x2] for x1, y1, x2, y2 in boxes])
+    batched = model._preprocess_boxes(img, boxes)
+    assert batched.shape == ref.shape == (16, 3, 256, 128)
+    diff = (batched - ref).abs()
+    assert diff.mean() < 0.02 and diff.max() < 0.15  # normalized units, the two resize filters differ slightly
+
+    cos = torch.nn.functional.cosine_similarity(model(img, boxes), model(ref), dim=1)
+    assert cos.min() >= 0.95  # random weights amplify the resize filter differences
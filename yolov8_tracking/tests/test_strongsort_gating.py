@@ -0,0 +1,88 @@
+# Regression tests for the batched Mahalanobis gating of the StrongSORT tracker
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import torch
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add yolov8_tracking ROOT to PATH
+
+from trackers.strongsort.sort.detection import Detection
+from trackers.strongsort.sort.kalman_filter import KalmanFilter
+from trackers.strongsort.sort.nn_matching import NearestNeighborDistanceMetric
+from trackers.strongsort.sort.tracker import Tracker
+
+
+def detection_stream(n_objects, frames, seed, dim=32, miss=0.1, clutter=2):
+    # Per frame (tlwh, conf, cls, feature) of objects moving at constant speed, with missed and spurious detections
+    rng = np.random.default_rng(seed)
+    xy = rng.uniform(100, 1500, (n_objects, 2))
+    v = rng.uniform(-8, 8, (n_objects, 2))
+    wh = rng.uniform(40, 250, (n_objects, 2))
+    emb = rng.normal(0, 1, (n_objects, dim))
+    stream = []
+    for t in range(frames):
+        keep = rng.random(n_objects) > miss
+        tlwh = np.concatenate([xy + v * t + rng.normal(0, 2, (n_objects, 2)), wh * rng.uniform(0.95, 1.05, (n_objects, 2))],
+                              axis=1)[keep]
+        feats = (emb + rng.normal(0, 0.3, emb.shape))[keep]
+        n_fake = rng.integers(0, clutter + 1)
+        tlwh = np.concatenate([tlwh, np.concatenate([rng.uniform(0, 1500, (n_fake, 2)),
+                                                     rng.uniform(40, 250, (n_fake, 2))], axis=1)])
+        feats = np.concatenate([feats, rng.normal(0, 1, (n_fake, dim))])
+        order = rng.permutation(len(tlwh))
+        stream.append((tlwh[order], rng.uniform(0.3, 1, len(order)), np.zeros(len(order)), feats[order]))
+    return stream
+
+
+def make_tracker(batch_gating):
+    tracker = Tracker(NearestNeighborDistanceMetric('cosine', 0.2, 100), max_age=30, n_init=3)
+    tracker.batch_gating = batch_gating
+    return tracker
+
+
+def to_detections(tlwh, conf, feats):
+    return [Detection(b, c, torch.from_numpy(f.astype(np.float32))) for b, c, f in zip(tlwh, conf, feats)]
+
+
+def test_gating_distance_batch():
+    kf = KalmanFilter()
+    rng = np.random.default_rng(0)
+    means, covariances = [], []
+    for _ in range(20):
+        mean, cov = kf.initiate(np.array([rng.uniform(0, 1000), rng.uniform(0, 1000), rng.uniform(0.3, 2), rng.uniform(40, 300)]))
+        for _ in range(rng.integers(1, 5)):
+            mean, cov = kf.predict(mean, cov)
+        means.append(mean)
+        covariances.append(cov)
+    means, covariances = np.stack(means), np.stack(covariances)
+    msrs = means[rng.integers(0, len(means), 15), :4] + rng.normal(0, 5, (15, 4))
+    for only_position in (False, True):
+        d = kf.gating_distance_batch(means, covariances, msrs, only_position)
+        ref = np.stack([kf.gating_distance(m, c, msrs, only_position) for m, c in zip(means, covariances)])
+        np.testing.assert_allclose(d, ref, rtol=1e-9, atol=1e-9)
+    assert kf.gating_distance_batch(means, covariances, np.zeros((0, 4))).shape == (20, 0)
+    assert kf.gating_distance_batch(means[:0], covariances[:0], msrs).shape == (0, 15)
+
+
+def test_batched_gating_matches():
+    # The batched and per-track gating must associate every frame of the stream the same way
+    for seed in range(5):
+        batched, reference = make_tracker(True), make_tracker(False)
+        for tlwh, conf, cls, feats in detection_stream(n_objects=12, frames=60, seed=seed):
+            outputs = []
+            for tracker in (batched, reference):
+                dets = to_detections(tlwh, conf, feats)
+                tracker.predict()
+                matches, unmatched_tracks, unmatched_dets = tracker._match(dets)
+                tracker.update(dets, torch.from_numpy(cls), torch.from_numpy(conf))
+                outputs.append((sorted(matches), sorted(unmatched_tracks), sorted(unmatched_dets),
+                                [(t.track_id, t.to_tlwh()) for t in tracker.tracks]))
+            (m, ut, ud, tracks), (m_ref, ut_ref, ud_ref, tracks_ref) = outputs
+            assert (m, ut, ud) == (m_ref, ut_ref, ud_ref)
+            assert [i for i, _ in tracks] == [i for i, _ in tracks_ref]
+            for (_, box), (_, box_ref) in zip(tracks, tracks_ref):
+                np.testing.assert_allclose(box, box_ref, rtol=1e-9)
@@ -0,0 +1,67 @@
+# Range check, edge refinement and motion gate of the tray tracker on synthetic frames
+
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT.parent) not in sys.path:
+    sys.path.append(str(ROOT.parent))  # add the repository ROOT to PATH, for EgoHOS
+
+from EgoHOS.mmsegmentation.predict_tray import DEFAULT_TRAY, TrayTracker, plausible, refine_edges
+
+TRAY = ((520, 260), (1330, 870))
+
+
+def tray_frame(box=TRAY, h=1080, w=1920):
+    # A bright flat tray on a dark counter
+    img = np.full((h, w, 3), 60, dtype=np.uint8)
+    (x0, y0), (x1, y1) = box
+    img[y0:y1, x0:x1] = 200
+    return img
+
+
+def close(box, ref, tol):
+    return np.abs(np.array(box) - np.array(ref)).max() <= tol
+
+
+def test_plausible():
+    assert plausible(DEFAULT_TRAY)
+    assert plausible(TRAY)
+    assert not plausible(((100, 260), (1330, 870)))  # left edge far outside the range
+    assert not plausible(((520, 260), (1330, 1000)))  # taller than 650 pixels
+
+
+def test_refine_edges_snaps_to_the_tray_border():
+    gray = cv2.cvtColor(tray_frame(), cv2.COLOR_RGB2GRAY)
+    off = ((526, 254), (1325, 875))  # every edge a few pixels off
+    assert close(refine_edges(gray, off, band=12), TRAY, 1)
+    flat = np.full_like(gray, 60)
+    assert refine_edges(flat, ((10, 10), (11, 11))) == ((10, 10), (11, 11))  # too small to refine
+
+
+def test_motion_gate():
+    tracker = TrayTracker()
+    img = tray_frame()
+    for _ in range(10):
+        box, found = tracker(img)
+    assert found and close(box, TRAY, 2)
+    assert tracker.stats() == {"frames": 10, "detections": 1, "accepted": 1}  # a static tray is detected once
+
+    inner = img.copy()
+    inner[500:700, 800:1000] = 0  # a hand over the middle of the tray, away from its border
+    for _ in range(10):
+        tracker(inner)
+    assert tracker.stats()["detections"] == 1
+
+    moved = tray_frame(((530, 270), (1340, 880)))
+    for _ in range(tracker.min_interval):
+        box, found = tracker(moved)
+    assert tracker.stats()["detections"] == 2  # the border changed, detected again after min_interval frames
+    assert close(box, ((523, 263), (1333, 873)), 2)  # smoothed towards the new position with alpha 0.3
+
+    tracker.reset()
+    tracker(moved)
+    assert tracker.stats()["detections"] == 3  # a new video is detected on its first frame
@@ -36,12 +36,40 @@ from yolov8.ultralytics.yolo.data.utils import IMG_FORMATS, VID_FORMATS
 from yolov8.ultralytics.yolo.utils import DEFAULT_CFG, LOGGER, SETTINGS, callbacks, colorstr, ops
 from yolov8.ultralytics.yolo.utils.checks import check_file, check_imgsz, check_imshow, print_args, check_requirements
 from yolov8.ultralytics.yolo.utils.files import increment_path
+from yolov8.ultralytics.yolo.utils.metrics import box_iou
 from yolov8.ultralytics.yolo.utils.torch_utils import select_device
 from yolov8.ultralytics.yolo.utils.ops import Profile, non_max_suppression, scale_boxes, process_mask, \
     process_mask_native
 from yolov8.ultralytics.yolo.utils.plotting import Annotator, colors
 
 from trackers.multi_tracker_zoo import create_tracker
+from checkout_events import RETRO_WINDOW, CheckoutEvents
+from frame_cache import FrameCache, fingerprint
+from mot_writer import MOTWriter
+from profiler import StageProfiler
+from quantization import QUANT_MODES, calibration_crops, quantize, quantize_dynamic
+
+TRAY_MARGINS = (50, 180, 400, 100)  # pixels a box may stick out of the tray on the left, top, right and bottom
+
+
+def in_tray(bbox, tray, margins=TRAY_MARGINS):
+    left, top, right, bottom = margins
+    return (bbox[0] >= tray[0][0] - left and bbox[1] >= tray[0][1] - top and bbox[2] <= tray[1][0] + right and
+            bbox[3] <= tray[1][1] + bottom)
+
+
+def write_events(events, result_save, stream_events=False):
+    # Write the events of the tracks still held at the end of the video to result.txt
+    print(events.see)
+    if stream_events and events.n_rectified:
+        LOGGER.info(f'Checkout events: {events.n_rectified} of {events.n_tracks} items written while streaming')
+    lines = events.finalize()
+    if events.n_tracks:
+        # pass it as --event-avg-item to stream exactly the events of a batch run of this video
+        LOGGER.info(f'Checkout events: {events.sum_frame / events.n_tracks:.3f} votes per item')
+    with open(str(result_save), "a") as fd:
+        print("Writing")
+        fd.writelines(lines)
 
 
 @torch.no_grad()
@@ -81,15 +109,77 @@ def run(
         retina_masks=False,
         result_dir="",
         deblur_path="",
-        min_frame=18
+        min_frame=18,
+        seg_interval=1,  # run hand segmentation at least every n frames
+        seg_diff_thres=None,  # also run it when the mean frame difference to the last segmented frame exceeds this
+        seg_warp=False,  # warp the reused hand mask with optical flow instead of copying it
+        tray_roi=False,  # run hand segmentation and deblurring on the tray region only
+        roi_margin=100,  # pixels added around the tray box in tray_roi mode
+        async_deblur=False,  # deblur on a background thread, votes from restored frames are added when ready
+        deblur_queue=2,  # frames that may wait for the async deblur worker, further requests are dropped
+        models=None,  # preloaded models from load_models(), shared across videos
+        prefetch=0,  # frames decoded and preprocessed ahead on a background thread, 0 to decode inline
+        stream_events=False,  # write checkout events to result.txt as soon as their tracks are closed
+        event_avg_item=None,  # votes per item used for the thresholds of streamed events, running average if None
+        save_txt_format='txt',  # txt, npy or parquet
+        save_txt_buffer=4096,  # MOT rows buffered per sequence before they are written
+        tray_margins=TRAY_MARGINS,  # pixels a box may stick out of the tray (left, top, right, bottom) and still vote
+        deblur_weight=5,  # votes of a box seen in a deblurred frame
+        retro_window=RETRO_WINDOW,  # frames between a track and a predecessor it may be merged into
+        cache_dir='',  # frame cache root, '' to run without it
+        cache_max_gb=None,  # evict the least recently used cache entries beyond this size
+        cache_conf=0.1,  # NMS confidence floor of cached detections, replays may raise conf_thres above it
+        cache_masks=False,  # also cache the hand masks
+        replay=False,  # take detections, trays and embeddings from the frame cache, the models run on a miss only
+        reid_quant=None,  # INT8 StrongSORT ReID model on the CPU, 'dynamic' or 'static'
+        seg_quant=None,  # INT8 hand segmentor on the CPU, 'dynamic'
+        quant_calib=256,  # crops of the source video the static ReID quantization is calibrated on
+        cpu_threads=0,  # torch intra-op threads for CPU inference, 0 keeps the single thread set above
+        tray_scale=0.5,  # tray detection runs on the frame downscaled by this factor
+        tray_alpha=0.3,  # weight of a new tray detection in the smoothed tray box
+        tray_motion=4.0,  # re-detect the tray when the frame changed by more than this near its border (0-255)
+        deblur_sharpness=None,  # skip NAFNet on frames this sharp (Laplacian variance), None to always deblur
+        profile=False,  # time every pipeline stage, write trace.json (Chrome / Perfetto) and profile.txt to save_dir
 ):
     source = str(source)
+    if cpu_threads:
+        torch.set_num_threads(cpu_threads)
     save_img = not nosave and not source.endswith('.txt')  # save inference images
     is_file = Path(source).suffix[1:] in (VID_FORMATS)
     is_url = source.lower().startswith(('rtsp://', 'rtmp://', 'http://', 'https://'))
     webcam = source.isnumeric() or source.endswith('.txt') or (is_url and not is_file)
     if is_url and is_file:
         source = check_file(source)  # download
+    result_save = ROOT / "result.txt"
+    if result_dir != "":
+        result_save = str(result_dir).rstrip("/\\") + "/result.txt"
+
+    # Frame cache, keyed by the video content and everything that changes what the models output
+    cache, recorder = None, None
+    if cache_dir:
+        assert is_file and not is_url, 'the frame cache works on local video files'
+        cache = FrameCache(cache_dir, None if cache_max_gb is None else int(cache_max_gb * 1E9))
+        w = yolo_weights[0] if isinstance(yolo_weights, list) else yolo_weights
+        cache_fp = fingerprint(yolo_weights=Path(w), reid_weights=Path(reid_weights) if tracking_method == 'strongsort'
+                               else None, imgsz=imgsz, iou_thres=iou_thres, cache_conf=min(conf_thres, cache_conf),
+                               classes=classes, agnostic_nms=agnostic_nms, max_det=max_det, half=half,
+                               vid_stride=vid_stride, deblur_path=Path(deblur_path), seg_interval=seg_interval,
+                               seg_diff_thres=seg_diff_thres, seg_warp=seg_warp, tray_roi=tray_roi,
+                               roi_margin=roi_margin, async_deblur=async_deblur, retina_masks=retina_masks,
+                               reid_quant=reid_quant if tracking_method == 'strongsort' else None,
+                               seg_quant=seg_quant, tray_scale=tray_scale, tray_alpha=tray_alpha,
+                               tray_motion=tray_motion, deblur_sharpness=deblur_sharpness)
+        cached = cache.load(source, cache_fp) if replay else None
+        if cached is not None and (tracking_method != 'strongsort' or cached.embs is not None):
+            LOGGER.info(f'Replaying {source} from {cached.path}')
+            events = CheckoutEvents(source.split("_")[-1][:-4], window=retro_window, avg_item=event_avg_item)
+            replay_video(cached, events, tracking_method, tracking_config, reid_weights,
+                         select_device(device) if models is None else models['device'], half, conf_thres, classes,
+                         tray_margins, deblur_weight, stream_events, result_save,
+                         reid_model=None if models is None else models.get('reid'))
+            write_events(events, result_save, stream_events)
+            return
+        recorder = cache.recorder(source, cache_fp, masks=cache_masks and not prefetch, source=source)
 
     # Directories
     if not isinstance(yolo_weights, list):  # single yolo model
@@ -102,10 +192,15 @@ def run(
     save_dir = increment_path(Path(project) / exp_name, exist_ok=exist_ok)  # increment run
     (save_dir / 'tracks' if save_txt else save_dir).mkdir(parents=True, exist_ok=True)  # make dir
 
+    prof = StageProfiler(enabled=profile)
+
     # Load model
-    device = select_device(device)
+    if models is None:
+        device = select_device(device)
+        model = AutoBackend(yolo_weights, device=device, dnn=dnn, fp16=half)
+    else:
+        device, model = models['device'], models['yolo']
     is_seg = '-seg' in str(yolo_weights)
-    model = AutoBackend(yolo_weights, device=device, dnn=dnn, fp16=half)
     stride, names, pt = model.stride, model.names, model.pt
     imgsz = check_imgsz(imgsz, stride=stride)  # check image size
     # Dataloader
@@ -129,15 +224,35 @@ def run(
             auto=pt,
             transforms=getattr(model.model, 'transforms', None),
             vid_stride=vid_stride,
-            deblur_path=deblur_path
+            deblur_path=deblur_path,
+            seg_interval=seg_interval,
+            seg_diff_thres=seg_diff_thres,
+            seg_warp=seg_warp,
+            tray_roi=tray_roi,
+            roi_margin=roi_margin,
+            async_deblur=async_deblur,
+            deblur_queue=deblur_queue,
+            models=None if models is None else models['loader'],
+            prefetch=prefetch,
+            device=device,
+            seg_quantize=seg_quantizer(seg_quant),
+            tray_scale=tray_scale,
+            tray_alpha=tray_alpha,
+            tray_motion=tray_motion,
+            deblur_sharpness=deblur_sharpness,
+            profiler=prof if profile else None
         )
     vid_path, vid_writer, txt_path = [None] * bs, [None] * bs, [None] * bs
+    mot_writer = MOTWriter(save_txt_format, save_txt_buffer) if save_txt else None
     model.warmup(imgsz=(1 if pt or model.triton else bs, 3, *imgsz))  # warmup
 
     # Create as many strong sort instances as there are video sources
+    reid_model = None if models is None else models.get('reid')
+    if reid_model is None and reid_quant and tracking_method == 'strongsort':
+        reid_model = load_reid(reid_weights, device, half, reid_quant, source, quant_calib)
     tracker_list = []
     for i in range(bs):
-        tracker = create_tracker(tracking_method, tracking_config, reid_weights, device, half)
+        tracker = create_tracker(tracking_method, tracking_config, reid_weights, device, half, reid_model=reid_model)
         tracker_list.append(tracker, )
         if hasattr(tracker_list[i], 'model'):
             if hasattr(tracker_list[i].model, 'warmup'):
@@ -146,22 +261,55 @@ def run(
 
     # Run tracking
     # model.warmup(imgsz=(1 if pt else bs, 3, *imgsz))  # warmup
-    seen, windows, dt = 0, [], (Profile(), Profile(), Profile(), Profile())
+    seen, windows, dt = 0, [], (Profile(), Profile(), Profile(), Profile(), Profile())
     curr_frames, prev_frames = [None] * bs, [None] * bs
 
     # The dictionary that records the items that are seen by the network.
     # Entries are in the format of {unique_index:(timestamp_in_frame, {class: count})}
     # E.g. {"10": (870, {23: 115, 25: 3})} means id 10 object first enters the ROI tray at 870th frame,
     # it is classified as class_23 115 times, and class_25 3 times.
-    see = {}
-    # storing the keys to the seen dict in the order of time.
-    keys = []
+    # With stream_events, closed tracks are written and removed from it while the video is read.
+    vid_id = source.split("_")[-1][:-4]
+    events = CheckoutEvents(vid_id, window=retro_window, avg_item=event_avg_item)
+    see = events.see
+    # tracker outputs of frames still waiting for the async deblur worker, by the loader's frame index
+    deblur_history = {}
+
+    def fold_deblurred(wait=False):
+        # Detect on restored frames and give the tracks that voted at that frame the deblur weight for the class
+        # seen on the restored frame, in place of the single vote of the raw frame. A box thus ends up with
+        # deblur_weight votes, as on the synchronous path
+        for k, im_k, im0_k in dataset.deblurred(wait=wait):
+            outs = deblur_history.pop(k, None)
+            if outs is None or not len(outs):
+                continue
+            im_k = torch.from_numpy(im_k).to(device)
+            im_k = im_k.half() if half else im_k.float()
+            im_k = im_k[None] / 255.0
+            preds_k = model(im_k)
+            det_k = non_max_suppression(preds_k[0] if is_seg else preds_k, conf_thres, iou_thres, classes,
+                                        agnostic_nms, max_det=max_det)[0]
+            if not len(det_k):
+                continue
+            det_k[:, :4] = scale_boxes(im_k.shape[2:], det_k[:, :4], im0_k.shape).round()
+            iou = box_iou(torch.as_tensor(outs[:, :4], dtype=torch.float32), det_k[:, :4].float().cpu())
+            best_iou, best = iou.max(1)
+            for output, v, b in zip(outs, best_iou.tolist(), best.tolist()):
+                if v >= 0.5 and output[4] in see:
+                    d = see[output[4]][1]
+                    raw_cls = int(output[5])
+                    if d.get(raw_cls, 0) > 1:
+                        d[raw_cls] -= 1
+                    else:
+                        d.pop(raw_cls, None)
+                    cls_int = int(det_k[b, 5])
+                    d[cls_int] = d.get(cls_int, 0) + deblur_weight
 
-    for frame_idx, batch in enumerate(dataset):
+    for frame_idx, batch in enumerate(prof.iterate(dataset)):
         path, im, im0s, vid_cap, s, tray, deblur = batch
         dataset.set_deblur(False)
         visualize = increment_path(save_dir / Path(path[0]).stem, mkdir=True) if visualize else False
-        with dt[0]:
+        with dt[0], prof.stage('preprocess'):
             im = torch.from_numpy(im).to(device)
             im = im.half() if half else im.float()  # uint8 to fp16/32
             im /= 255.0  # 0 - 255 to 0.0 - 1.0
@@ -169,17 +317,22 @@ def run(
                 im = im[None]  # expand for batch dim
 
         # Inference
-        with dt[1]:
+        with dt[1], prof.stage('inference'):
             preds = model(im, augment=augment, visualize=visualize)
 
         # Apply NMS
-        with dt[2]:
+        with dt[2], prof.stage('nms'):
+            # when recording, keep the detections down to the cache floor and track the ones above conf_thres
+            nms_conf = conf_thres if recorder is None else min(conf_thres, cache_conf)
             if is_seg:
                 masks = []
-                p = non_max_suppression(preds[0], conf_thres, iou_thres, classes, agnostic_nms, max_det=max_det, nm=32)
+                p = non_max_suppression(preds[0], nms_conf, iou_thres, classes, agnostic_nms, max_det=max_det, nm=32)
                 proto = preds[1][-1]
             else:
-                p = non_max_suppression(preds, conf_thres, iou_thres, classes, agnostic_nms, max_det=max_det)
+                p = non_max_suppression(preds, nms_conf, iou_thres, classes, agnostic_nms, max_det=max_det)
+            p_all = p
+            if recorder is not None:
+                p = [x[x[:, 4] >= conf_thres] for x in p]
 
         # Process detections
         for i, det in enumerate(p):  # detections per image
@@ -211,7 +364,30 @@ def run(
 
             if hasattr(tracker_list[i], 'tracker') and hasattr(tracker_list[i].tracker, 'camera_update'):
                 if prev_frames[i] is not None and curr_frames[i] is not None:  # camera motion compensation
-                    tracker_list[i].tracker.camera_update(prev_frames[i], curr_frames[i])
+                    with dt[4], prof.stage('camera_motion'):
+                        tracker_list[i].tracker.camera_update(prev_frames[i], curr_frames[i])
+
+            embs = None
+            if recorder is not None:
+                with prof.stage('cache'):
+                    det_all = p_all[i][:, :6].clone()
+                    det_all[:, :4] = scale_boxes(im.shape[2:], det_all[:, :4], im0.shape).round()
+                    keep = (det_all[:, 4] >= conf_thres).cpu().numpy()
+                    embs_np = None
+                    if hasattr(tracker_list[i], 'features'):
+                        if len(det_all):
+                            embs = tracker_list[i].features(det_all[:, :4].cpu().numpy(), im0)
+                            embs_np = embs.cpu().numpy()
+                        else:  # recorded as a (0, D) block, so that every frame carries embeddings
+                            embs_np = np.zeros((0, 0), np.float32)
+                    hand_mask = getattr(getattr(dataset, 'h', None), 'last_mask', None) if cache_masks else None
+                    if hand_mask is not None and tray_roi:
+                        full = np.zeros(im0.shape[:2], dtype=bool)
+                        full[dataset.roi] = hand_mask != 0
+                        hand_mask = full
+                    recorder.add(det_all.cpu().numpy(), tray, deblur, embs_np,
+                                 getattr(getattr(tracker_list[i], 'tracker', None), 'warp_matrix', None), hand_mask,
+                                 shape=im0.shape)
 
             if det is not None and len(det):
                 if is_seg:
@@ -232,196 +408,256 @@ def run(
                     s += f"{n} {names[int(c)]}{'s' * (n > 1)}, "  # add to string
 
                 # pass detections to strongsort
-                with dt[3]:
-                    outputs[i] = tracker_list[i].update(det.cpu(), im0)
+                with dt[3], prof.stage('tracker'):
+                    if embs is not None:  # computed for the cache already
+                        outputs[i] = tracker_list[i].update(det.cpu(), im0, features=embs[keep])
+                    else:
+                        outputs[i] = tracker_list[i].update(det.cpu(), im0)
+                load_idx = getattr(dataset, 'last_index', frame_idx)  # the loader's index, restored frames carry it
+                if load_idx in getattr(dataset, 'pending', {}):  # restored copy of this frame is on its way
+                    # the outputs in the tray, the ones that vote below
+                    deblur_history[load_idx] = np.asarray(
+                        [o for o in outputs[i] if in_tray(o[0:4], tray, tray_margins)]).copy()
 
                 # draw boxes for visualization
                 if len(outputs[i]) > 0:
 
                     if is_seg:
                         # Mask plotting
-                        annotator.masks(
-                            masks[i],
-                            colors=[colors(x, True) for x in det[:, 5]],
-                            im_gpu=torch.as_tensor(im0, dtype=torch.float16).to(device).permute(2, 0, 1).flip(
-                                0).contiguous() /
-                                   255 if retina_masks else im[i]
+                        with prof.stage('annotate'):
+                            annotator.masks(
+                                masks[i],
+                                colors=[colors(x, True) for x in det[:, 5]],
+                                im_gpu=torch.as_tensor(im0, dtype=torch.float16).to(device).permute(2, 0, 1).flip(
+                                    0).contiguous() /
+                                       255 if retina_masks else im[i]
                         )
 
-                    for j, (output) in enumerate(outputs[i]):
-
-                        bbox = output[0:4]
-                        id = output[4]
-                        cls = output[5]
-                        conf = output[6]
-
-                        cls_int = int(cls)
-
-                        if (bbox[0] >= tray[0][0] - 50 and bbox[1] >= tray[0][1] - 180 and bbox[2] <= tray[1][0] + 400 and
-                                bbox[3] <= tray[1][1] + 100):  # in tray area
-                            # Entries are in the format of {unique_index:(timestamp_in_frame, {class: count})}
-                            if id in see:
-                                d = see[id][1]
-                                if cls_int in d:
-                                    if deblur:
-                                        d[cls_int] += 5
-                                    else:
-                                        d[cls_int] += 1
-                                else:
-                                    if deblur:
-                                        d[cls_int] = 5
-                                    else:
-                                        d[cls_int] = 1
-                            else:
-                                dataset.set_deblur(True)
-                                if deblur:
-                                    see[id] = (frame_idx, {cls_int: 5})
-                                else:
-                                    see[id] = (frame_idx, {cls_int: 1})
-                                keys.append(id)
-
-                        if save_txt:
-                            # to MOT format
-                            bbox_left = output[0]
-                            bbox_top = output[1]
-                            bbox_w = output[2] - output[0]
-                            bbox_h = output[3] - output[1]
-                            # Write MOT compliant results to file
-                            with open(txt_path + '.txt', 'a') as f:
-                                f.write(('%g ' * 10 + '\n') % (frame_idx + 1, id, bbox_left,  # MOT format
-                                                               bbox_top, bbox_w, bbox_h, -1, -1, -1, i))
-
-                        if save_vid or save_crop or show_vid:  # Add bbox/seg to image
-                            c = int(cls)  # integer class
-                            id = int(id)  # integer id
-                            label = None if hide_labels else (f'{id} {names[c]}' if hide_conf else \
-                                                                  (
-                                                                      f'{id} {conf:.2f}' if hide_class else f'{id} {names[c]} {conf:.2f}'))
-                            color = colors(c, True)
-                            annotator.box_label(bbox, label, color=color)
-
-
-                            if save_trajectories and tracking_method == 'strongsort':
-                                q = output[7]
-                                tracker_list[i].trajectory(im0, q, color=color)
-                            if save_crop:
-                                txt_file_name = txt_file_name if (isinstance(path, list) and len(path) > 1) else ''
-                                save_one_box(np.array(bbox, dtype=np.int16), imc,
-                                             file=save_dir / 'crops' / txt_file_name / names[
-                                                 c] / f'{id}' / f'{p.stem}.jpg', BGR=True)
+                    if save_txt:  # MOT format
+                        mot_outputs = np.asarray(outputs[i])
+                        with prof.stage('mot_write'):
+                            mot_writer.add(txt_path, frame_idx + 1, mot_outputs[:, :4], mot_outputs[:, 4], i)
+
+                    with prof.stage('annotate'):
+                        for j, (output) in enumerate(outputs[i]):
+
+                            bbox = output[0:4]
+                            id = output[4]
+                            cls = output[5]
+                            conf = output[6]
+
+                            cls_int = int(cls)
+
+                            if in_tray(bbox, tray, tray_margins):  # in tray area
+                                if events.vote(id, frame_idx, cls_int, deblur_weight if deblur else 1):  # new item
+                                    dataset.set_deblur(True, bbox)
+
+                            if save_vid or save_crop or show_vid:  # Add bbox/seg to image
+                                c = int(cls)  # integer class
+                                id = int(id)  # integer id
+                                label = None if hide_labels else (f'{id} {names[c]}' if hide_conf else \
+                                                                      (
+                                                                          f'{id} {conf:.2f}' if hide_class else f'{id} {names[c]} {conf:.2f}'))
+                                color = colors(c, True)
+                                annotator.box_label(bbox, label, color=color)
+
+
+                                if save_trajectories and tracking_method == 'strongsort':
+                                    q = output[7]
+                                    tracker_list[i].trajectory(im0, q, color=color)
+                                if save_crop:
+                                    txt_file_name = txt_file_name if (isinstance(path, list) and len(path) > 1) else ''
+                                    save_one_box(np.array(bbox, dtype=np.int16), imc,
+                                                 file=save_dir / 'crops' / txt_file_name / names[
+                                                     c] / f'{id}' / f'{p.stem}.jpg', BGR=True)
 
             else:
                 pass
                 # tracker_list[i].tracker.pred_n_update_all_tracks()
 
             # show tray label
-            annotator.box_label([tray[0][0], tray[0][1], tray[1][0], tray[1][1]], "tray", color=colors(0, True))
+            with prof.stage('annotate'):
+                annotator.box_label([tray[0][0], tray[0][1], tray[1][0], tray[1][1]], "tray", color=colors(0, True))
+                im0 = annotator.result()
             # Stream results
-            im0 = annotator.result()
-            if show_vid:
-                if platform.system() == 'Linux' and p not in windows:
-                    windows.append(p)
-                    cv2.namedWindow(str(p), cv2.WINDOW_NORMAL | cv2.WINDOW_KEEPRATIO)  # allow window resize (Linux)
-                    cv2.resizeWindow(str(p), im0.shape[1], im0.shape[0])
-                cv2.imshow(str(p), im0)
-                if cv2.waitKey(1) == ord('q'):  # 1 millisecond
-                    exit()
+            with prof.stage('show'):
+                if show_vid:
+                    if platform.system() == 'Linux' and p not in windows:
+                        windows.append(p)
+                        cv2.namedWindow(str(p), cv2.WINDOW_NORMAL | cv2.WINDOW_KEEPRATIO)  # allow window resize (Linux)
+                        cv2.resizeWindow(str(p), im0.shape[1], im0.shape[0])
+                    cv2.imshow(str(p), im0)
+                    if cv2.waitKey(1) == ord('q'):  # 1 millisecond
+                        exit()
 
             # Save results (image with detections)
-            if save_vid:
-                if vid_path[i] != save_path:  # new video
-                    vid_path[i] = save_path
-                    if isinstance(vid_writer[i], cv2.VideoWriter):
-                        vid_writer[i].release()  # release previous video writer
-                    if vid_cap:  # video
-                        fps = vid_cap.get(cv2.CAP_PROP_FPS)
-                        w = int(vid_cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                        h = int(vid_cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                    else:  # stream
-                        fps, w, h = 30, im0.shape[1], im0.shape[0]
-                    save_path = str(Path(save_path).with_suffix('.mp4'))  # force *.mp4 suffix on results videos
-                    vid_writer[i] = cv2.VideoWriter(save_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (w, h))
-                vid_writer[i].write(im0)
+            with prof.stage('video_write'):
+                if save_vid:
+                    if vid_path[i] != save_path:  # new video
+                        vid_path[i] = save_path
+                        if isinstance(vid_writer[i], cv2.VideoWriter):
+                            vid_writer[i].release()  # release previous video writer
+                        if vid_cap:  # video
+                            fps = vid_cap.get(cv2.CAP_PROP_FPS)
+                            w = int(vid_cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+                            h = int(vid_cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+                        else:  # stream
+                            fps, w, h = 30, im0.shape[1], im0.shape[0]
+                        save_path = str(Path(save_path).with_suffix('.mp4'))  # force *.mp4 suffix on results videos
+                        vid_writer[i] = cv2.VideoWriter(save_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (w, h))
+                    vid_writer[i].write(im0)
 
             prev_frames[i] = curr_frames[i]
+            if outputs[i] is not None and len(outputs[i]):
+                events.observe(frame_idx, [output[4] for output in outputs[i]])
+
+        if async_deblur:
+            with prof.stage('fold_deblurred'):
+                fold_deblurred()
+        if stream_events:
+            with prof.stage('events'):
+                lines = events.flush(frame_idx)
+            if lines:
+                with open(str(result_save), "a") as fd:
+                    fd.writelines(lines)
 
         # Print total time (preprocessing + inference + NMS + tracking)
         LOGGER.info(
             f"{s}{'' if len(det) else '(no detections), '}{sum([dt.dt for dt in dt if hasattr(dt, 'dt')]) * 1E3:.1f}ms")
 
+    if async_deblur:
+        fold_deblurred(wait=True)  # evidence of the last frames must land before the votes are counted
+        w = dataset.deblur_worker
+        LOGGER.info(f'Async deblur: {w.done} frames restored, {w.dropped} requests dropped on a full queue')
+    if not webcam:
+        c = dataset.deblur_counts
+        LOGGER.info(f"Deblur: {c['requested']} frames requested, {c['restored']} sent to NAFNet, "
+                    f"{c['sharp']} judged sharp and skipped")
+
     # Print results
     t = tuple(x.t / seen * 1E3 for x in dt)  # speeds per image
     LOGGER.info(
-        f'Speed: %.1fms pre-process, %.1fms inference, %.1fms NMS, %.1fms {tracking_method} update per image at shape {(1, 3, *imgsz)}' % t)
+        f'Speed: %.1fms pre-process, %.1fms inference, %.1fms NMS, %.1fms {tracking_method} update, '
+        f'%.1fms camera motion per image at shape {(1, 3, *imgsz)}' % t)
+    if getattr(dataset, 'prefetch', 0):
+        pf = dataset.prefetch_stats()
+        LOGGER.info(f"Prefetch: mean queue depth {pf['mean_depth']:.1f}/{prefetch}, queue empty on {pf['empty']} of "
+                    f"{pf['frames']} frames, {pf['stall'] * 1E3 / max(pf['frames'], 1):.1f}ms stall per image")
+    for tracker in tracker_list:
+        if hasattr(tracker, 'tracker') and hasattr(tracker.tracker, 'ecc_solves'):
+            LOGGER.info(f'Camera motion: {tracker.tracker.ecc_solves} ECC solves over {seen} frames')
+    if hasattr(dataset, 'h'):
+        seg_stats = dataset.h.scheduler.stats()
+        LOGGER.info(f"Hand segmentation: {seg_stats['segmented']} runs, {seg_stats['skipped']} skipped "
+                    f"({seg_stats['skipped'] / max(seg_stats['frames'], 1) * 100:.1f}%), "
+                    f"mask drift mean {seg_stats['mean_drift']:.3f} max {seg_stats['max_drift']:.3f}")
+    if profile:
+        prof.export_chrome_trace(save_dir / 'trace.json')
+        (save_dir / 'profile.txt').write_text(prof.table() + '\n')
+        LOGGER.info(f"Stage latency per frame in ms, trace saved to {save_dir / 'trace.json'}\n{prof.table()}")
+    if save_txt:
+        mot_writer.close()
     if save_txt or save_vid:
-        s = f"\n{len(list((save_dir / 'tracks').glob('*.txt')))} tracks saved to {save_dir / 'tracks'}" if save_txt else ''
+        s = f"\n{len(list((save_dir / 'tracks').glob('*' + mot_writer.suffix)))} tracks saved to {save_dir / 'tracks'}" if save_txt else ''
         LOGGER.info(f"Results saved to {colorstr('bold', save_dir)}{s}")
     if update:
         strip_optimizer(yolo_weights)  # update model (to fix SourceChangeWarning)
 
-    print(see)
-    keys.sort()
-    prev_tstamp = -1
-    prev_cls = -1
-    prev_count = -1
-    sum_frame = 0
-    wait = 5
-    for j in range(len(keys) - 1, -1, -1):  # backwards
-        tstamp, cls_d = see[keys[j]]
-        max_cls = max(cls_d, key=cls_d.get)
-        sum_frame += cls_d[max_cls]
-        for retro in range(1, 4):
-            nxt_key = keys[j - retro] if j - retro >= 0 else -1
-            if nxt_key != -1:
-                ntstamp, ncls_d = see[keys[j - retro]]
-                nmax_cls = max(ncls_d, key=ncls_d.get)
-                if nmax_cls == max_cls and (tstamp - ntstamp - ncls_d[nmax_cls]) < 250:
-                    ncls_d[nmax_cls] += cls_d[max_cls]
-                    cls_d[max_cls] = 0
-                    break
-
-    avg_item = sum_frame / len(keys)
-    threshold = int(sum_frame / len(keys))
-    if threshold > 18:
-        threshold = 18
-        wait = 15
-    else:
-        threshold = min(10, threshold)
-    result_save = ROOT / "result.txt"
-    if result_dir != "":
-        result_save = str(result_dir).rstrip("/\\") + "/result.txt"
-    with open(str(result_save), "a") as fd:
-        print("Writing")
-        vid_id = source.split("_")[-1][:-4]
-        for i in keys:
-            tstamp, cls_d = see[i]
-            x = sorted(((v,k) for k,v in cls_d.items()))
-            max_cls = x[-1][1]
-            if cls_d[max_cls] > threshold:  # The count for this classification is > threshold
-                frames = cls_d[max_cls]
-                added_frames = (frames // 10) if frames < 50 else 5
-                if len(x) > 1 and cls_d[x[-2][1]] > avg_item + 10:
-                    fd.write("{} {} {}\n".format(vid_id, x[-2][1] + 1, int(tstamp + wait - avg_item)))
-                if prev_cls == -1:
-                    prev_cls = max_cls
-                    prev_tstamp = tstamp
-                    prev_count = cls_d[max_cls]
-                    fd.write("{} {} {}\n".format(vid_id, max_cls+1, tstamp+wait+added_frames))
-                else:
-                    if (prev_cls == max_cls and (tstamp - prev_tstamp - prev_count) < 60) or ((tstamp - prev_tstamp) < 9 and (tstamp - prev_tstamp) >= 0):
-                        # Enforcing that if you are writing consecutive entries with the same item
-                        # there must be a time gap larger than threshold frames.
-                        if tstamp + cls_d[max_cls] > prev_tstamp + prev_count:
-                            prev_tstamp = tstamp
-                            prev_count = cls_d[max_cls]
-                        continue
-                    else:
-                        prev_cls = max_cls
-                        prev_tstamp = tstamp
-                        prev_count = cls_d[max_cls]
-                        fd.write("{} {} {}\n".format(vid_id, max_cls + 1, tstamp+5))
+    if recorder is not None:
+        LOGGER.info(f'Frame cache: {len(recorder.dets)} frames saved to {recorder.save()}')
+    write_events(events, result_save, stream_events)
+
+
+def replay_video(cached, events, tracking_method, tracking_config, reid_weights, device, half, conf_thres, classes,
+                 tray_margins, deblur_weight, stream_events, result_save, reid_model=None):
+    """
+    Track a video from its frame cache and collect the votes into events, like run() but without any model.
+    A frame is deblurred when a new item entered the tray on the previous one. Frames whose cached detections come
+    from the other variant (the parameters changed when deblurring kicks in) are used as they are and counted.
+    """
+    assert tracking_method in ('strongsort', 'bytetrack', 'ocsort'), f'{tracking_method} needs the frames to track'
+    tracker = create_tracker(tracking_method, tracking_config, reid_weights, device, half, reid_model=reid_model)
+    shape_img = np.broadcast_to(np.zeros((), np.uint8), cached.shape)  # trackers only read the image shape
+    outputs, deblur, mismatched = [], False, 0
+    for frame_idx in range(len(cached)):
+        det, embs, tray, was_deblurred, warp = cached.frame(frame_idx)
+        mismatched += deblur != was_deblurred
+        keep = det[:, 4] >= conf_thres
+        if classes is not None:
+            keep &= np.isin(det[:, 5], classes)
+        if warp is not None and hasattr(tracker, 'tracker') and hasattr(tracker.tracker, 'camera_update'):
+            tracker.tracker.camera_update(None, None, matrix=warp)
+        new_item = False
+        if keep.any():
+            det = torch.from_numpy(det[keep])
+            if tracking_method == 'strongsort':
+                outputs = tracker.update(det, shape_img, features=torch.from_numpy(embs[keep]))
+            else:
+                outputs = tracker.update(det, shape_img)
+            for output in outputs:
+                if in_tray(output[0:4], tray, tray_margins):
+                    new_item |= events.vote(output[4], frame_idx, int(output[5]), deblur_weight if deblur else 1)
+        deblur = new_item
+        if len(outputs):
+            events.observe(frame_idx, [output[4] for output in outputs])
+        if stream_events:
+            lines = events.flush(frame_idx)
+            if lines:
+                with open(str(result_save), "a") as fd:
+                    fd.writelines(lines)
+    LOGGER.info(f'Replay: {len(cached)} frames, {mismatched} with detections of the other deblur variant')
+
+
+def load_reid(reid_weights, device, half=False, reid_quant=None, source='', quant_calib=256):
+    """
+    The StrongSORT ReID backbone. With reid_quant its PyTorch model is replaced by the INT8 CPU variant, 'static'
+    calibrates the activation ranges on quant_calib crops of the source video.
+    """
+    from trackers.strongsort.reid_multibackend import ReIDDetectMultiBackend
+    reid = ReIDDetectMultiBackend(weights=reid_weights, device=device, fp16=half and not reid_quant)
+    if reid_quant:
+        assert reid.pt and device.type == 'cpu', 'INT8 ReID needs PyTorch ReID weights and --device cpu'
+        calib = None
+        if reid_quant == 'static':
+            crops = calibration_crops(source, quant_calib)
+            calib = [reid._preprocess(crops[i:i + 32]) for i in range(0, len(crops), 32)]
+        reid.model = quantize(reid.model, reid_quant, calib)
+        LOGGER.info(f'ReID model quantized to INT8 ({reid_quant})')
+    return reid
+
+
+def seg_quantizer(seg_quant=None):
+    # The quantizer of the hand segmentor handed to LoadImages. Dynamic only, INT8 weights for the Linear layers of
+    # the Swin backbone and the heads, the Swin backbone can not be traced for static quantization
+    assert seg_quant in (None, 'dynamic'), f'the hand segmentor supports dynamic quantization only, not {seg_quant}'
+    return quantize_dynamic if seg_quant else None
+
+
+def load_models(yolo_weights, reid_weights, tracking_method, device='', half=False, dnn=False, deblur_path="",
+                seg_interval=1, seg_diff_thres=None, seg_warp=False, reid_quant=None, seg_quant=None, source='',
+                quant_calib=256, cpu_threads=0, **kwargs):
+    """
+    Load the models that keep no per-video state (YOLO, the StrongSORT ReID backbone, NAFNet and the hand
+    segmentor) so that several videos can be tracked in one process:
+        models = load_models(**vars(opt))
+        run(**vars(opt), models=models)
+    Trackers themselves are still created fresh for every video. The static ReID quantization is calibrated on
+    `source`, the first video of the batch.
+    """
+    if cpu_threads:
+        torch.set_num_threads(cpu_threads)
+    device = select_device(device)
+    models = {
+        'device': device,
+        'yolo': AutoBackend(yolo_weights, device=device, dnn=dnn, fp16=half),
+        'loader': LoadImages.load_models(deblur_path, seg_interval, seg_diff_thres, seg_warp, device,
+                                         seg_quantizer(seg_quant))}
+    if tracking_method == 'strongsort':
+        models['reid'] = load_reid(reid_weights, device, half, reid_quant, source, quant_calib)
+    return models
+
 
-def parse_opt():
+def parse_opt(args=None):
     parser = argparse.ArgumentParser()
     parser.add_argument('--yolo-weights', nargs='+', type=Path, default=WEIGHTS / 'yolov8s-seg.pt',
                         help='model.pt path(s)')
@@ -436,6 +672,9 @@ def parse_opt():
     parser.add_argument('--device', default='', help='cuda device, i.e. 0 or 0,1,2,3 or cpu')
     parser.add_argument('--show-vid', action='store_true', help='display tracking video results')
     parser.add_argument('--save-txt', action='store_true', help='save results to *.txt')
+    parser.add_argument('--save-txt-format', type=str, default='txt', choices=('txt', 'npy', 'parquet'),
+                        help='file format of --save-txt tracks, parquet requires pyarrow')
+    parser.add_argument('--save-txt-buffer', type=int, default=4096, help='MOT rows buffered per track file')
     parser.add_argument('--save-conf', action='store_true', help='save confidences in --save-txt labels')
     parser.add_argument('--save-crop', action='store_true', help='save cropped prediction boxes')
     parser.add_argument('--save-trajectories', action='store_true', help='save trajectories for each track')
@@ -461,7 +700,44 @@ def parse_opt():
     parser.add_argument('--result-dir', help='where to save the result.txt file', default="", type=str)
     parser.add_argument('--deblur-path', help='path to pretrained deblur NAFNet file', default="/content/AICityChallenge/NAFNet/experiments/pretrained_models/NAFNet-REDS-width64.pth", type=str)
     parser.add_argument('--min-frame', help='minimum number of frame for a detection', default=18, type=int)
-    opt = parser.parse_args()
+    parser.add_argument('--seg-interval', type=int, default=1, help='run hand segmentation at least every n frames')
+    parser.add_argument('--seg-diff-thres', type=float, default=None,
+                        help='re-run hand segmentation when the mean frame difference exceeds this (0-255)')
+    parser.add_argument('--seg-warp', action='store_true', help='warp reused hand masks with optical flow')
+    parser.add_argument('--tray-roi', action='store_true', help='hand segmentation and deblurring on the tray only')
+    parser.add_argument('--roi-margin', type=int, default=100, help='pixels added around the tray box for --tray-roi')
+    parser.add_argument('--async-deblur', action='store_true', help='deblur on a background thread')
+    parser.add_argument('--deblur-queue', type=int, default=2, help='max frames waiting for the async deblur worker')
+    parser.add_argument('--prefetch', type=int, default=0, help='frames to decode and preprocess ahead, 0 to disable')
+    parser.add_argument('--tray-scale', type=float, default=0.5, help='downscale factor of the tray detection')
+    parser.add_argument('--tray-alpha', type=float, default=0.3, help='weight of a new detection in the tray box')
+    parser.add_argument('--tray-motion', type=float, default=4.0,
+                        help='re-detect the tray when the frame changed by more than this near its border (0-255)')
+    parser.add_argument('--tray-margins', nargs=4, type=int, default=list(TRAY_MARGINS),
+                        help='pixels a box may stick out of the tray on the left, top, right and bottom')
+    parser.add_argument('--profile', action='store_true',
+                        help='time every pipeline stage, save a Chrome / Perfetto trace and a latency table')
+    parser.add_argument('--deblur-sharpness', type=float, default=None,
+                        help='Laplacian variance of the item boxes from which a frame is not deblurred')
+    parser.add_argument('--deblur-weight', type=int, default=5, help='votes of a box seen in a deblurred frame')
+    parser.add_argument('--retro-window', type=int, default=RETRO_WINDOW,
+                        help='frames between a track and a predecessor it may be merged into')
+    parser.add_argument('--cache-dir', type=str, default='', help='frame cache directory, empty to disable')
+    parser.add_argument('--cache-max-gb', type=float, default=None, help='evict old frame cache entries beyond this')
+    parser.add_argument('--cache-conf', type=float, default=0.1, help='confidence floor of cached detections')
+    parser.add_argument('--cache-masks', action='store_true', help='also cache hand masks (not with --prefetch)')
+    parser.add_argument('--replay', action='store_true', help='track from the frame cache, run the models on a miss')
+    parser.add_argument('--reid-quant', type=str, default=None, choices=QUANT_MODES,
+                        help='INT8 StrongSORT ReID model, needs --device cpu')
+    parser.add_argument('--seg-quant', type=str, default=None, choices=('dynamic',),
+                        help='INT8 hand segmentor, needs --device cpu')
+    parser.add_argument('--quant-calib', type=int, default=256, help='source video crops to calibrate --reid-quant static')
+    parser.add_argument('--cpu-threads', type=int, default=0, help='torch threads for CPU inference, 0 for one')
+    parser.add_argument('--stream-events', action='store_true',
+                        help='write checkout events as soon as their tracks are closed instead of at the end')
+    parser.add_argument('--event-avg-item', type=float, default=None,
+                        help='votes per item for the thresholds of streamed events, running average by default')
+    opt = parser.parse_args(args)
     opt.imgsz *= 2 if len(opt.imgsz) == 1 else 1  # expand
     opt.tracking_config = ROOT / 'trackers' / opt.tracking_method / 'configs' / (opt.tracking_method + '.yaml')
     print_args(vars(opt))
@@ -12,6 +12,7 @@ from yolov8.ultralytics.yolo.utils.ops import xywh2xyxy, xyxy2xywh
 from trackers.bytetrack.kalman_filter import KalmanFilter
 from trackers.bytetrack import matching
 from trackers.bytetrack.basetrack import BaseTrack, TrackState
+from trackers.bytetrack.track_table import TrackTable
 
 class STrack(BaseTrack):
     shared_kalman = KalmanFilter()
@@ -150,9 +151,8 @@ class STrack(BaseTrack):
 
 class BYTETracker(object):
     def __init__(self, track_thresh=0.45, match_thresh=0.8, track_buffer=25, frame_rate=30):
-        self.tracked_stracks = []  # type: list[STrack]
-        self.lost_stracks = []  # type: list[STrack]
-        self.removed_stracks = []  # type: list[STrack]
+        # tracked, lost and removed tracks are rows of one table, see TrackTable
+        self.tracks = TrackTable()
 
         self.frame_id = 0
         self.track_buffer=track_buffer
@@ -164,8 +164,41 @@ class BYTETracker(object):
         self.max_time_lost = self.buffer_size
         self.kalman_filter = KalmanFilter()
 
+    def multi_predict(self, rows):
+        """STrack.multi_predict on table rows"""
+        if len(rows) > 0:
+            T = self.tracks
+            multi_mean = T.mean[rows].copy()
+            multi_mean[T.state[rows] != TrackState.Tracked, 7] = 0
+            T.mean[rows], T.covariance[rows] = STrack.shared_kalman.multi_predict(multi_mean, T.covariance[rows])
+
+    def update_track(self, row, tlwh, score, cls=None):
+        """STrack.update of a row, or STrack.re_activate when the class of the detection is given"""
+        T = self.tracks
+        T.mean[row], T.covariance[row] = self.kalman_filter.update(
+            T.mean[row], T.covariance[row], STrack.tlwh_to_xyah(tlwh))
+        T.tracklet_len[row] = 0 if cls is not None else T.tracklet_len[row] + 1
+        T.state[row] = TrackState.Tracked
+        T.is_activated[row] = True
+        T.frame_id[row] = self.frame_id
+        T.score[row] = score
+        if cls is not None:
+            T.cls[row] = cls
+
+    def remove_duplicate_stracks(self):
+        # Of a tracked and a lost track that overlap, keep the one that has been tracked for longer
+        T = self.tracks
+        stracksa, stracksb = T.tracked, T.lost
+        pdist = box_iou_distance(T.tlbr(stracksa), T.tlbr(stracksb))
+        p, q = np.where(pdist < 0.15)
+        timep = T.frame_id[stracksa[p]] - T.start_frame[stracksa[p]]
+        timeq = T.frame_id[stracksb[q]] - T.start_frame[stracksb[q]]
+        T.in_lost[stracksb[q[timep > timeq]]] = False
+        T.in_tracked[stracksa[p[timep <= timeq]]] = False
+
     def update(self, dets, _):
         self.frame_id += 1
+        T = self.tracks
         activated_starcks = []
         refind_stracks = []
         lost_stracks = []
@@ -186,169 +219,133 @@ class BYTETracker(object):
 
         inds_second = np.logical_and(inds_low, inds_high)
         
-        dets_second = xywh[inds_second]
-        dets = xywh[remain_inds]
+        # detections stay arrays, in the float32 an STrack would hold them
+        dets_second = np.asarray(xywh[inds_second], dtype=np.float32)
+        dets = np.asarray(xywh[remain_inds], dtype=np.float32)
         
         scores_keep = confs[remain_inds]
         scores_second = confs[inds_second]
         
         clss_keep = classes[remain_inds]
         clss_second = classes[inds_second]
-        
-
-        if len(dets) > 0:
-            '''Detections'''
-            detections = [STrack(xyxy, s, c) for 
-                (xyxy, s, c) in zip(dets, scores_keep, clss_keep)]
-        else:
-            detections = []
 
         ''' Add newly detected tracklets to tracked_stracks'''
-        unconfirmed = []
-        tracked_stracks = []  # type: list[STrack]
-        for track in self.tracked_stracks:
-            if not track.is_activated:
-                unconfirmed.append(track)
-            else:
-                tracked_stracks.append(track)
+        tracked = T.tracked
+        unconfirmed = tracked[~T.is_activated[tracked]]
+        tracked_stracks = tracked[T.is_activated[tracked]]
+        prev_lost = T.lost
 
         ''' Step 2: First association, with high score detection boxes'''
-        strack_pool = joint_stracks(tracked_stracks, self.lost_stracks)
+        strack_pool = np.concatenate([tracked_stracks, prev_lost])
         # Predict the current location with KF
-        STrack.multi_predict(strack_pool)
-        dists = matching.iou_distance(strack_pool, detections)
+        self.multi_predict(strack_pool)
+        dists = box_iou_distance(T.tlbr(strack_pool), tlwh_to_tlbr_batch(dets))
         #if not self.args.mot20:
-        dists = matching.fuse_score(dists, detections)
+        dists = fuse_det_score(dists, scores_keep)
         matches, u_track, u_detection = matching.linear_assignment(dists, thresh=self.match_thresh)
 
         for itracked, idet in matches:
-            track = strack_pool[itracked]
-            det = detections[idet]
-            if track.state == TrackState.Tracked:
-                track.update(detections[idet], self.frame_id)
-                activated_starcks.append(track)
+            row = strack_pool[itracked]
+            if T.state[row] == TrackState.Tracked:
+                self.update_track(row, dets[idet], scores_keep[idet])
+                activated_starcks.append(row)
             else:
-                track.re_activate(det, self.frame_id, new_id=False)
-                refind_stracks.append(track)
+                self.update_track(row, dets[idet], scores_keep[idet], clss_keep[idet])
+                refind_stracks.append(row)
 
         ''' Step 3: Second association, with low score detection boxes'''
         # association the untrack to the low score detections
-        if len(dets_second) > 0:
-            '''Detections'''
-            detections_second = [STrack(xywh, s, c) for (xywh, s, c) in zip(dets_second, scores_second, clss_second)]
-        else:
-            detections_second = []
-        r_tracked_stracks = [strack_pool[i] for i in u_track if strack_pool[i].state == TrackState.Tracked]
-        dists = matching.iou_distance(r_tracked_stracks, detections_second)
+        r_tracked_stracks = strack_pool[np.asarray(u_track, dtype=np.int64)]
+        r_tracked_stracks = r_tracked_stracks[T.state[r_tracked_stracks] == TrackState.Tracked]
+        dists = box_iou_distance(T.tlbr(r_tracked_stracks), tlwh_to_tlbr_batch(dets_second))
         matches, u_track, u_detection_second = matching.linear_assignment(dists, thresh=0.5)
         for itracked, idet in matches:
-            track = r_tracked_stracks[itracked]
-            det = detections_second[idet]
-            if track.state == TrackState.Tracked:
-                track.update(det, self.frame_id)
-                activated_starcks.append(track)
-            else:
-                track.re_activate(det, self.frame_id, new_id=False)
-                refind_stracks.append(track)
+            row = r_tracked_stracks[itracked]
+            self.update_track(row, dets_second[idet], scores_second[idet])
+            activated_starcks.append(row)
 
         for it in u_track:
-            track = r_tracked_stracks[it]
-            if not track.state == TrackState.Lost:
-                track.mark_lost()
-                lost_stracks.append(track)
+            row = r_tracked_stracks[it]
+            if not T.state[row] == TrackState.Lost:
+                T.state[row] = TrackState.Lost
+                lost_stracks.append(row)
 
         '''Deal with unconfirmed tracks, usually tracks with only one beginning frame'''
-        detections = [detections[i] for i in u_detection]
-        dists = matching.iou_distance(unconfirmed, detections)
+        remaining = np.asarray(u_detection, dtype=np.int64)
+        dists = box_iou_distance(T.tlbr(unconfirmed), tlwh_to_tlbr_batch(dets[remaining]))
         #if not self.args.mot20:
-        dists = matching.fuse_score(dists, detections)
+        dists = fuse_det_score(dists, scores_keep[remaining])
         matches, u_unconfirmed, u_detection = matching.linear_assignment(dists, thresh=0.7)
         for itracked, idet in matches:
-            unconfirmed[itracked].update(detections[idet], self.frame_id)
+            self.update_track(unconfirmed[itracked], dets[remaining[idet]], scores_keep[remaining[idet]])
             activated_starcks.append(unconfirmed[itracked])
         for it in u_unconfirmed:
-            track = unconfirmed[it]
-            track.mark_removed()
-            removed_stracks.append(track)
+            row = unconfirmed[it]
+            T.state[row] = TrackState.Removed
+            removed_stracks.append(row)
 
         """ Step 4: Init new stracks"""
         for inew in u_detection:
-            track = detections[inew]
-            if track.score < self.det_thresh:
+            i = remaining[inew]
+            if scores_keep[i] < self.det_thresh:
                 continue
-            track.activate(self.kalman_filter, self.frame_id)
-            activated_starcks.append(track)
+            mean, covariance = self.kalman_filter.initiate(STrack.tlwh_to_xyah(dets[i]))
+            row = T.add(BaseTrack.next_id(), mean, covariance, scores_keep[i], clss_keep[i], self.frame_id,
+                        is_activated=self.frame_id == 1)
+            activated_starcks.append(row)
         """ Step 5: Update state"""
-        for track in self.lost_stracks:
-            if self.frame_id - track.end_frame > self.max_time_lost:
-                track.mark_removed()
-                removed_stracks.append(track)
+        expired = prev_lost[self.frame_id - T.frame_id[prev_lost] > self.max_time_lost]
+        T.state[expired] = TrackState.Removed
+        removed_stracks.extend(expired)
 
         # print('Ramained match {} s'.format(t4-t3))
 
-        self.tracked_stracks = [t for t in self.tracked_stracks if t.state == TrackState.Tracked]
-        self.tracked_stracks = joint_stracks(self.tracked_stracks, activated_starcks)
-        self.tracked_stracks = joint_stracks(self.tracked_stracks, refind_stracks)
-        self.lost_stracks = sub_stracks(self.lost_stracks, self.tracked_stracks)
-        self.lost_stracks.extend(lost_stracks)
-        self.lost_stracks = sub_stracks(self.lost_stracks, self.removed_stracks)
-        self.removed_stracks.extend(removed_stracks)
-        self.tracked_stracks, self.lost_stracks = remove_duplicate_stracks(self.tracked_stracks, self.lost_stracks)
+        # tracked_stracks: members still tracked, then the activated and refound tracks that were not members yet
+        n = len(T)
+        T.in_tracked[:n] &= T.state[:n] == TrackState.Tracked
+        joined = [row for row in activated_starcks + refind_stracks if not T.in_tracked[row]]
+        T.sequence(joined)
+        T.in_tracked[joined] = True
+        # lost_stracks: members that are not tracked, then the newly lost tracks, minus the tracks removed in
+        # earlier frames (the ones removed in this frame stay in the list until the next one)
+        T.in_lost[:n] &= ~T.in_tracked[:n]
+        T.sequence(lost_stracks)
+        T.in_lost[lost_stracks] = True
+        T.in_lost[:n] &= ~T.in_removed[:n]
+        T.in_removed[removed_stracks] = True
+        self.remove_duplicate_stracks()
         # get scores of lost tracks
-        output_stracks = [track for track in self.tracked_stracks if track.is_activated]
+        output_stracks = T.tracked
+        output_stracks = output_stracks[T.is_activated[output_stracks]]
+        xyxys = xywh2xyxy(T.tlwh(output_stracks))
         outputs = []
-        for t in output_stracks:
-            output= []
-            tlwh = t.tlwh
-            tid = t.track_id
-            tlwh = np.expand_dims(tlwh, axis=0)
-            xyxy = xywh2xyxy(tlwh)
-            xyxy = np.squeeze(xyxy, axis=0)
-            output.extend(xyxy)
-            output.append(tid)
-            output.append(t.cls)
-            output.append(t.score)
+        for xyxy, tid, cls, score in zip(xyxys, T.track_id[output_stracks], T.cls[output_stracks],
+                                         T.score[output_stracks]):
+            output = list(xyxy)
+            output.append(int(tid))
+            output.append(cls)
+            output.append(score)
             outputs.append(output)
+        # tracks that left both lists are never matched again
+        T.compact()
 
         return outputs
 #track_id, class_id, conf
 
-def joint_stracks(tlista, tlistb):
-    exists = {}
-    res = []
-    for t in tlista:
-        exists[t.track_id] = 1
-        res.append(t)
-    for t in tlistb:
-        tid = t.track_id
-        if not exists.get(tid, 0):
-            exists[tid] = 1
-            res.append(t)
-    return res
-
-
-def sub_stracks(tlista, tlistb):
-    stracks = {}
-    for t in tlista:
-        stracks[t.track_id] = t
-    for t in tlistb:
-        tid = t.track_id
-        if stracks.get(tid, 0):
-            del stracks[tid]
-    return list(stracks.values())
-
-
-def remove_duplicate_stracks(stracksa, stracksb):
-    pdist = matching.iou_distance(stracksa, stracksb)
-    pairs = np.where(pdist < 0.15)
-    dupa, dupb = list(), list()
-    for p, q in zip(*pairs):
-        timep = stracksa[p].frame_id - stracksa[p].start_frame
-        timeq = stracksb[q].frame_id - stracksb[q].start_frame
-        if timep > timeq:
-            dupb.append(q)
-        else:
-            dupa.append(p)
-    resa = [t for i, t in enumerate(stracksa) if not i in dupa]
-    resb = [t for i, t in enumerate(stracksb) if not i in dupb]
-    return resa, resb
+
+def tlwh_to_tlbr_batch(tlwh):
+    ret = np.asarray(tlwh).copy()
+    ret[:, 2:] += ret[:, :2]
+    return ret
+
+
+def box_iou_distance(atlbrs, btlbrs):
+    # matching.iou_distance of (n, 4) and (m, 4) tlbr arrays
+    return 1 - matching.ious(atlbrs, btlbrs)
+
+
+def fuse_det_score(cost_matrix, scores):
+    # matching.fuse_score with the detection scores as an array
+    if cost_matrix.size == 0:
+        return cost_matrix
+    return 1 - (1 - cost_matrix) * np.asarray(scores)[None, :]
@@ -0,0 +1,108 @@
+"""
+    Track table of ByteTrack. Every track is a row of column arrays (Kalman mean and covariance, state, score, ...)
+    instead of an STrack object, and the tracked / lost / removed lists of BYTETracker are membership masks:
+
+        in_tracked   row is in tracked_stracks
+        in_lost      row is in lost_stracks
+        in_removed   row was added to removed_stracks once
+
+    so that joint_stracks / sub_stracks become mask operations. The lists keep their order through `seq`, a row gets a
+    new sequence number when it enters a list. Rows that are in neither list can never be matched again and are
+    dropped by compact(), which keeps the table as large as the live tracks over arbitrarily long videos.
+"""
+import numpy as np
+
+from trackers.bytetrack.basetrack import TrackState
+
+
+class TrackTable(object):
+    def __init__(self, capacity=64):
+        self.n = 0
+        self.next_seq = 0
+        self.track_id = np.zeros(capacity, dtype=np.int64)
+        self.state = np.full(capacity, TrackState.New, dtype=np.int8)
+        self.is_activated = np.zeros(capacity, dtype=bool)
+        self.in_tracked = np.zeros(capacity, dtype=bool)
+        self.in_lost = np.zeros(capacity, dtype=bool)
+        self.in_removed = np.zeros(capacity, dtype=bool)
+        self.seq = np.zeros(capacity, dtype=np.int64)
+        self.mean = np.zeros((capacity, 8))
+        self.covariance = np.zeros((capacity, 8, 8))
+        self.score = np.zeros(capacity, dtype=np.float32)
+        self.cls = np.zeros(capacity, dtype=np.float32)
+        self.frame_id = np.zeros(capacity, dtype=np.int64)
+        self.start_frame = np.zeros(capacity, dtype=np.int64)
+        self.tracklet_len = np.zeros(capacity, dtype=np.int64)
+
+    COLUMNS = ('track_id', 'state', 'is_activated', 'in_tracked', 'in_lost', 'in_removed', 'seq', 'mean', 'covariance',
+               'score', 'cls', 'frame_id', 'start_frame', 'tracklet_len')
+
+    def __len__(self):
+        return self.n
+
+    def _grow(self):
+        for name in self.COLUMNS:
+            col = getattr(self, name)
+            setattr(self, name, np.concatenate([col, np.zeros_like(col)]))
+
+    def add(self, track_id, mean, covariance, score, cls, frame_id, is_activated):
+        """
+        Append a new track in state Tracked and return its row
+        """
+        if self.n == len(self.track_id):
+            self._grow()
+        row = self.n
+        self.n += 1
+        self.track_id[row] = track_id
+        self.state[row] = TrackState.Tracked
+        self.is_activated[row] = is_activated
+        self.in_tracked[row] = self.in_lost[row] = self.in_removed[row] = False
+        self.mean[row] = mean
+        self.covariance[row] = covariance
+        self.score[row] = score
+        self.cls[row] = cls
+        self.frame_id[row] = self.start_frame[row] = frame_id
+        self.tracklet_len[row] = 0
+        return row
+
+    def sequence(self, rows):
+        # Move rows to the end of their list, in the given order
+        rows = np.asarray(rows, dtype=np.int64)
+        self.seq[rows] = self.next_seq + np.arange(len(rows))
+        self.next_seq += len(rows)
+
+    def ordered(self, mask):
+        # Rows of a membership mask in list order
+        rows = np.flatnonzero(mask[:self.n])
+        return rows[np.argsort(self.seq[rows], kind='stable')]
+
+    @property
+    def tracked(self):
+        return self.ordered(self.in_tracked)
+
+    @property
+    def lost(self):
+        return self.ordered(self.in_lost)
+
+    def tlwh(self, rows):
+        ret = self.mean[rows, :4].copy()
+        ret[:, 2] *= ret[:, 3]
+        ret[:, :2] -= ret[:, 2:] / 2
+        return ret
+
+    def tlbr(self, rows):
+        ret = self.tlwh(rows)
+        ret[:, 2:] += ret[:, :2]
+        return ret
+
+    def compact(self):
+        """
+        Drop the rows that are in neither the tracked nor the lost list
+        """
+        keep = np.flatnonzero(self.in_tracked[:self.n] | self.in_lost[:self.n])
+        if len(keep) == self.n:
+            return
+        for name in self.COLUMNS:
+            col = getattr(self, name)
+            col[:len(keep)] = col[keep]
+        self.n = len(keep)
@@ -11,9 +11,13 @@ import numpy as np
 
 
 class EmbeddingComputer:
-    def __init__(self, dataset):
+    def __init__(self, dataset, device=None):
         self.model = None
         self.dataset = dataset
+        # half precision on the GPU, FP32 on CPU-only boxes
+        self.device = torch.device(device) if device is not None else \
+            torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        self.half = self.device.type != 'cpu'
         self.crop_size = (128, 384)
         os.makedirs("./cache/embeddings/", exist_ok=True)
         self.cache_path = "./cache/embeddings/{}_embedding.pkl"
@@ -73,8 +77,8 @@ class EmbeddingComputer:
 
         # Create embeddings and l2 normalize them
         with torch.no_grad():
-            crops = crops.cuda()
-            crops = crops.half()
+            crops = crops.to(self.device)
+            crops = crops.half() if self.half else crops.float()
             embs = self.model(crops)
         embs = torch.nn.functional.normalize(embs)
         embs = embs.cpu().numpy()
@@ -106,8 +110,8 @@ class EmbeddingComputer:
 
         model = FastReID(path)
         model.eval()
-        model.cuda()
-        model.half()
+        model.to(self.device)
+        model.half() if self.half else model.float()
         self.model = model
 
     def dump_cache(self):
@@ -1,6 +1,6 @@
 from trackers.strongsort.utils.parser import get_config
 
-def create_tracker(tracker_type, tracker_config, reid_weights, device, half):
+def create_tracker(tracker_type, tracker_config, reid_weights, device, half, reid_model=None):
     
     cfg = get_config()
     cfg.merge_from_file(tracker_config)
@@ -19,7 +19,7 @@ def create_tracker(tracker_type, tracker_config, reid_weights, device, half):
             nn_budget=cfg.strongsort.nn_budget,
             mc_lambda=cfg.strongsort.mc_lambda,
             ema_alpha=cfg.strongsort.ema_alpha,
-
+            model=reid_model,
         )
         return strongsort
     
@@ -0,0 +1,154 @@
+"""
+    Kalman filter of all OC-SORT tracks at once. Means and covariances of every track are rows of stacked arrays,
+    predict() and the updates of a frame run as batched matmuls instead of one KalmanFilterNew per track.
+
+    The constant velocity model and the noise settings are those of KalmanBoxTracker, the state is
+    [x, y, s, r, vx, vy, vs] with z = [x, y, s, r]. The observation-centric re-update (ORU) of KalmanFilterNew is
+    kept: a track that loses its observations is frozen, and when it is observed again the filter is rolled back
+    to the frozen state and refreshed along a linear virtual trajectory between the last and the new observation.
+"""
+import numpy as np
+
+DIM_X, DIM_Z = 7, 4
+
+F = np.eye(DIM_X)
+F[0, 4] = F[1, 5] = F[2, 6] = 1
+H = np.eye(DIM_Z, DIM_X)
+R = np.eye(DIM_Z)
+R[2:, 2:] *= 10.
+P0 = np.eye(DIM_X)
+P0[4:, 4:] *= 1000.  # give high uncertainty to the unobservable initial velocities
+P0 *= 10.
+Q = np.eye(DIM_X)
+Q[-1, -1] *= 0.01
+Q[4:, 4:] *= 0.01
+
+
+def convert_x_to_bbox_batch(x):
+    """
+    Takes (n, 7) states and returns (n, 4) boxes [x1,y1,x2,y2], the rows of convert_x_to_bbox
+    """
+    w = np.sqrt(x[:, 2] * x[:, 3])
+    h = x[:, 2] / w
+    return np.stack([x[:, 0] - w / 2., x[:, 1] - h / 2., x[:, 0] + w / 2., x[:, 1] + h / 2.], axis=1)
+
+
+class BatchKalmanFilter(object):
+    def __init__(self, capacity=64):
+        self.x = np.zeros((capacity, DIM_X))
+        self.P = np.zeros((capacity, DIM_X, DIM_X))
+        self.free = list(range(capacity - 1, -1, -1))
+        self.observed = np.zeros(capacity, dtype=bool)
+        self.n_hist = np.zeros(capacity, dtype=np.int64)  # length of the observation history, None included
+        self.last_obs = np.full(capacity, -1, dtype=np.int64)  # history index of the last observation
+        self.last_z = np.zeros((capacity, DIM_Z))  # last observation, real or virtual
+        self.frozen = {}  # slot -> (x, P) saved when the track lost its observations
+        self.pending = []  # (slot, z) updates of the current frame, applied together by flush()
+
+    def _grow(self):
+        n = len(self.x)
+        self.x = np.concatenate([self.x, np.zeros_like(self.x)])
+        self.P = np.concatenate([self.P, np.zeros_like(self.P)])
+        self.observed = np.concatenate([self.observed, np.zeros_like(self.observed)])
+        self.n_hist = np.concatenate([self.n_hist, np.zeros_like(self.n_hist)])
+        self.last_obs = np.concatenate([self.last_obs, np.full_like(self.last_obs, -1)])
+        self.last_z = np.concatenate([self.last_z, np.zeros_like(self.last_z)])
+        self.free = list(range(2 * n - 1, n - 1, -1)) + self.free
+
+    def add(self, z):
+        """
+        Start a track at observation z = [x, y, s, r] and return its slot
+        """
+        if not self.free:
+            self._grow()
+        slot = self.free.pop()
+        self.x[slot] = 0
+        self.x[slot, :DIM_Z] = z
+        self.P[slot] = P0
+        self.observed[slot] = False
+        self.n_hist[slot] = 0
+        self.last_obs[slot] = -1
+        self.frozen.pop(slot, None)
+        return slot
+
+    def remove(self, slot):
+        self.frozen.pop(slot, None)
+        self.free.append(slot)
+
+    def predict(self, slots, clamp=True):
+        """
+        Advance the given tracks one frame. With clamp, a scale velocity that would make the area non positive is
+        zeroed first, as KalmanBoxTracker.predict does.
+        """
+        idx = np.asarray(slots, dtype=np.int64)
+        x = self.x[idx]
+        if clamp:
+            x[x[:, 6] + x[:, 2] <= 0, 6] = 0.
+        self.x[idx] = x @ F.T
+        self.P[idx] = F @ self.P[idx] @ F.T + Q
+
+    def predict_boxes(self, slots):
+        self.predict(slots)
+        return convert_x_to_bbox_batch(self.x[np.asarray(slots, dtype=np.int64)])
+
+    def _update(self, idx, z):
+        # Joseph form update of the tracks idx with observations z, batched KalmanFilterNew.update
+        x, P = self.x[idx], self.P[idx]
+        y = z - x[:, :DIM_Z]
+        PHT = P[:, :, :DIM_Z]
+        S = PHT[:, :DIM_Z, :] + R
+        K = PHT @ np.linalg.inv(S)
+        self.x[idx] = x + (K @ y[..., None])[..., 0]
+        I_KH = np.broadcast_to(np.eye(DIM_X), P.shape).copy()
+        I_KH[:, :, :DIM_Z] -= K
+        self.P[idx] = I_KH @ P @ I_KH.transpose(0, 2, 1) + K @ R @ K.transpose(0, 2, 1)
+
+    def update(self, slot, z):
+        """
+        Observe z = [x, y, s, r] for a track, or None when it was not matched. Observations are applied by flush(),
+        a track is updated at most once per frame.
+        """
+        self.n_hist[slot] += 1
+        if z is None:
+            if self.observed[slot]:
+                # no observation, freeze the current parameters for a future re-update
+                self.frozen[slot] = (self.x[slot].copy(), self.P[slot].copy())
+            self.observed[slot] = False
+            return
+        z = np.asarray(z, dtype=np.float64).reshape(DIM_Z)
+        if not self.observed[slot] and slot in self.frozen:
+            self._unfreeze(slot, z)
+        else:
+            self.last_obs[slot] = self.n_hist[slot] - 1
+            self.last_z[slot] = z
+        self.observed[slot] = True
+        self.pending.append((slot, z))
+
+    def _unfreeze(self, slot, z):
+        # Roll back to the frozen state and re-update along the linear path from the last observation to z
+        self.x[slot], self.P[slot] = self.frozen.pop(slot)
+        index1, index2 = self.last_obs[slot], self.n_hist[slot] - 1
+        time_gap = index2 - index1
+        x1, y1, s1, r1 = self.last_z[slot]
+        w1, h1 = np.sqrt(s1 * r1), np.sqrt(s1 / r1)
+        x2, y2, s2, r2 = z
+        w2, h2 = np.sqrt(s2 * r2), np.sqrt(s2 / r2)
+        dx, dy, dw, dh = (x2 - x1) / time_gap, (y2 - y1) / time_gap, (w2 - w1) / time_gap, (h2 - h1) / time_gap
+        self.n_hist[slot] = index1 + 1  # the None entries are replaced by the virtual observations
+        idx = np.array([slot])
+        for i in range(time_gap):
+            w, h = w1 + (i + 1) * dw, h1 + (i + 1) * dh
+            box = np.array([x1 + (i + 1) * dx, y1 + (i + 1) * dy, w * h, w / float(h)])
+            self._update(idx, box[None])
+            self.n_hist[slot] += 1
+            self.last_obs[slot] = self.n_hist[slot] - 1
+            self.last_z[slot] = box
+            if not i == (time_gap - 1):
+                self.predict(idx, clamp=False)
+
+    def flush(self):
+        # Apply the observations of the frame in one batched update
+        if self.pending:
+            slots, zs = zip(*self.pending)
+            self._update(np.array(slots, dtype=np.int64), np.stack(zs))
+            self.pending = []
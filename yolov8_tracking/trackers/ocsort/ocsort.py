@@ -5,6 +5,7 @@ from __future__ import print_function
 
 import numpy as np
 from .association import *
+from .batch_kalman import BatchKalmanFilter
 from yolov8.ultralytics.yolo.utils.ops import xywh2xyxy
 
 
@@ -61,30 +62,13 @@ class KalmanBoxTracker(object):
     """
     count = 0
 
-    def __init__(self, bbox, cls, delta_t=3, orig=False):
+    def __init__(self, bbox, cls, kf, delta_t=3):
         """
-        Initialises a tracker using initial bounding box.
+        Initialises a tracker using initial bounding box, its state is a slot of the shared BatchKalmanFilter kf.
 
         """
-        # define constant velocity model
-        if not orig:
-          from .kalmanfilter import KalmanFilterNew as KalmanFilter
-          self.kf = KalmanFilter(dim_x=7, dim_z=4)
-        else:
-          from filterpy.kalman import KalmanFilter
-          self.kf = KalmanFilter(dim_x=7, dim_z=4)
-        self.kf.F = np.array([[1, 0, 0, 0, 1, 0, 0], [0, 1, 0, 0, 0, 1, 0], [0, 0, 1, 0, 0, 0, 1], [
-                            0, 0, 0, 1, 0, 0, 0],  [0, 0, 0, 0, 1, 0, 0], [0, 0, 0, 0, 0, 1, 0], [0, 0, 0, 0, 0, 0, 1]])
-        self.kf.H = np.array([[1, 0, 0, 0, 0, 0, 0], [0, 1, 0, 0, 0, 0, 0],
-                            [0, 0, 1, 0, 0, 0, 0], [0, 0, 0, 1, 0, 0, 0]])
-
-        self.kf.R[2:, 2:] *= 10.
-        self.kf.P[4:, 4:] *= 1000.  # give high uncertainty to the unobservable initial velocities
-        self.kf.P *= 10.
-        self.kf.Q[-1, -1] *= 0.01
-        self.kf.Q[4:, 4:] *= 0.01
-
-        self.kf.x[:4] = convert_bbox_to_z(bbox)
+        self.kf = kf
+        self.slot = kf.add(convert_bbox_to_z(bbox)[:, 0])
         self.time_since_update = 0
         self.id = KalmanBoxTracker.count
         KalmanBoxTracker.count += 1
@@ -139,30 +123,32 @@ class KalmanBoxTracker(object):
             self.history = []
             self.hits += 1
             self.hit_streak += 1
-            self.kf.update(convert_bbox_to_z(bbox))
+            self.kf.update(self.slot, convert_bbox_to_z(bbox)[:, 0])
         else:
-            self.kf.update(bbox)
+            self.kf.update(self.slot, None)
 
     def predict(self):
         """
         Advances the state vector and returns the predicted bounding box estimate.
         """
-        if((self.kf.x[6]+self.kf.x[2]) <= 0):
-            self.kf.x[6] *= 0.0
+        return self.predicted(self.kf.predict_boxes([self.slot])[0])
 
-        self.kf.predict()
+    def predicted(self, box):
+        """
+        Bookkeeping of a prediction made for all tracks at once by the shared filter.
+        """
         self.age += 1
         if(self.time_since_update > 0):
             self.hit_streak = 0
         self.time_since_update += 1
-        self.history.append(convert_x_to_bbox(self.kf.x))
+        self.history.append(box.reshape((1, 4)))
         return self.history[-1]
 
     def get_state(self):
         """
         Returns the current bounding box estimate.
         """
-        return convert_x_to_bbox(self.kf.x)
+        return convert_x_to_bbox(self.kf.x[self.slot])
 
 
 """
@@ -194,6 +180,7 @@ class OCSort(object):
         self.asso_func = ASSO_FUNCS[asso_func]
         self.inertia = inertia
         self.use_byte = use_byte
+        self.kf = BatchKalmanFilter()
         KalmanBoxTracker.count = 0
 
     def update(self, dets, _):
@@ -224,18 +211,20 @@ class OCSort(object):
         remain_inds = confs > self.det_thresh
         dets = output_results[remain_inds]
 
-        # get predicted locations from existing trackers.
+        # get predicted locations from existing trackers, all of them in one batched predict.
         trks = np.zeros((len(self.trackers), 5))
         to_del = []
         ret = []
-        for t, trk in enumerate(trks):
-            pos = self.trackers[t].predict()[0]
-            trk[:] = [pos[0], pos[1], pos[2], pos[3], 0]
-            if np.any(np.isnan(pos)):
-                to_del.append(t)
+        if self.trackers:
+            boxes = self.kf.predict_boxes([trk.slot for trk in self.trackers])
+            for t, trk in enumerate(trks):
+                pos = self.trackers[t].predicted(boxes[t])[0]
+                trk[:] = [pos[0], pos[1], pos[2], pos[3], 0]
+                if np.any(np.isnan(pos)):
+                    to_del.append(t)
         trks = np.ma.compress_rows(np.ma.masked_invalid(trks))
         for t in reversed(to_del):
-            self.trackers.pop(t)
+            self.kf.remove(self.trackers.pop(t).slot)
 
         velocities = np.array(
             [trk.velocity if trk.velocity is not None else np.array((0, 0)) for trk in self.trackers])
@@ -301,10 +290,11 @@ class OCSort(object):
 
         for m in unmatched_trks:
             self.trackers[m].update(None, None)
+        self.kf.flush()  # the observations of all matched tracks in one batched update
 
         # create and initialise new trackers for unmatched detections
         for i in unmatched_dets:
-            trk = KalmanBoxTracker(dets[i, :5], dets[i, 5], delta_t=self.delta_t)
+            trk = KalmanBoxTracker(dets[i, :5], dets[i, 5], self.kf, delta_t=self.delta_t)
             self.trackers.append(trk)
         i = len(self.trackers)
         for trk in reversed(self.trackers):
@@ -322,7 +312,7 @@ class OCSort(object):
             i -= 1
             # remove dead tracklet
             if(trk.time_since_update > self.max_age):
-                self.trackers.pop(i)
+                self.kf.remove(self.trackers.pop(i).slot)
         if(len(ret) > 0):
             return np.concatenate(ret)
         return np.empty((0, 5))
@@ -7,6 +7,7 @@ import torchvision.transforms as transforms
 import cv2
 import sys
 import torchvision.transforms as T
+from torchvision.ops import roi_align
 from collections import OrderedDict, namedtuple
 import gdown
 from os.path import exists as file_exists
@@ -51,6 +52,9 @@ class ReIDDetectMultiBackend(nn.Module):
         self.transforms += [T.Normalize(mean=self.pixel_mean, std=self.pixel_std)]
         self.preprocess = T.Compose(self.transforms)
         self.to_pil = T.ToPILImage()
+        # Normalize folded into one affine op on 0-255 pixels for the batched box path
+        self.pixel_mean_255 = torch.tensor(self.pixel_mean, device=device).view(1, 3, 1, 1) * 255
+        self.pixel_std_255 = torch.tensor(self.pixel_std, device=device).view(1, 3, 1, 1) * 255
 
         model_name = get_model_name(w)
 
@@ -182,12 +186,26 @@ class ReIDDetectMultiBackend(nn.Module):
         images = images.to(self.device)
 
         return images
-    
-    
-    def forward(self, im_batch):
-        
+
+    def _preprocess_boxes(self, img, xyxy):
+        # Crop, resize and normalize every box of a frame with a single roi_align call instead of a PIL round-trip
+        # per crop. Boxes are integer pixel bounds, the crop img[y1:y2, x1:x2] covers exactly [x1, x2) x [y1, y2)
+        # with aligned=True. Adaptive sampling averages the pixels under each output bin like PIL's antialiased resize.
+        im = torch.from_numpy(np.ascontiguousarray(img)).to(self.device).permute(2, 0, 1)[None].float()
+        boxes = torch.as_tensor(np.asarray(xyxy, dtype=np.float32), device=self.device).view(-1, 4)
+        rois = torch.cat([boxes.new_zeros(len(boxes), 1), boxes], 1)  # all boxes come from image 0
+        crops = roi_align(im, rois, self.image_size, spatial_scale=1.0, sampling_ratio=-1, aligned=True)
+        return (crops - self.pixel_mean_255) / self.pixel_std_255
+
+    def forward(self, im_batch, boxes=None):
+        """
+        Args:
+            im_batch: list of HWC uint8 crops, or the full HWC frame when boxes is given.
+            boxes: (n, 4) xyxy pixel boxes to crop from the frame on the batched tensor path.
+        """
+
         # preprocess batch
-        im_batch = self._preprocess(im_batch)
+        im_batch = self._preprocess(im_batch) if boxes is None else self._preprocess_boxes(im_batch, boxes)
 
         # batch to half
         if self.fp16 and im_batch.dtype != torch.float16:
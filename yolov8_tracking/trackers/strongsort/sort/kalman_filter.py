@@ -211,4 +211,61 @@ class KalmanFilter(object):
             cholesky_factor, d.T, lower=True, check_finite=False,
             overwrite_b=True)
         squared_maha = np.sum(z * z, axis=0)
-        return squared_maha
\ No newline at end of file
+        return squared_maha
+
+    def project_batch(self, means, covariances):
+        """Project the state distributions of N tracks to measurement space,
+        `project` with zero confidence for every row.
+        Parameters
+        ----------
+        means : ndarray
+            The Nx8 dimensional matrix of state means.
+        covariances : ndarray
+            The Nx8x8 dimensional stack of state covariances.
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the Nx4 projected means and the Nx4x4 projected
+            covariances.
+        """
+        h = self._std_weight_position * means[:, 3]
+        std = np.stack([h, h, np.full_like(h, 1e-1), h], axis=1)
+        covariance = covariances[:, :4, :4] + np.square(std)[:, :, None] * np.eye(4)
+        return means[:, :4].copy(), covariance
+
+    def gating_distance_batch(self, means, covariances, measurements,
+                              only_position=False):
+        """Compute the gating distance between N state distributions and M
+        measurements. All covariances are factored in one batched Cholesky
+        decomposition instead of one `gating_distance` call per track.
+        Parameters
+        ----------
+        means : ndarray
+            The Nx8 dimensional matrix of state means.
+        covariances : ndarray
+            The Nx8x8 dimensional stack of state covariances.
+        measurements : ndarray
+            An Mx4 dimensional matrix of M measurements in format (x, y, a, h).
+        only_position : Optional[bool]
+            If True, distance computation is done with respect to the bounding
+            box center position only.
+        Returns
+        -------
+        ndarray
+            Returns an NxM matrix, where element (i, j) is the squared
+            Mahalanobis distance between track i and `measurements[j]`, row i
+            equals `gating_distance(means[i], covariances[i], measurements)`.
+        """
+        measurements = np.asarray(measurements, dtype=np.float64).reshape(-1, 4)
+        if not len(means) or not len(measurements):
+            return np.zeros((len(means), len(measurements)))
+        mean, covariance = self.project_batch(means, covariances)
+
+        if only_position:
+            mean, covariance = mean[:, :2], covariance[:, :2, :2]
+            measurements = measurements[:, :2]
+
+        cholesky_factor = np.linalg.cholesky(covariance)
+        d = measurements[None, :, :] - mean[:, None, :]
+        z = np.linalg.solve(cholesky_factor, d.transpose(0, 2, 1))
+        return np.sum(z * z, axis=1)
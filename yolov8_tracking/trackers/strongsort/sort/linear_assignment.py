@@ -130,7 +130,7 @@ def matching_cascade(
 
 def gate_cost_matrix(
         cost_matrix, tracks, detections, track_indices, detection_indices, mc_lambda,
-        gated_cost=INFTY_COST, only_position=False):
+        gated_cost=INFTY_COST, only_position=False, gating_distance=None):
     """Invalidate infeasible entries in cost matrix based on the state
     distributions obtained by Kalman filtering.
     Parameters
@@ -157,6 +157,10 @@ def gate_cost_matrix(
     only_position : Optional[bool]
         If True, only the x, y position of the state distribution is considered
         during gating. Defaults to False.
+    gating_distance : Optional[ndarray]
+        The NxM squared Mahalanobis distances of the track and detection
+        indices, e.g. a slice of `KalmanFilter.gating_distance_batch` computed
+        once per frame. If None, the distances are computed per track.
     Returns
     -------
     ndarray
@@ -164,6 +168,10 @@ def gate_cost_matrix(
     """
     gating_dim = 2 if only_position else 4
     gating_threshold = kalman_filter.chi2inv95[gating_dim]
+    if gating_distance is not None:
+        cost_matrix[gating_distance > gating_threshold] = gated_cost
+        cost_matrix[:] = mc_lambda * cost_matrix + (1 - mc_lambda) * gating_distance
+        return cost_matrix
     measurements = np.asarray(
         [detections[i].to_xyah() for i in detection_indices])
     for row, track_idx in enumerate(track_indices):
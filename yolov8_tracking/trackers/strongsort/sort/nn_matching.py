@@ -107,22 +107,56 @@ class NearestNeighborDistanceMetric(object):
         the oldest samples when the budget is reached.
     Attributes
     ----------
-    samples : Dict[int -> List[ndarray]]
-        A dictionary that maps from target identities to the list of samples
-        that have been observed so far.
+    gallery : ndarray
+        A (rows, slots, M) array of samples, one ring buffer of `budget` slots
+        per target. Cosine samples are stored normalized.
+    rows : Dict[int -> int]
+        A dictionary that maps from target identities to their gallery row.
+    count : ndarray
+        Number of samples stored in every row.
+    head : ndarray
+        Slot the next sample of every row is written to.
     """
 
     def __init__(self, metric, matching_threshold, budget=None):
         if metric == "euclidean":
-            self._metric = _nn_euclidean_distance
+            self._normalize = False
         elif metric == "cosine":
-            self._metric = _nn_cosine_distance
+            self._normalize = True
         else:
             raise ValueError(
                 "Invalid metric; must be either 'euclidean' or 'cosine'")
         self.matching_threshold = matching_threshold
         self.budget = budget
-        self.samples = {}
+        self.rows = {}
+        self.free = []
+        self.gallery = None  # allocated on the first samples, when their dimension is known
+        self.sqnorm = None  # squared norm of every sample, for the euclidean distance
+        self.count = np.zeros(0, dtype=np.int64)
+        self.head = np.zeros(0, dtype=np.int64)
+
+    def _allocate(self, rows, slots, dim):
+        gallery = np.zeros((rows, slots, dim), dtype=np.float32)
+        sqnorm = np.zeros((rows, slots), dtype=np.float32)
+        count = np.zeros(rows, dtype=np.int64)
+        head = np.zeros(rows, dtype=np.int64)
+        if self.gallery is not None:
+            r, k = self.gallery.shape[:2]
+            gallery[:r, :k], sqnorm[:r, :k], count[:r], head[:r] = self.gallery, self.sqnorm, self.count, self.head
+            self.free = list(range(rows - 1, r - 1, -1)) + self.free
+        else:
+            self.free = list(range(rows - 1, -1, -1))
+        self.gallery, self.sqnorm, self.count, self.head = gallery, sqnorm, count, head
+
+    def _row(self, target):
+        row = self.rows.get(target)
+        if row is None:
+            if not self.free:
+                self._allocate(2 * len(self.gallery), self.gallery.shape[1], self.gallery.shape[2])
+            row = self.rows[target] = self.free.pop()
+            self.count[row] = 0
+            self.head[row] = 0
+        return row
 
     def partial_fit(self, features, targets, active_targets):
         """Update the distance metric with new data.
@@ -135,11 +169,22 @@ class NearestNeighborDistanceMetric(object):
         active_targets : List[int]
             A list of targets that are currently present in the scene.
         """
-        for feature, target in zip(features, targets):
-            self.samples.setdefault(target, []).append(feature)
-            if self.budget is not None:
-                self.samples[target] = self.samples[target][-self.budget:]
-        self.samples = {k: self.samples[k] for k in active_targets}
+        if len(features) and self.gallery is None:
+            self._allocate(32, self.budget or 32, features.shape[1])
+        for target, feature in zip(targets, features):
+            row = self._row(target)
+            if self.budget is None and self.count[row] == self.gallery.shape[1]:  # unbounded, make room
+                self._allocate(len(self.gallery), 2 * self.gallery.shape[1], self.gallery.shape[2])
+            if self._normalize:
+                feature = feature / np.linalg.norm(feature)
+            slot = self.head[row]
+            self.gallery[row, slot] = feature
+            self.sqnorm[row, slot] = np.dot(self.gallery[row, slot], self.gallery[row, slot])
+            self.head[row] = (slot + 1) % self.gallery.shape[1]
+            self.count[row] = min(self.count[row] + 1, self.gallery.shape[1])
+        active = set(active_targets)
+        for target in [t for t in self.rows if t not in active]:
+            self.free.append(self.rows.pop(target))
 
     def distance(self, features, targets):
         """Compute distance between features and targets.
@@ -156,7 +201,20 @@ class NearestNeighborDistanceMetric(object):
             element (i, j) contains the closest squared distance between
             `targets[i]` and `features[j]`.
         """
-        cost_matrix = np.zeros((len(targets), len(features)))
-        for i, target in enumerate(targets):
-            cost_matrix[i, :] = self._metric(self.samples[target], features)
-        return cost_matrix
\ No newline at end of file
+        if len(targets) == 0 or len(features) == 0:
+            return np.zeros((len(targets), len(features)))
+        rows = np.array([self.rows[target] for target in targets])
+        features = np.asarray(features, dtype=np.float32)
+        _, k, m = self.gallery.shape
+        used = rows.max() + 1  # rows past the last queried one are skipped
+        if self._normalize:
+            features = features / np.linalg.norm(features, axis=1, keepdims=True)
+        # one matmul of every stored sample against every feature, then the min over the valid slots of each row
+        dots = (self.gallery[:used].reshape(used * k, m) @ features.T).reshape(used, k, len(features))
+        if self._normalize:
+            distances = 1. - dots
+        else:
+            distances = np.clip(-2. * dots + self.sqnorm[:used, :, None] + np.square(features).sum(axis=1),
+                                0., float(np.inf))
+        distances[np.arange(k)[None, :] >= self.count[:used, None]] = np.inf  # empty slots
+        return distances.min(axis=1)[rows].astype(np.float64)
@@ -124,7 +124,8 @@ class Track:
         return ret
 
 
-    def ECC(self, src, dst, warp_mode = cv2.MOTION_EUCLIDEAN, eps = 1e-5,
+    @staticmethod
+    def ECC(src, dst, warp_mode = cv2.MOTION_EUCLIDEAN, eps = 1e-5,
         max_iter = 100, scale = 0.1, align = False):
         """Compute the warp matrix from src to dst.
         Parameters
@@ -216,7 +217,8 @@ class Track:
             return warp_matrix, None
 
 
-    def get_matrix(self, matrix):
+    @staticmethod
+    def get_matrix(matrix):
         eye = np.eye(3)
         dist = np.linalg.norm(eye - matrix)
         if dist < 100:
@@ -224,14 +226,23 @@ class Track:
         else:
             return eye
 
-    def camera_update(self, previous_frame, next_frame):
-        warp_matrix, src_aligned = self.ECC(previous_frame, next_frame)
-        if warp_matrix is None and src_aligned is None:
-            return
-        [a,b] = warp_matrix
-        warp_matrix=np.array([a,b,[0,0,1]])
-        warp_matrix = warp_matrix.tolist()
-        matrix = self.get_matrix(warp_matrix)
+    def camera_update(self, previous_frame, next_frame, matrix=None):
+        """Move the track by the camera motion between two frames.
+
+        Parameters
+        ----------
+        matrix : Optional[ndarray]
+            The 3x3 camera motion matrix, if it was already estimated for this
+            frame pair. Otherwise it is estimated here with `ECC`.
+        """
+        if matrix is None:
+            warp_matrix, src_aligned = self.ECC(previous_frame, next_frame)
+            if warp_matrix is None and src_aligned is None:
+                return
+            [a,b] = warp_matrix
+            warp_matrix=np.array([a,b,[0,0,1]])
+            warp_matrix = warp_matrix.tolist()
+            matrix = self.get_matrix(warp_matrix)
 
         x1, y1, x2, y2 = self.to_tlbr()
         x1_, y1_, _ = matrix @ np.array([x1, y1, 1]).T
@@ -35,6 +35,9 @@ class Tracker:
         The list of active tracks at the current time step.
     """
     GATING_THRESHOLD = np.sqrt(kalman_filter.chi2inv95[4])
+    # gate all tracks with one batched Mahalanobis computation per frame,
+    # False falls back to one gating_distance call per track and cascade level
+    batch_gating = True
 
     def __init__(self, metric, max_iou_dist=0.9, max_age=30, max_unmatched_preds=7, n_init=3, _lambda=0, ema_alpha=0.9, mc_lambda=0.995):
         self.metric = metric
@@ -49,6 +52,9 @@ class Tracker:
         self.kf = kalman_filter.KalmanFilter()
         self.tracks = []
         self._next_id = 1
+        # camera motion of the current frame pair, shared by every track
+        self.warp_matrix = None
+        self.ecc_solves = 0
 
     def predict(self):
         """Propagate track state distributions one time step forward.
@@ -63,9 +69,39 @@ class Tracker:
             track.increment_age()
             track.mark_missed()
 
-    def camera_update(self, previous_img, current_img):
-        for track in self.tracks:
-            track.camera_update(previous_img, current_img)
+    def camera_update(self, previous_img, current_img, matrix=None):
+        """Estimate the camera motion between two frames once and move every
+        track by it.
+
+        The warp is solved with a single ECC call per frame pair and kept in
+        `warp_matrix` for the rest of the frame. All track means are then
+        transformed together, which gives the same boxes as warping each track
+        on its own. A known warp (e.g. from the frame cache) can be passed as
+        `matrix` to skip ECC.
+        """
+        self.warp_matrix = None
+        if not self.tracks:
+            return
+        if matrix is None:
+            warp_matrix, _ = Track.ECC(previous_img, current_img)
+            self.ecc_solves += 1
+            if warp_matrix is None:
+                return
+            matrix = np.asarray(Track.get_matrix(np.vstack([warp_matrix, [0, 0, 1]]).astype(np.float64)))
+        self.warp_matrix = matrix
+
+        # (x, y, a, h) -> corners, warp all of them in one matmul, then back to (x, y, a, h)
+        means = np.stack([t.mean[:4] for t in self.tracks])
+        wh = np.stack([means[:, 2] * means[:, 3], means[:, 3]], axis=1)
+        tl = means[:, :2] - wh / 2
+        corners = np.concatenate([tl, tl + wh])
+        corners = np.hstack([corners, np.ones((len(corners), 1))]) @ matrix.T
+        n = len(self.tracks)
+        tl_, br_ = corners[:n, :2], corners[n:, :2]
+        wh_ = br_ - tl_
+        xyah = np.concatenate([tl_ + wh_ / 2, (wh_[:, 0] / wh_[:, 1])[:, None], wh_[:, 1:]], axis=1)
+        for track, m in zip(self.tracks, xyah):
+            track.mean[:4] = m
             
     def pred_n_update_all_tracks(self):
         """Perform predictions and updates for all tracks by its own predicted state.
@@ -126,14 +162,11 @@ class Tracker:
         is more intuitive in terms of values.
         """
         # Compute First the Position-based Cost Matrix
-        pos_cost = np.empty([len(track_indices), len(detection_indices)])
         msrs = np.asarray([dets[i].to_xyah() for i in detection_indices])
-        for row, track_idx in enumerate(track_indices):
-            pos_cost[row, :] = np.sqrt(
-                self.kf.gating_distance(
-                    tracks[track_idx].mean, tracks[track_idx].covariance, msrs, False
-                )
-            ) / self.GATING_THRESHOLD
+        means, covariances = self._track_states(tracks, track_indices)
+        pos_cost = np.sqrt(
+            self.kf.gating_distance_batch(means, covariances, msrs, False)
+        ) / self.GATING_THRESHOLD
         pos_gate = pos_cost > 1.0
         # Now Compute the Appearance-based Cost Matrix
         app_cost = self.metric.distance(
@@ -147,13 +180,35 @@ class Tracker:
         # Return Matrix
         return cost_matrix
 
+    @staticmethod
+    def _track_states(tracks, track_indices):
+        # Stacked (N, 8) means and (N, 8, 8) covariances of the given tracks
+        if not len(track_indices):
+            return np.zeros((0, 8)), np.zeros((0, 8, 8))
+        means = np.stack([tracks[i].mean for i in track_indices])
+        covariances = np.stack([tracks[i].covariance for i in track_indices])
+        return means, covariances
+
     def _match(self, detections):
+        gating = {}
+
+        def gating_distance(track_indices, detection_indices):
+            # Squared Mahalanobis distances of every track to every detection,
+            # computed on first use and sliced by each cascade level
+            if 'd' not in gating:
+                msrs = np.asarray([d.to_xyah() for d in detections])
+                gating['d'] = self.kf.gating_distance_batch(
+                    *self._track_states(self.tracks, range(len(self.tracks))), msrs)
+            return gating['d'][np.ix_(np.asarray(track_indices, dtype=np.int64),
+                                      np.asarray(detection_indices, dtype=np.int64))]
 
         def gated_metric(tracks, dets, track_indices, detection_indices):
             features = np.array([dets[i].feature for i in detection_indices])
             targets = np.array([tracks[i].track_id for i in track_indices])
             cost_matrix = self.metric.distance(features, targets)
-            cost_matrix = linear_assignment.gate_cost_matrix(cost_matrix, tracks, dets, track_indices, detection_indices, self.mc_lambda)
+            cost_matrix = linear_assignment.gate_cost_matrix(
+                cost_matrix, tracks, dets, track_indices, detection_indices, self.mc_lambda,
+                gating_distance=gating_distance(track_indices, detection_indices) if self.batch_gating else None)
 
             return cost_matrix
 
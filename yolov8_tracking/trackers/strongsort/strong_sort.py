@@ -27,10 +27,12 @@ class StrongSORT(object):
                  n_init=3,
                  nn_budget=100,
                  mc_lambda=0.995,
-                 ema_alpha=0.9
+                 ema_alpha=0.9,
+                 model=None
                 ):
 
-        self.model = ReIDDetectMultiBackend(weights=model_weights, device=device, fp16=fp16)
+        # an already loaded ReID model can be shared between trackers
+        self.model = model if model is not None else ReIDDetectMultiBackend(weights=model_weights, device=device, fp16=fp16)
         
         self.max_dist = max_dist
         metric = NearestNeighborDistanceMetric(
@@ -38,7 +40,8 @@ class StrongSORT(object):
         self.tracker = Tracker(
             metric, max_iou_dist=max_iou_dist, max_age=max_age, n_init=n_init, max_unmatched_preds=max_unmatched_preds, mc_lambda=mc_lambda, ema_alpha=ema_alpha)
 
-    def update(self, dets,  ori_img):
+    def update(self, dets,  ori_img, features=None):
+        # features: ReID embeddings of dets when they are already known, only the shape of ori_img is used then
         
         xyxys = dets[:, 0:4]
         confs = dets[:, 4]
@@ -50,7 +53,8 @@ class StrongSORT(object):
         self.height, self.width = ori_img.shape[:2]
         
         # generate detections
-        features = self._get_features(xywhs, ori_img)
+        if features is None:
+            features = self._get_features(xywhs, ori_img)
         bbox_tlwh = self._xywh_to_tlwh(xywhs)
         detections = [Detection(bbox_tlwh[i], conf, features[i]) for i, conf in enumerate(
             confs)]
@@ -129,7 +133,23 @@ class StrongSORT(object):
         h = int(y2 - y1)
         return t, l, w, h
 
+    def features(self, xyxys, ori_img):
+        # ReID embeddings of xyxy boxes, the same update() computes for its detections
+        self.height, self.width = ori_img.shape[:2]
+        return self._get_features(xyxy2xywh(np.asarray(xyxys, dtype=np.float32)), ori_img)
+
     def _get_features(self, bbox_xywh, ori_img):
+        if not len(bbox_xywh):
+            return np.array([])
+        # same bounds as _xywh_to_xyxy, for all boxes at once, the crops are taken by the ReID model
+        x, y, w, h = np.asarray(bbox_xywh, dtype=np.float64).T
+        xyxy = np.stack([np.maximum((x - w / 2).astype(int), 0), np.maximum((y - h / 2).astype(int), 0),
+                         np.minimum((x + w / 2).astype(int), self.width - 1),
+                         np.minimum((y + h / 2).astype(int), self.height - 1)], 1)
+        return self.model(ori_img, boxes=xyxy)
+
+    def _get_features_per_crop(self, bbox_xywh, ori_img):
+        # Reference path that crops in numpy and preprocesses every crop with PIL
         im_crops = []
         for box in bbox_xywh:
             x1, y1, x2, y2 = self._xywh_to_xyxy(box)
@@ -4,7 +4,9 @@ import glob
 import math
 import os
 import time
+from contextlib import nullcontext
 from pathlib import Path
+from queue import Empty, Full, Queue
 from threading import Thread
 from urllib.parse import urlparse
 
@@ -31,7 +33,7 @@ print("Root directory for project: " + str(root_path))
 sys.path.append(str(root_path))
 
 import EgoHOS.mmsegmentation.predict_image as handseg
-from EgoHOS.mmsegmentation.predict_tray import predict_tray
+from EgoHOS.mmsegmentation.predict_tray import TrayTracker
 
 
 class LoadStreams:
@@ -169,9 +171,84 @@ class LoadScreenshots:
         return str(self.screen), im, im0, None, s  # screen, img, original img, im0s, s
 
 
+NULL_STAGE = nullcontext()
+
+
+def profile_stage(profiler, name, frame=None):
+    # Stage of a profiler.StageProfiler of the tracking root, a no-op without one
+    return NULL_STAGE if profiler is None else profiler.stage(name, frame)
+
+
+def sharpness(im0, region=None, scale=0.5):
+    """
+    Variance of the Laplacian of the grayscale frame, low for motion blurred frames.
+    Args:
+        im0: BGR frame.
+        region: (row, column) slices the score is computed on, the whole frame if None.
+        scale: the region is downscaled by this factor first, which also suppresses sensor noise.
+    """
+    crop = im0 if region is None else im0[region]
+    if crop.size == 0:
+        return 0.
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    if scale != 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(gray, cv2.CV_32F).var())
+
+
+class DeblurWorker:
+    # Runs NAFNet restoration on a daemon thread so the decode loop never waits for it.
+    # At most `maxsize` frames wait in the queue; requests made while it is full are dropped and counted.
+    def __init__(self, fn, maxsize=2, profiler=None):
+        self.fn = fn
+        self.profiler = profiler
+        self.inputs = Queue(maxsize=maxsize)
+        self.outputs = Queue()
+        self.submitted, self.done, self.dropped = 0, 0, 0
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            idx, args = self.inputs.get()
+            try:
+                with profile_stage(self.profiler, 'deblur', idx):
+                    out = self.fn(*args)
+            except Exception as e:
+                LOGGER.warning(f'WARNING ⚠️ Deblurring frame {idx} failed: {e}')
+                out = None
+            self.outputs.put((idx, out))
+
+    def submit(self, idx, *args):
+        # Queue frame `idx` for restoration, returns False if the request was dropped
+        try:
+            self.inputs.put_nowait((idx, args))
+        except Full:
+            self.dropped += 1
+            return False
+        self.submitted += 1
+        return True
+
+    def results(self, wait=False):
+        # Finished (idx, restored frame) pairs, optionally blocking until every submitted frame is done
+        ready = []
+        while self.done < self.submitted:
+            try:
+                idx, out = self.outputs.get(block=wait)
+            except Empty:
+                break
+            self.done += 1
+            if out is not None:
+                ready.append((idx, out))
+        return ready
+
+
 class LoadImages:
     # YOLOv8 image/video dataloader, i.e. `python detect.py --source image.jpg/vid.mp4`
-    def __init__(self, path, imgsz=640, stride=32, auto=True, transforms=None, vid_stride=1, deblur_path=""):
+    def __init__(self, path, imgsz=640, stride=32, auto=True, transforms=None, vid_stride=1, deblur_path="",
+                 seg_interval=1, seg_diff_thres=None, seg_warp=False, tray_roi=False, roi_margin=100,
+                 async_deblur=False, deblur_queue=2, models=None, prefetch=0, device=None, seg_quantize=None,
+                 tray_scale=0.5, tray_alpha=0.3, tray_motion=4.0, deblur_sharpness=None, profiler=None):
         if isinstance(path, str) and Path(path).suffix == ".txt":  # *.txt file with img/vid/dir on each line
             path = Path(path).read_text().rsplit()
         files = []
@@ -200,21 +277,34 @@ class LoadImages:
         self.transforms = transforms  # optional
         self.vid_stride = vid_stride  # video frame-rate stride
         # added attributes
-        self.tray = ((500, 250), (1350, 880))
-        self.first_found = False
-        self.counter = 0
-        base_path = Path(__file__).parent.resolve()
-        opt_path = (base_path / '../../../../../../NAFNet/options/test/REDS/NAFNet-width64.yml').resolve()
-        opt = parse(str(opt_path), is_train=False)
-        opt['dist'] = False
-        opt['path']['pretrain_network_g'] = deblur_path
-        print(opt)
-        self.NAFNet = create_model(opt)
+        self.profiler = profiler  # times decode, deblur, hand segmentation, tray and letterbox per frame
+        # tray box, detected on a downscaled frame whenever the tray border changed and smoothed over time
+        self.tray_tracker = TrayTracker(scale=tray_scale, alpha=tray_alpha, motion_thres=tray_motion)
+        self.tray = self.tray_tracker.tray
+        # restrict hand segmentation and deblurring to the tray box grown by roi_margin pixels
+        self.tray_roi = tray_roi
+        self.roi_margin = roi_margin
+        self.roi = None
+        if models is None:
+            models = self.load_models(deblur_path, seg_interval, seg_diff_thres, seg_warp, device, seg_quantize)
+        self.NAFNet, self.h = models
         self.deblur = False
-        work_path = (base_path / "../../../../../../EgoHOS/mmsegmentation/work_dirs").resolve()
-        config_path = (work_path / "seg_twohands_ccda/seg_twohands_ccda.py").resolve()
-        checkpt_path = (work_path / "seg_twohands_ccda/best_mIoU_iter_56000.pth").resolve()
-        self.h = handseg.HandSegmentor(str(config_path), str(checkpt_path))
+        self.deblur_boxes = []  # boxes of the items that requested deblurring
+        # frames whose sharpness reaches deblur_sharpness skip NAFNet but are still yielded as deblurred
+        self.deblur_sharpness = deblur_sharpness
+        self.deblur_counts = {'requested': 0, 'restored': 0, 'sharp': 0}
+        # in async mode the yielded frame stays raw, restored frames are collected later with deblurred()
+        self.deblur_worker = DeblurWorker(self.deblur_frame, deblur_queue, profiler) if async_deblur else None
+        self.pending = {}  # frame index -> ROI of frames handed to the worker
+        # frame index over all files of the source, the one deblur requests, the worker and the profiler stages use.
+        # self.frame restarts with every video
+        self.index = 0
+        self.last_index = -1  # index of the batch last returned by __next__
+        # with prefetch > 0 a thread decodes and preprocesses up to `prefetch` frames ahead of the consumer
+        self.prefetch = prefetch
+        self.queue = Queue(maxsize=max(prefetch, 1))
+        self.producer = None
+        self.depths, self.stall = [], 0.
         if any(videos):
             self._new_video(videos[0])  # new video
         else:
@@ -222,8 +312,114 @@ class LoadImages:
         assert self.nf > 0, f'No images or videos found in {p}. ' \
                             f'Supported formats are:\nimages: {IMG_FORMATS}\nvideos: {VID_FORMATS}'
 
-    def set_deblur(self, value):
+    @staticmethod
+    def load_models(deblur_path="", seg_interval=1, seg_diff_thres=None, seg_warp=False, device=None,
+                    seg_quantize=None):
+        # NAFNet and the EgoHOS hand segmentor, pass them as `models` to reuse them across loaders. Both run on the
+        # first GPU unless device is the CPU. seg_quantize is the caller's quantizer (model -> INT8 model) of the CPU
+        # hand segmentor, e.g. quantization.quantize_dynamic of track.py. A NAFNet exported by export_nafnet.py
+        # (.onnx / .torchscript) runs through NAFNetRuntime instead of the BasicSR model.
+        cpu = device is not None and torch.device(device).type == 'cpu'
+        base_path = Path(__file__).parent.resolve()
+        if Path(deblur_path).suffix in ('.onnx', '.torchscript'):
+            from nafnet_runtime import NAFNetRuntime
+            nafnet = NAFNetRuntime(deblur_path, device='cpu' if cpu else 'cuda:0')
+        else:
+            nafnet = LoadImages.load_nafnet(deblur_path, cpu)
+        work_path = (base_path / "../../../../../../EgoHOS/mmsegmentation/work_dirs").resolve()
+        config_path = (work_path / "seg_twohands_ccda/seg_twohands_ccda.py").resolve()
+        checkpt_path = (work_path / "seg_twohands_ccda/best_mIoU_iter_56000.pth").resolve()
+        h = handseg.HandSegmentor(str(config_path), str(checkpt_path), seg_interval=seg_interval,
+                                  seg_diff_thres=seg_diff_thres, seg_warp=seg_warp,
+                                  device='cpu' if cpu else 'cuda:0', quantize=seg_quantize)
+        return nafnet, h
+
+    @staticmethod
+    def load_nafnet(deblur_path="", cpu=False):
+        # The BasicSR ImageRestorationModel around NAFNet
+        opt_path = (Path(__file__).parent.resolve() / '../../../../../../NAFNet/options/test/REDS/NAFNet-width64.yml').resolve()
+        opt = parse(str(opt_path), is_train=False)
+        opt['dist'] = False
+        if cpu:
+            opt['num_gpu'] = 0
+        opt['path']['pretrain_network_g'] = deblur_path
+        print(opt)
+        return create_model(opt)
+
+    def set_deblur(self, value, box=None):
+        # Request deblurring of the next frame, `box` (x1, y1, x2, y2) is the item that asked for it
         self.deblur = value
+        if not value:
+            self.deblur_boxes = []
+        elif box is not None:
+            self.deblur_boxes.append(box)
+
+    def is_sharp(self, im0):
+        """
+        Whether a frame that was asked to be deblurred is sharp enough to skip NAFNet, judged on the item boxes that
+        requested it, or on the tray ROI. Counts the requests and the frames judged sharp.
+        """
+        self.deblur_counts['requested'] += 1
+        if self.deblur_sharpness is None:
+            return False
+        h, w = im0.shape[:2]
+        regions = [(slice(max(int(y0), 0), min(int(y1), h)), slice(max(int(x0), 0), min(int(x1), w)))
+                   for x0, y0, x1, y1 in self.deblur_boxes] or [self.get_roi(im0.shape)]
+        sharp = min(sharpness(im0, r) for r in regions) >= self.deblur_sharpness
+        self.deblur_counts['sharp'] += sharp
+        return sharp
+
+    def get_roi(self, shape):
+        # Current tray box plus margin, clipped to the frame, as (row, column) slices
+        h, w = shape[:2]
+        (x0, y0), (x1, y1) = self.tray
+        m = self.roi_margin
+        return slice(max(y0 - m, 0), min(y1 + m, h)), slice(max(x0 - m, 0), min(x1 + m, w))
+
+    def deblur_frame(self, im0, roi=None):
+        # Restore a BGR frame with NAFNet, only inside `roi` when given
+        if roi is not None:
+            im0 = im0.copy()
+            im0[roi] = self.restore(np.ascontiguousarray(im0[roi]))
+            return im0
+        return self.restore(im0)
+
+    def restore(self, im):
+        # NAFNet on a BGR image, through the exported model or the BasicSR one
+        if not hasattr(self.NAFNet, 'feed_data'):
+            return self.NAFNet(im)
+        return cv2.cvtColor(self.single_image_inference(self.NAFNet, self.img2tensor(im)), cv2.COLOR_RGB2BGR)
+
+    def deblurred(self, wait=False):
+        """
+        Collect frames restored by the async deblur worker.
+        Args:
+            wait: block until every queued frame is restored, e.g. at the end of a video.
+        Return:
+            A list of (frame index, letterboxed model input, hand-masked restored frame).
+        """
+        if self.deblur_worker is None:
+            return []
+        ready = []
+        for idx, im0 in self.deblur_worker.results(wait=wait):
+            im0 = self.mask_hands(im0, self.pending.pop(idx, None))
+            ready.append((idx, self.preprocess(im0.astype('float32')), im0))
+        return ready
+
+    def mask_hands(self, im0, roi=None):
+        # Segment directly, frames restored out of order must not disturb the mask scheduler of the live stream
+        if roi is not None:
+            crop = np.ascontiguousarray(im0[roi])
+            im0[roi] = handseg.composite_hand_mask(crop, self.h.segment(crop))
+            return im0
+        return handseg.composite_hand_mask(im0, self.h.segment(im0))
+
+    def preprocess(self, im1):
+        if self.transforms:
+            return self.transforms(im1)  # transforms
+        im = LetterBox(self.imgsz, self.auto, stride=self.stride)(image=im1)
+        im = im.transpose((2, 0, 1))[::-1]  # HWC to CHW, BGR to RGB
+        return np.ascontiguousarray(im)  # contiguous
 
     def imread(self, img_path):
         img = cv2.imread(img_path)
@@ -262,26 +458,36 @@ class LoadImages:
 
     def __iter__(self):
         self.count = 0
+        self.index = 0
         return self
 
     def __next__(self):
+        if self.prefetch:
+            return self._next_prefetched()
+        batch, self.last_index, _, _ = self._next(self.deblur)
+        return batch
+
+    def _next(self, deblur_requested, keep_raw=False):
+        # Decode and preprocess one frame. Returns the batch yielded by __next__, its index, a copy of the
+        # decoded frame (keep_raw) and the ROI in use, the last three let a consumer redo the frame with deblurring.
         if self.count == self.nf:
             raise StopIteration
         path = self.files[self.count]
+        idx, raw, roi = self.index, None, None
 
         if self.video_flag[self.count]:
             # Read video
             self.mode = 'video'
-            for _ in range(self.vid_stride):
-                self.cap.grab()
-            ret_val, im0 = self.cap.retrieve()
+            with profile_stage(self.profiler, 'decode', idx):
+                for _ in range(self.vid_stride):
+                    self.cap.grab()
+                ret_val, im0 = self.cap.retrieve()
 
             # TODO: Image Preprocess to im0 Here!!! #####
             # TODO: after hand segmentation, determine if predict tray should kick in
-            # If current tray prediction is based on guesses, predict_tray must kick in
-            # Keep running predict_tray until we find a frame where hand/object is not covering the tray AND
-            # the prediction result is not a guess.
-            # Every 5 second (tentative) after, refresh the tray prediction if hand/object is not covering the tray.
+            # The tray tracker detects on every frame until the first plausible box, afterwards whenever the
+            # border of the tray changed or every 300 frames. It sees the raw frame, with the hand-masked pixels
+            # written back inside the ROI when tray_roi is set.
             def hand_on_tray(img):
                 ret = False
                 for i in range(250, 880):
@@ -289,34 +495,43 @@ class LoadImages:
                         if (img[i][j] == np.array([0, 0, 0])).all():
                             ret = True
                 return ret
-            if self.deblur and im0 is not None:
-                print("Deblurring at work")
-                inp = self.img2tensor(im0)
-                im0 = self.single_image_inference(self.NAFNet, inp)
-                im0 = cv2.cvtColor(im0, cv2.COLOR_RGB2BGR)
-                # do deblur work
-
+            if self.tray_roi and im0 is not None:
+                roi = self.get_roi(im0.shape)
+                if roi != self.roi:  # tray moved, a reused hand mask would no longer line up
+                    self.roi = roi
+                    self.h.scheduler.invalidate()
+            deblur = deblur_requested and self.deblur_worker is None
             if im0 is not None:
-                im1 = self.h.process_video_frame(im0).astype('float32')
-
-            print("first_found: ", self.first_found)
-            if not self.first_found:
-                coord1, coord2, pred = predict_tray(im0)
-                # if (not hand_on_tray(im1)) and pred:
-                if pred:  # not a guess
-                    self.first_found = True
-                self.tray = (coord1, coord2)
-            else:
-                if self.counter == 300:
-                    coord1, coord2, pred = predict_tray(im0)
-                    if pred:
-                        self.tray = (coord1, coord2)
+                roi = self.roi if self.tray_roi else None
+                raw = im0.copy() if keep_raw else None
+            with profile_stage(self.profiler, 'sharpness', idx):
+                sharp = deblur_requested and im0 is not None and self.is_sharp(im0)
+            if sharp:
+                deblur = True  # nothing to restore, the votes of the frame count as deblurred right away
+            elif deblur_requested and im0 is not None:
+                if self.deblur_worker is not None:
+                    # hand the frame over and carry on with the raw one, evidence comes back via deblurred()
+                    if self.deblur_worker.submit(idx, raw if raw is not None else im0.copy(), roi):
+                        self.pending[idx] = roi
+                        self.deblur_counts['restored'] += 1
+                else:
+                    print("Deblurring at work")
+                    with profile_stage(self.profiler, 'deblur', idx):
+                        im0 = self.deblur_frame(im0, roi)
+                    self.deblur_counts['restored'] += 1
 
-            if self.counter >= 300:
-                self.counter = 0
-            else:
-                self.counter += 1
-            print("Current tray: ", self.tray)
+            if im0 is not None:
+                with profile_stage(self.profiler, 'hand_seg', idx):
+                    if self.tray_roi:
+                        # pixels outside the ROI stay raw
+                        im0[self.roi] = self.h.process_video_frame(np.ascontiguousarray(im0[self.roi]))
+                        im1 = im0.astype('float32')
+                    else:
+                        im1 = self.h.process_video_frame(im0).astype('float32')
+
+            with profile_stage(self.profiler, 'tray', idx):
+                self.tray, found = self.tray_tracker(im0)
+            print("Current tray: ", self.tray, "" if found else "(default)")
             while not ret_val:
                 self.count += 1
                 self.cap.release()
@@ -336,19 +551,71 @@ class LoadImages:
             im0 = cv2.imread(path)  # BGR
             assert im0 is not None, f'Image Not Found {path}'
             s = f'image {self.count}/{self.nf} {path}: '
+            deblur = False
+
+        with profile_stage(self.profiler, 'letterbox', idx):
+            im = self.preprocess(im1)
+
+        self.index += 1
+        return (path, im, im0, self.cap, s, self.tray, deblur), idx, raw, roi
+
+    def _produce(self):
+        # Prefetch thread: decode and preprocess ahead of the consumer, without deblurring
+        try:
+            while True:
+                self.queue.put(self._next(False, keep_raw=True))
+        except StopIteration:
+            self.queue.put(None)
+        except Exception as e:
+            self.queue.put(e)
+
+    def _next_prefetched(self):
+        if self.producer is None:
+            self.producer = Thread(target=self._produce, daemon=True)
+            self.producer.start()
+        self.depths.append(self.queue.qsize())
+        t = time.perf_counter()
+        item = self.queue.get()
+        self.stall += time.perf_counter() - t
+        if item is None:
+            self.queue.put(None)  # keep signalling the end to later calls
+            raise StopIteration
+        if isinstance(item, Exception):
+            raise item
+        batch, idx, raw, roi = item
+        self.last_index = idx
+        with profile_stage(self.profiler, 'sharpness', idx):
+            sharp = self.deblur and raw is not None and self.is_sharp(raw)
+        if sharp:
+            batch = batch[:6] + (True,)
+        elif self.deblur and raw is not None:
+            # the frame was prepared before deblurring was requested, redo it from the decoded copy
+            if self.deblur_worker is not None:
+                if self.deblur_worker.submit(idx, raw, roi):
+                    self.pending[idx] = roi
+                    self.deblur_counts['restored'] += 1
+            else:
+                print("Deblurring at work")
+                path, _, _, cap, s, tray, _ = batch
+                with profile_stage(self.profiler, 'deblur', idx):
+                    im0 = self.mask_hands(self.deblur_frame(raw, roi), roi)
+                self.deblur_counts['restored'] += 1
+                batch = (path, self.preprocess(im0.astype('float32')), im0, cap, s, tray, True)
+        return batch
 
-        if self.transforms:
-            im = self.transforms(im1)  # transforms
-        else:
-            im = LetterBox(self.imgsz, self.auto, stride=self.stride)(image=im1)
-            im = im.transpose((2, 0, 1))[::-1]  # HWC to CHW, BGR to RGB
-            im = np.ascontiguousarray(im)  # contiguous
+    def prefetch_stats(self):
+        # Queue depth seen by the consumer and the time it spent waiting for the producer
+        return {"frames": len(self.depths),
+                "mean_depth": float(np.mean(self.depths)) if self.depths else 0.,
+                "empty": int(sum(d == 0 for d in self.depths)),
+                "stall": self.stall}
 
-        return path, im, im0, self.cap, s, self.tray, self.deblur
 
     def _new_video(self, path):
         # Create a new video capture object
         self.frame = 0
+        self.h.scheduler.reset()  # masks from the previous video must not be reused
+        self.tray_tracker.reset()  # detect the tray on the first frame, the box of the last video is only a prior
         self.cap = cv2.VideoCapture(path)
         self.frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT) / self.vid_stride)
         self.orientation = int(self.cap.get(cv2.CAP_PROP_ORIENTATION_META))  # rotation degrees
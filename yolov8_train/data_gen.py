@@ -3,127 +3,150 @@ import glob
 import math
 import os.path
 import random
+import time
+from multiprocessing import Pool
 from tqdm import tqdm
-import cv2
+import numpy as np
 from PIL import Image, ImageDraw, ImageFilter, ImageOps, ImageEnhance
 
 slash = "/"
+PRODUCTS_PER_IMAGE = 6
+FIRST_IMAGE = 100000  # name of the first generated image
 
-def IOU(boxA, boxB):
-    # Calculate the IOU ratio between two bounding boxes
-    # boxA = [top_left_x, top_left_y, bottom_right_x, bottom_right_y]
-        
-    xA = max(boxA[0], boxB[0])
-    yA = max(boxA[1], boxB[1])
-    xB = min(boxA[2], boxB[2])
-    yB = min(boxA[3], boxB[3])
+def IOU(boxA, boxes):
+    # Calculate the IOU ratio between a bounding box and each row of an (N, 4) array of boxes
+    # box = [top_left_x, top_left_y, bottom_right_x, bottom_right_y]
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+    xA = np.maximum(boxA[0], boxes[:, 0])
+    yA = np.maximum(boxA[1], boxes[:, 1])
+    xB = np.minimum(boxA[2], boxes[:, 2])
+    yB = np.minimum(boxA[3], boxes[:, 3])
 
     # intersection area with smoothing factor
-    interArea = max(0, xB - xA + 1) * max(0, yB - yA + 1)
+    interArea = np.maximum(0, xB - xA + 1) * np.maximum(0, yB - yA + 1)
 
     # union area with smoothing factor to avoid division by 0
     boxAArea = (boxA[2] - boxA[0] + 1) * (boxA[3] - boxA[1] + 1)
-    boxBArea = (boxB[2] - boxB[0] + 1) * (boxB[3] - boxB[1] + 1)
+    boxBArea = (boxes[:, 2] - boxes[:, 0] + 1) * (boxes[:, 3] - boxes[:, 1] + 1)
 
     # compute the IOU
-    iou = interArea / float(boxAArea + boxBArea - interArea)
-
-    return iou
+    return interArea / (boxAArea + boxBArea - interArea)
 
 
 def checkIOUwithList(bbx, bbx_list, iou_threshold=0.2):
     # check if the current bbx have a higher IOU with any of the pervious bbx
     if len(bbx_list) == 0:
         return True
-    for a in bbx_list:
-        if IOU(a, bbx) > iou_threshold:
-            return False
-    return True
-
-
-def main(bkg, src, target, seg):
-    images = glob.glob(src + "/*")
-    img_count = 100000
-    count = 0
-    bkg_img = Image.open(bkg)
-    
-    # randomize the order of images
-    random.shuffle(images)
+    return not (IOU(bbx, bbx_list) > iou_threshold).any()
+
+
+def init_worker(bkg, src, target, seg, images, seed, images_per_shard):
+    # The background is decoded once per process, with its four flips
+    global backgrounds, config
+    bkg_img = Image.open(bkg).convert("RGB")
+    backgrounds = [ImageOps.flip(bkg_img), ImageOps.mirror(bkg_img), ImageOps.flip(ImageOps.mirror(bkg_img)), bkg_img]
+    config = dict(src=src, target=target, seg=seg, images=images, seed=seed, images_per_shard=images_per_shard)
+
+
+def generate_shard(shard):
+    """
+    Composite the product crops of one shard, PRODUCTS_PER_IMAGE per background, and write each image with its YOLO
+    labels. The shard covers images [shard * images_per_shard, (shard + 1) * images_per_shard) and draws from its own
+    seed, so the data set does not depend on the number of processes.
+    """
+    rng = random.Random(config["seed"] + shard)
+    start = shard * config["images_per_shard"] * PRODUCTS_PER_IMAGE
+    crops = config["images"][start:start + config["images_per_shard"] * PRODUCTS_PER_IMAGE]
     iou_threshold=0.1
     num_try = 8
-    bbx_l = [] # keep a list of bounding boxes (top_left_x, top_left_y, bottom_right_x, bottom_right_y) in the curr background image
-    
-    for image_path in tqdm(images, total=len(images)):
-        label_path = seg + slash + image_path.split(slash)[-1].split(".jpg")[0] + '_seg.jpg'
-        filename = image_path.split(slash)[-1]
-        object_class = filename.split("_")[0]
-        object_class = object_class.lstrip("0")
-        
-        im = Image.open(image_path)
-        w, h = im.size
-        mask_im = Image.open(label_path)
-        
-        # Adjust brightness
-        enhancer = ImageEnhance.Brightness(im)
-        brightness_factor = random.uniform(0.9, 1.1)
-        im = enhancer.enhance(brightness_factor)
-        
-        # randomize the position of product images on the ROI of background images
-        p = random.randint(-30, 30)
-        q = random.randint(-50, 50)
-        top_left_x = 50 + (300 * count) + p
-        top_left_y = 400 + q
-        bottom_right_x = 50 + (300 * count) + p + w
-        bottom_right_y = 400 + q + h
-        
-        bbx = [top_left_x, top_left_y, bottom_right_x, bottom_right_y]
-        
-        if count == 0 or checkIOUwithList(bbx, bbx_l):
-            bbx_l.append(bbx)
-        else:
-            for i in range(num_try):
-                if checkIOUwithList(bbx, bbx_l):
-                    break
-                elif bbx[1] > 0:
-                    bbx[1] -= 30 # move the object 30 pixels up to reduce IOU as much as possible
-                    
-        # now deal with the potential outside the coords boundaries
-        while bbx[2] > 1920:
-            bbx[2] -= 5
-            bbx[0] -= 5
-            
-        while bbx[3] > 1080:
-            bbx[3] -= 5
-            bbx[1] -= 5
-                
-        bkg_img.paste(im, (bbx[0], bbx[1]), mask_im) # top left corner (x, y)
-        with open(target + slash + "labels" + slash + str(img_count) + ".txt", "a") as f:
+    n_images = 0
+
+    for first in range(0, len(crops), PRODUCTS_PER_IMAGE):
+        img_count = FIRST_IMAGE + start // PRODUCTS_PER_IMAGE + n_images
+        # flip the background image horizontally, vertically, in both ways or not at random to increase diversity
+        bkg_img = backgrounds[rng.randint(0, 3)].copy()
+        bbx_l = [] # keep a list of bounding boxes (top_left_x, top_left_y, bottom_right_x, bottom_right_y) in the curr background image
+        lines = []
+
+        for count, image_path in enumerate(crops[first:first + PRODUCTS_PER_IMAGE]):
+            label_path = config["seg"] + slash + image_path.split(slash)[-1].split(".jpg")[0] + '_seg.jpg'
+            filename = image_path.split(slash)[-1]
+            object_class = filename.split("_")[0]
+            object_class = object_class.lstrip("0")
+
+            im = Image.open(image_path)
+            w, h = im.size
+            mask_im = Image.open(label_path)
+
+            # Adjust brightness
+            enhancer = ImageEnhance.Brightness(im)
+            brightness_factor = rng.uniform(0.9, 1.1)
+            im = enhancer.enhance(brightness_factor)
+
+            # randomize the position of product images on the ROI of background images
+            p = rng.randint(-30, 30)
+            q = rng.randint(-50, 50)
+            top_left_x = 50 + (300 * count) + p
+            top_left_y = 400 + q
+            bottom_right_x = 50 + (300 * count) + p + w
+            bottom_right_y = 400 + q + h
+
+            bbx = [top_left_x, top_left_y, bottom_right_x, bottom_right_y]
+
+            if count == 0 or checkIOUwithList(bbx, bbx_l):
+                bbx_l.append(bbx)
+            else:
+                for i in range(num_try):
+                    if checkIOUwithList(bbx, bbx_l):
+                        break
+                    elif bbx[1] > 0:
+                        bbx[1] -= 30 # move the object 30 pixels up to reduce IOU as much as possible
+
+            # now deal with the potential outside the coords boundaries, in steps of 5 pixels
+            if bbx[2] > 1920:
+                shift = math.ceil((bbx[2] - 1920) / 5) * 5
+                bbx[2] -= shift
+                bbx[0] -= shift
+
+            if bbx[3] > 1080:
+                shift = math.ceil((bbx[3] - 1080) / 5) * 5
+                bbx[3] -= shift
+                bbx[1] -= shift
+
+            bkg_img.paste(im, (bbx[0], bbx[1]), mask_im) # top left corner (x, y)
             x = (bbx[0] + (w / 2.0)) / 1920.0 # center (x, y)
             y = (bbx[1] + (h / 2.0)) / 1080.0
             width = w / 1920.0
             height = h / 1080.0
-            s = "{} {} {} {} {}\n".format(int(object_class)-1, x, y, width, height)
-            f.write(s)
-            
-        count += 1
-        if count >= 6:
-            bbx_l = []
-            bkg_img.save(target + slash + "images" + slash + str(img_count) + ".jpg", quality=95)
-            img_count += 1
-            count = 0
-            bkg_img = Image.open(bkg)
-            
-            # flip the background image horizontally, vertically, or in both ways at random to increase diversity
-            r = random.randint(0, 3) 
-            if r == 0:
-                bkg_img = ImageOps.flip(bkg_img)
-            elif r == 1:
-                bkg_img = ImageOps.mirror(bkg_img)  
-            elif r == 2:
-                bkg_img = ImageOps.flip(ImageOps.mirror(bkg_img))
-
-    if count > 0:
-        bkg_img.save(target + slash + "images" + slash + str(img_count) + ".jpg", quality=95)
+            lines.append("{} {} {} {} {}\n".format(int(object_class)-1, x, y, width, height))
+
+        bkg_img.save(config["target"] + slash + "images" + slash + str(img_count) + ".jpg", quality=95)
+        with open(config["target"] + slash + "labels" + slash + str(img_count) + ".txt", "w") as f:
+            f.writelines(lines)
+        n_images += 1
+
+    return n_images, len(crops)
+
+
+def main(bkg, src, target, seg, workers=None, seed=0, images_per_shard=50):
+    images = sorted(glob.glob(src + "/*"))
+    os.makedirs(target + slash + "images", exist_ok=True)
+    os.makedirs(target + slash + "labels", exist_ok=True)
+
+    # randomize the order of images
+    random.Random(seed).shuffle(images)
+    n_shards = math.ceil(len(images) / (images_per_shard * PRODUCTS_PER_IMAGE))
+
+    t = time.time()
+    n_images = n_crops = 0
+    with Pool(workers, init_worker, (bkg, src, target, seg, images, seed, images_per_shard)) as pool:
+        for shard_images, shard_crops in tqdm(pool.imap_unordered(generate_shard, range(n_shards)), total=n_shards):
+            n_images += shard_images
+            n_crops += shard_crops
+    t = time.time() - t
+    print("{} images from {} product crops in {:.1f}s, {:.1f} images/sec".format(
+        n_images, n_crops, t, n_images / max(t, 1e-9)))
 
 
 if __name__ == "__main__":
@@ -133,5 +156,9 @@ if __name__ == "__main__":
     parser.add_argument("--target_dir", required=True, help="Directory for saving background replaced files.")
     parser.add_argument("--segmentation_dir", required=True,
                         help="Directory where segmentation label images are stored.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of generator processes.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the crop order, shard i draws from seed + i.")
+    parser.add_argument("--images_per_shard", type=int, default=50, help="Generated images per shard.")
     args = parser.parse_args()
-    main(args.background_dir, args.source_dir, args.target_dir, args.segmentation_dir)
+    main(args.background_dir, args.source_dir, args.target_dir, args.segmentation_dir,
+         args.workers, args.seed, args.images_per_shard)